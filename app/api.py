@@ -1,26 +1,44 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, UploadFile, File, Query
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, UploadFile, File, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Index, UniqueConstraint, and_, bindparam, delete, insert, select, func, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, relationship, selectinload
+from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel
-from app.predict import predict
+from typing import List, Optional
+from app.archive import load_archived, restore_chat
+from app.predict import RETRIEVAL_MIN_SCORE, match_batch, predict_batch, registry
+from app.scheduler import InferenceScheduler, QueueFullError
+from app.cache import TTLCache
+from app.database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine, get_async_db, get_db
+from app.hashing import HasherBusyError, PasswordHasher
+from app.jobs import TERMINAL_STATUSES, JobQueue, JobQueueFullError
+from app.maintenance import MaintenanceRunner, default_tasks
+from app.metrics import PREDICT_SECONDS, PREDICT_TEXTS, WEBSOCKET_MESSAGE_SECONDS, WEBSOCKET_SHED, MetricsMiddleware, instrument_engine, metrics, timed
+from app.migrate import add_missing_columns, create_missing_indexes, migrate_chat_messages, migrate_search_queries
+from app.pubsub import ConnectionManager, get_broker
+from app.ratelimit import RateLimiter
+from app.search import get_search_backend
+from app.storage import (
+    MAX_UPLOAD_BYTES, UPLOAD_DIR, UploadTooLargeError, blob_path, commit_blob_file, derived_paths, discard,
+    ensure_dirs, file_extension, make_thumbnails, remove_files, stream_to_temp, thumbnail_executor, upload_url, write_temp,
+)
+from collections import Counter
 import os
 import json
-import shutil
-import requests
-from openai import OpenAI
+import asyncio
+import base64
+import importlib
+import logging
+import time
 
-# Database setup
-DATABASE_URL = "sqlite:///./kaisang.db"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+logger = logging.getLogger(__name__)
 
 # Models
 class User(Base):
@@ -46,16 +64,33 @@ class Project(Base):
     user = relationship("User", back_populates="projects")
     chats = relationship("Chat", back_populates="project")
     images = relationship("Image", back_populates="project")
+    __table_args__ = (Index("ix_projects_user_created", "user_id", "created_at", "id"),)
 
 class Chat(Base):
     __tablename__ = "chats"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
-    messages = Column(JSON, default=list)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Set while the chat's messages live in a cold-storage segment (see ChatArchive)
+    archived_at = Column(DateTime, nullable=True)
+    restored_at = Column(DateTime, nullable=True)
     user = relationship("User", back_populates="chats")
     project = relationship("Project", back_populates="chats")
+    messages = relationship("Message", back_populates="chat", order_by="Message.seq", passive_deletes=True)
+    __table_args__ = (Index("ix_chats_user_created", "user_id", "created_at", "id"),)
+
+class Message(Base):
+    __tablename__ = "messages"
+    id = Column(Integer, primary_key=True, index=True)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    seq = Column(Integer, nullable=False)
+    role = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    chat = relationship("Chat", back_populates="messages")
+    # Also serves as the (chat_id, seq) index for history pagination
+    __table_args__ = (UniqueConstraint("chat_id", "seq", name="uq_messages_chat_seq"),)
 
 class Image(Base):
     __tablename__ = "images"
@@ -63,60 +98,136 @@ class Image(Base):
     filename = Column(String)
     path = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
-    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True)
+    project_id = Column(Integer, ForeignKey("projects.id"), nullable=True, index=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True)
     user = relationship("User", back_populates="images")
     project = relationship("Project", back_populates="images")
+    __table_args__ = (Index("ix_images_user_uploaded", "user_id", "uploaded_at", "id"),)
+
+# Where an archived chat's messages sit in app/archive.py's segments, plus what listings show for it
+class ChatArchive(Base):
+    __tablename__ = "chat_archives"
+    chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
+    segment = Column(String, nullable=False, index=True)
+    byte_offset = Column(Integer, nullable=False)
+    byte_length = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    last_seq = Column(Integer, nullable=False)
+    last_role = Column(String)
+    last_preview = Column(Text)
+    last_timestamp = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+# Content-addressed upload storage; images sharing bytes share one blob
+class Blob(Base):
+    __tablename__ = "blobs"
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    content_type = Column(String)
+    ref_count = Column(Integer, nullable=False, default=0)
+    thumbnail_path = Column(String)
+    preview_path = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class SearchQuery(Base):
     __tablename__ = "search_queries"
     id = Column(Integer, primary_key=True, index=True)
     query = Column(String)
     user_id = Column(Integer, ForeignKey("users.id"))
-    results = Column(JSON)
+    filters = Column(JSON)
+    hit_count = Column(Integer, default=0)
+    result_ids = Column(JSON, default=list)
     timestamp = Column(DateTime, default=datetime.utcnow)
     user = relationship("User", back_populates="search_queries")
+    __table_args__ = (Index("ix_search_queries_user_id_id", "user_id", "id"),)
 
-Base.metadata.create_all(bind=engine)
+# Last known state of each image job, so a poll can be answered by any worker (the one running it
+# keeps the live copy in image_jobs)
+class ImageJob(Base):
+    __tablename__ = "image_jobs"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    status = Column(String, nullable=False)
+    stage = Column(String)
+    attempts = Column(Integer, default=0)
+    result = Column(JSON)
+    error = Column(Text)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime, index=True)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+search_backend = None
+
+def init_db():
+    # Creates and migrates the schema; run by the startup hook and `python -m app.migrate`
+    global search_backend
+    Base.metadata.create_all(bind=engine)
+    migrate_chat_messages(engine)
+    migrate_search_queries(engine)
+    add_missing_columns(engine, Base.metadata)
+    create_missing_indexes(engine, Base.metadata)
+    search_backend = get_search_backend(engine)
+
+instrument_engine(engine)
+instrument_engine(async_engine)
 
 # Auth setup
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def verify_password(plain_password, hashed_password):
-    # Truncate to 72 bytes (not characters) to match bcrypt's limit
-    truncated_password = plain_password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-    return pwd_context.verify(truncated_password, hashed_password)
+# bcrypt runs on a dedicated process pool; excess requests get a fast 503
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("HASH_POOL_WORKERS", str(min(2, os.cpu_count() or 1)))),
+    max_pending=int(os.getenv("HASH_POOL_MAX_PENDING", "32")),
+    timeout=float(os.getenv("HASH_POOL_TIMEOUT", "10")),
+)
 
-def get_password_hash(password):
-    # Truncate to 72 bytes (not characters) to comply with bcrypt limit
-    truncated_password = password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
-    return pwd_context.hash(truncated_password)
+async def run_password_op(op, *args):
+    try:
+        return await op(*args)
+    except HasherBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
+    # python-jose is imported on first use (or by the startup warm-up), like the other slow imports
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(User).filter(User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: Session, username: str, password: str):
+    user = await run_in_threadpool(db.query(User).filter(User.username == username).first)
+    if not user or not await run_password_op(password_hasher.verify, password, user.hashed_password):
         return False
     return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Verified token -> detached User, so authenticated calls skip the JWT decode and user SELECT
+principal_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "300")),
+)
+
+def evict_principal(user_id):
+    principal_cache.invalidate(lambda key, user: user.id == user_id)
+
+def invalidate_principal(user_id):
+    # Other workers evict their copies when the event reaches them (see chat_connections)
+    evict_principal(user_id)
+    chat_connections.notify(AUTH_INVALIDATION_CHANNEL, {"user_id": user_id})
+
+def resolve_token(token: str, db: Session):
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+    from jose import JWTError, jwt
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -127,8 +238,22 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     user = db.query(User).filter(User.username == username).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
+    db.expunge(user)
+    # Never outlive the token itself
+    principal_cache.set(token, user, ttl=min(principal_cache.ttl, payload["exp"] - time.time()))
     return user
 
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return resolve_token(token, db)
+
+# Operators allowed to use server-wide endpoints; nobody is by default
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+def get_admin_user(current_user: User = Depends(get_current_user)):
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 # Pydantic models
 class UserCreate(BaseModel):
     username: str
@@ -159,6 +284,8 @@ class SearchRequest(BaseModel):
     date_from: str = None
     date_to: str = None
     chat_id: int = None
+    limit: int = 20
+    offset: int = 0
 
 class Settings(BaseModel):
     theme: str = "light"
@@ -171,6 +298,10 @@ class ImageGenerate(BaseModel):
 # App
 app = FastAPI(title="Kaisang AI")
 
+@app.on_event("startup")
+def create_schema():
+    init_db()
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -180,104 +311,452 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Inference scheduler shared by /predict and the chat WebSocket
+observed_predict_batch = timed(predict_batch, PREDICT_SECONDS, PREDICT_TEXTS)
+inference_scheduler = InferenceScheduler(
+    observed_predict_batch,
+    max_batch_size=int(os.getenv("INFERENCE_MAX_BATCH", "32")),
+    max_wait_ms=float(os.getenv("INFERENCE_MAX_WAIT_MS", "5")),
+    max_queue=int(os.getenv("INFERENCE_MAX_QUEUE", "1024")),
+    threads=int(os.getenv("INFERENCE_THREADS", "1")),
+)
+
+@app.on_event("startup")
+async def start_inference_scheduler():
+    inference_scheduler.ensure_started()
+
+@app.on_event("shutdown")
+async def stop_inference_scheduler():
+    await inference_scheduler.stop()
+
+@app.on_event("shutdown")
+def stop_password_hasher():
+    password_hasher.shutdown()
+
+# Poll model artifacts and hot-swap the bundle when they change (0 disables)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "0"))
+
+async def watch_model_files():
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        try:
+            await run_in_threadpool(registry.reload_if_changed)
+        except Exception as e:
+            logger.warning("Model reload failed: %s", e)
+
+@app.on_event("startup")
+async def start_model_watcher():
+    if MODEL_WATCH_INTERVAL > 0:
+        asyncio.get_running_loop().create_task(watch_model_files())
+
+# Heavy imports (sklearn, passlib, openai) and the model load run after startup, off the
+# request path; /ready answers 503 until they are done
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true"
+warm_up_state = {"done": False, "components": {}}
+
+async def warm_up_component(name, step):
+    started = time.perf_counter()
+    try:
+        await step()
+        warm_up_state["components"][name] = {"ready": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    except Exception as e:
+        logger.warning("Warm-up of %s failed: %s", name, e)
+        warm_up_state["components"][name] = {"ready": False, "error": str(e)}
+
+async def warm_up():
+    await asyncio.gather(
+        warm_up_component("model", lambda: run_in_threadpool(lambda: registry.bundle)),
+        warm_up_component("password_hashing", password_hasher.warm_up),
+        warm_up_component("auth", lambda: run_in_threadpool(importlib.import_module, "jose.jwt")),
+        warm_up_component("image_generation", lambda: run_in_threadpool(load_image_generation)),
+    )
+    warm_up_state["done"] = True
+
+@app.on_event("startup")
+async def start_warm_up():
+    if WARM_UP_ON_STARTUP:
+        asyncio.get_running_loop().create_task(warm_up())
+    else:
+        warm_up_state["done"] = True
+
+@app.get("/ready")
+def get_readiness():
+    ready = warm_up_state["done"] and all(c["ready"] for c in warm_up_state["components"].values())
+    body = {"ready": ready, **warm_up_state}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+ensure_dirs()
+app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 # Auth endpoints
 @app.post("/auth/register", response_model=Token)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.username == user.username).first():
-        raise HTTPException(status_code=400, detail="Username taken")
-    if db.query(User).filter(User.email == user.email).first():
-        raise HTTPException(status_code=400, detail="Email taken")
-    hashed = get_password_hash(user.password)
-    db_user = User(username=user.username, email=user.email, hashed_password=hashed)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    def check_taken():
+        if db.query(User).filter(User.username == user.username).first():
+            raise HTTPException(status_code=400, detail="Username taken")
+        if db.query(User).filter(User.email == user.email).first():
+            raise HTTPException(status_code=400, detail="Email taken")
+
+    def save(hashed):
+        db_user = User(username=user.username, email=user.email, hashed_password=hashed)
+        db.add(db_user)
+        db.commit()
+
+    await run_in_threadpool(check_taken)
+    hashed = await run_password_op(password_hasher.hash, user.password)
+    await run_in_threadpool(save, hashed)
     token = create_access_token({"sub": user.username})
     return {"access_token": token, "token_type": "bearer"}
 
 @app.post("/auth/login", response_model=Token)
-def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form.username, form.password)
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await authenticate_user(db, form.username, form.password)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({"sub": user.username})
     return {"access_token": token, "token_type": "bearer"}
 
+# Per-user search results, dropped whenever that user's chats change
+search_cache = TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "300")),
+)
+
+def invalidate_search_cache(user_id):
+    search_cache.invalidate(lambda key, value: key[0] == user_id)
+
+# Keyset pagination for list endpoints: newest first, cursor = (timestamp, id) of the last row
+LIST_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 200
+PREVIEW_LENGTH = 100
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_page(statement, timestamp_column, id_column, cursor, limit):
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        statement = statement.where(tuple_(timestamp_column, id_column) < tuple_(timestamp, row_id))
+    return statement.order_by(timestamp_column.desc(), id_column.desc()).limit(limit + 1)
+
+def page_response(rows, limit, timestamp_attr, serialize):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(getattr(rows[-1], timestamp_attr), rows[-1].id) if has_more else None
+    return {"items": [serialize(row) for row in rows], "next_cursor": next_cursor}
+
+def clamp_limit(limit):
+    return max(1, min(limit, LIST_MAX_PAGE_SIZE))
+
 # Chat endpoints
+CHAT_HISTORY_PAGE_SIZE = 100
+CHAT_HISTORY_MAX_PAGE_SIZE = 500
+
+def serialize_message(message):
+    return {"seq": message.seq, "role": message.role, "content": message.content, "timestamp": message.timestamp.isoformat()}
+
+def serialize_chat(chat, messages):
+    return {
+        "id": chat.id,
+        "user_id": chat.user_id,
+        "project_id": chat.project_id,
+        "created_at": chat.created_at,
+        "messages": [serialize_message(m) for m in messages],
+    }
+
+def next_message_seq(chat_id):
+    # Evaluated inside the INSERT, so concurrent writers on one chat never reuse a seq
+    return select(func.coalesce(func.max(Message.seq), 0) + 1).where(Message.chat_id == chat_id).scalar_subquery()
+
+async def chat_summaries(db, chat_ids):
+    # Message count and latest message for a page of chats in one query
+    if not chat_ids:
+        return {}
+    stats = (
+        select(Message.chat_id, func.count().label("message_count"), func.max(Message.seq).label("last_seq"))
+        .where(Message.chat_id.in_(chat_ids))
+        .group_by(Message.chat_id)
+        .subquery()
+    )
+    rows = await db.execute(
+        select(stats.c.chat_id, stats.c.message_count, Message.role, Message.content, Message.timestamp)
+        .join(Message, and_(Message.chat_id == stats.c.chat_id, Message.seq == stats.c.last_seq))
+    )
+    return {
+        chat_id: {
+            "message_count": count,
+            "last_message": {"role": role, "content": content[:PREVIEW_LENGTH], "timestamp": timestamp.isoformat()},
+            "updated_at": timestamp,
+        }
+        for chat_id, count, role, content, timestamp in rows
+    }
+
+async def archived_summaries(db, chat_ids):
+    if not chat_ids:
+        return {}
+    rows = await db.scalars(select(ChatArchive).where(ChatArchive.chat_id.in_(chat_ids)))
+    return {
+        row.chat_id: {
+            "message_count": row.message_count,
+            "last_message": {"role": row.last_role, "content": row.last_preview, "timestamp": row.last_timestamp.isoformat()},
+            "updated_at": row.last_timestamp,
+        }
+        for row in rows
+    }
+
 @app.get("/chats")
-def get_chats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(Chat).filter(Chat.user_id == current_user.id).all()
+async def get_chats(cursor: str = None, limit: int = LIST_PAGE_SIZE, full: bool = False, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    limit = clamp_limit(limit)
+    if full:
+        statement = select(Chat).options(selectinload(Chat.messages)).where(Chat.user_id == current_user.id)
+        chats = (await db.scalars(keyset_page(statement, Chat.created_at, Chat.id, cursor, limit))).all()
+        # Archived chats are read from their segments, not restored, just for being listed
+        archived = await run_in_threadpool(load_archived, engine, [chat.id for chat in chats[:limit] if chat.archived_at])
+        return page_response(chats, limit, "created_at", lambda chat: serialize_chat(chat, chat.messages) if chat.id not in archived else {
+            **serialize_chat(chat, []), "messages": archived[chat.id],
+        })
+    statement = select(Chat.id, Chat.project_id, Chat.created_at, Chat.archived_at).where(Chat.user_id == current_user.id)
+    chats = (await db.execute(keyset_page(statement, Chat.created_at, Chat.id, cursor, limit))).all()
+    summaries = await chat_summaries(db, [chat.id for chat in chats[:limit]])
+    summaries.update(await archived_summaries(db, [chat.id for chat in chats[:limit] if chat.archived_at]))
+    empty = {"message_count": 0, "last_message": None, "updated_at": None}
+    return page_response(chats, limit, "created_at", lambda chat: {**chat._asdict(), **summaries.get(chat.id, empty)})
 
 @app.post("/chats")
 def create_chat(chat: ChatCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db_chat = Chat(user_id=current_user.id, project_id=chat.project_id, messages=[])
+    db_chat = Chat(user_id=current_user.id, project_id=chat.project_id)
     db.add(db_chat)
     db.commit()
     db.refresh(db_chat)
-    return db_chat
+    invalidate_search_cache(current_user.id)
+    return serialize_chat(db_chat, [])
 
 @app.get("/chats/{chat_id}")
-def get_chat(chat_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == current_user.id).first()
+async def get_chat(chat_id: int, before: int = None, limit: int = CHAT_HISTORY_PAGE_SIZE, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    chat = await db.scalar(select(Chat).where(Chat.id == chat_id, Chat.user_id == current_user.id))
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    return chat
+    if chat.archived_at:
+        await run_in_threadpool(restore_chat, engine, chat.id)
+        # A fresh read transaction, so the restored messages are visible
+        await db.commit()
+    limit = max(1, min(limit, CHAT_HISTORY_MAX_PAGE_SIZE))
+    # Newest page first; `before` is the seq cursor returned by the previous page
+    query = select(Message).where(Message.chat_id == chat_id)
+    if before is not None:
+        query = query.where(Message.seq < before)
+    page = (await db.scalars(query.order_by(Message.seq.desc()).limit(limit + 1))).all()
+    has_more = len(page) > limit
+    messages = list(reversed(page[:limit]))
+    result = serialize_chat(chat, messages)
+    result["next_cursor"] = messages[0].seq if has_more else None
+    return result
+
+def delete_chat_rows(db, chat_ids):
+    # Messages and cold-storage entries of the chats (a list or a select of ids); the chats themselves are left to the caller
+    db.execute(delete(ChatArchive).where(ChatArchive.chat_id.in_(chat_ids)).execution_options(synchronize_session=False))
+    db.execute(delete(Message).where(Message.chat_id.in_(chat_ids)).execution_options(synchronize_session=False))
 
 @app.delete("/chats/{chat_id}")
 def delete_chat(chat_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == current_user.id).first()
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
+    delete_chat_rows(db, [chat.id])
     db.delete(chat)
     db.commit()
+    invalidate_search_cache(current_user.id)
     return {"message": "Deleted"}
 
+# Live fan-out of chat turns to every socket open on the same chat, across workers when
+# CHAT_PUBSUB_BACKEND=sqlite points them all at one CHAT_PUBSUB_PATH
+CHAT_PUBSUB_BACKEND = os.getenv("CHAT_PUBSUB_BACKEND", "memory")
+CHAT_PUBSUB_PATH = os.getenv("CHAT_PUBSUB_PATH", "./kaisang_pubsub.db")
+CHAT_PUBSUB_POLL_MS = float(os.getenv("CHAT_PUBSUB_POLL_MS", "20"))
+CHAT_PUBSUB_MAX_PENDING = int(os.getenv("CHAT_PUBSUB_MAX_PENDING", "256"))
+
+chat_connections = ConnectionManager(
+    get_broker(CHAT_PUBSUB_BACKEND, CHAT_PUBSUB_PATH, CHAT_PUBSUB_POLL_MS / 1000),
+    max_pending=CHAT_PUBSUB_MAX_PENDING,
+)
+
+# The same bus carries auth cache invalidations, so an updated or deleted account stops
+# authenticating on every worker within one poll instead of after AUTH_CACHE_TTL
+AUTH_INVALIDATION_CHANNEL = "auth:invalidate"
+chat_connections.listen(AUTH_INVALIDATION_CHANNEL, lambda message: evict_principal(message["user_id"]))
+
+@app.on_event("startup")
+async def start_chat_connections():
+    await chat_connections.start()
+
+@app.on_event("shutdown")
+async def stop_chat_connections():
+    await chat_connections.stop()
+
+# Chat socket limits: a few queued messages per connection and a token bucket per user. Anything
+# over the limits gets an immediate busy frame. Sockets that send nothing (not even a heartbeat
+# pong) for CHAT_WS_IDLE_TIMEOUT seconds are closed, releasing their DB session
+CHAT_WS_MAX_PENDING = int(os.getenv("CHAT_WS_MAX_PENDING", "4"))
+CHAT_WS_RATE = float(os.getenv("CHAT_WS_RATE", "2"))
+CHAT_WS_BURST = int(os.getenv("CHAT_WS_BURST", "5"))
+CHAT_WS_MAX_MESSAGE_CHARS = int(os.getenv("CHAT_WS_MAX_MESSAGE_CHARS", "4000"))
+CHAT_WS_HEARTBEAT_INTERVAL = float(os.getenv("CHAT_WS_HEARTBEAT_INTERVAL", "30"))
+CHAT_WS_IDLE_TIMEOUT = float(os.getenv("CHAT_WS_IDLE_TIMEOUT", "90"))
+HEARTBEAT_PING = json.dumps({"type": "ping"})
+
+chat_rate_limiter = RateLimiter(CHAT_WS_RATE, CHAT_WS_BURST)
+
+def is_pong(data):
+    if not data.startswith("{"):
+        return False
+    try:
+        return json.loads(data).get("type") == "pong"
+    except (ValueError, AttributeError):
+        return False
+
+async def shed(websocket, reason, content, retry_after=None):
+    WEBSOCKET_SHED.inc(reason=reason)
+    frame = {"role": "system", "content": content, "busy": True, "reason": reason}
+    if retry_after is not None:
+        frame["retry_after"] = round(retry_after, 2)
+    await websocket.send_text(json.dumps(frame))
+
 # WebSocket for chat
 @app.websocket("/ws/chat/{chat_id}")
-async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(None), db: Session = Depends(get_db)):
+async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(None), db: AsyncSession = Depends(get_async_db)):
     await websocket.accept()
     # Authenticate user
     if not token:
         await websocket.close(code=1008)
         return
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if not username:
-            await websocket.close(code=1008)
-            return
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            await websocket.close(code=1008)
-            return
-    except JWTError:
+        user = await db.run_sync(lambda session: resolve_token(token, session))
+    except HTTPException:
         await websocket.close(code=1008)
         return
 
-    chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user.id).first()
+    chat = await db.scalar(select(Chat).where(Chat.id == chat_id, Chat.user_id == user.id))
     if not chat:
         await websocket.close(code=1008)
         return
-    try:
+    if chat.archived_at:
+        await run_in_threadpool(restore_chat, engine, chat.id)
+    # End the lookup transaction so idle listeners don't each pin a pooled connection
+    await db.commit()
+    channel = f"chat:{chat.id}"
+    subscriber = await chat_connections.subscribe(channel, websocket)
+    inbound = asyncio.Queue(maxsize=CHAT_WS_MAX_PENDING)
+
+    async def receive_frames():
+        # Admission happens here, so a flood is answered at once instead of queuing behind inference
         while True:
-            data = await websocket.receive_text()
-            response = predict(data)
-            message_user = {"role": "user", "content": data, "timestamp": str(datetime.utcnow())}
-            message_ai = {"role": "ai", "content": response, "timestamp": str(datetime.utcnow())}
-            chat.messages.append(message_user)
-            chat.messages.append(message_ai)
-            db.commit()
-            await websocket.send_text(json.dumps(message_ai))
+            try:
+                data = await asyncio.wait_for(websocket.receive_text(), CHAT_WS_IDLE_TIMEOUT or None)
+            except asyncio.TimeoutError:
+                logger.info("Closing idle chat socket for user %s on chat %s", user.id, chat.id)
+                await websocket.close(code=1001)
+                return
+            if is_pong(data):
+                continue
+            if len(data) > CHAT_WS_MAX_MESSAGE_CHARS:
+                await shed(websocket, "too_large", f"Message exceeds {CHAT_WS_MAX_MESSAGE_CHARS} characters")
+                continue
+            wait = chat_rate_limiter.acquire(user.id)
+            if wait:
+                await shed(websocket, "rate_limited", "Too many messages, please slow down", wait)
+                continue
+            try:
+                inbound.put_nowait((data, time.perf_counter()))
+            except asyncio.QueueFull:
+                await shed(websocket, "queue_full", "Server busy, please retry")
+
+    async def process_messages():
+        while True:
+            item = await inbound.get()
+            if item is None:
+                return
+            data, started = item
+            try:
+                response = await inference_scheduler.submit(data)
+            except QueueFullError:
+                await shed(websocket, "inference_busy", "Server busy, please retry")
+                continue
+            received_at = datetime.utcnow()
+            replied_at = datetime.utcnow()
+            # Append-only: one two-row insert per turn
+            db.add_all([
+                Message(chat_id=chat.id, seq=next_message_seq(chat.id), role="user", content=data, timestamp=received_at),
+                Message(chat_id=chat.id, seq=next_message_seq(chat.id), role="ai", content=response, timestamp=replied_at),
+            ])
+            await db.commit()
+            invalidate_search_cache(user.id)
+            message_user = {"role": "user", "content": data, "timestamp": str(received_at)}
+            message_ai = {"role": "ai", "content": response, "timestamp": str(replied_at)}
+            frame_ai = json.dumps(message_ai)
+            await websocket.send_text(frame_ai)
+            # The sender already shows its own message; other sockets on the chat get both
+            await chat_connections.publish(channel, [json.dumps(message_user), frame_ai], origin=subscriber)
+            WEBSOCKET_MESSAGE_SECONDS.observe(time.perf_counter() - started, route="/ws/chat/{chat_id}")
+
+    async def send_heartbeats():
+        while True:
+            await asyncio.sleep(CHAT_WS_HEARTBEAT_INTERVAL)
+            await websocket.send_text(HEARTBEAT_PING)
+
+    reader = asyncio.create_task(receive_frames())
+    worker = asyncio.create_task(process_messages())
+    tasks = [reader, worker]
+    if CHAT_WS_HEARTBEAT_INTERVAL > 0:
+        tasks.append(asyncio.create_task(send_heartbeats()))
+    try:
+        await asyncio.wait([reader, worker], return_when=asyncio.FIRST_COMPLETED)
+        if worker.done():
+            worker.result()
+        else:
+            # The client is gone: let the turn in progress commit and drop the rest
+            while not inbound.empty():
+                inbound.get_nowait()
+            inbound.put_nowait(None)
+            await asyncio.gather(worker, return_exceptions=True)
+            reader.result()
     except WebSocketDisconnect:
         pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await chat_connections.unsubscribe(subscriber)
 
 # Projects endpoints
 @app.get("/projects")
-def get_projects(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(Project).filter(Project.user_id == current_user.id).all()
+async def get_projects(cursor: str = None, limit: int = LIST_PAGE_SIZE, full: bool = False, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    limit = clamp_limit(limit)
+    if full:
+        statement = select(Project).where(Project.user_id == current_user.id)
+        projects = (await db.scalars(keyset_page(statement, Project.created_at, Project.id, cursor, limit))).all()
+        return page_response(projects, limit, "created_at", lambda project: project)
+    statement = select(Project.id, Project.name, Project.description, Project.created_at).where(Project.user_id == current_user.id)
+    projects = (await db.execute(keyset_page(statement, Project.created_at, Project.id, cursor, limit))).all()
+    project_ids = [project.id for project in projects[:limit]]
+    chat_counts = dict((await db.execute(
+        select(Chat.project_id, func.count()).where(Chat.project_id.in_(project_ids)).group_by(Chat.project_id)
+    )).all())
+    image_counts = dict((await db.execute(
+        select(Image.project_id, func.count()).where(Image.project_id.in_(project_ids)).group_by(Image.project_id)
+    )).all())
+    return page_response(projects, limit, "created_at", lambda project: {
+        **project._asdict(),
+        "chat_count": chat_counts.get(project.id, 0),
+        "image_count": image_counts.get(project.id, 0),
+    })
 
 @app.post("/projects")
 def create_project(project: ProjectCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -316,122 +795,452 @@ def delete_project(project_id: int, current_user: User = Depends(get_current_use
     return {"message": "Deleted"}
 
 # Images endpoints
+def serialize_image(image, blob=None):
+    return {
+        "id": image.id,
+        "filename": image.filename,
+        "path": image.path,
+        "url": upload_url(image.path),
+        "thumbnail_url": upload_url(blob.thumbnail_path) if blob else None,
+        "preview_url": upload_url(blob.preview_path) if blob else None,
+        "user_id": image.user_id,
+        "project_id": image.project_id,
+        "uploaded_at": image.uploaded_at,
+    }
+
+def build_thumbnails(sha256, path):
+    # Runs on the thumbnail pool after the upload has been committed
+    try:
+        paths = make_thumbnails(sha256, path)
+    except Exception as e:
+        logger.info("No thumbnails for blob %s: %s", sha256, e)
+        return
+    db = SessionLocal()
+    try:
+        if not db.query(Blob).filter(Blob.sha256 == sha256).update(paths, synchronize_session=False):
+            # Blob was deleted while we were rendering
+            remove_files(*paths.values())
+        db.commit()
+    finally:
+        db.close()
+
+def store_image(db, current_user, tmp_path, sha256, size, filename, content_type, project_id):
+    # Reference an existing blob or move the temp file into place as a new one
+    path = blob_path(sha256, file_extension(filename))
+    created = False
+    try:
+        while True:
+            if db.query(Blob).filter(Blob.sha256 == sha256).update({Blob.ref_count: Blob.ref_count + 1}, synchronize_session=False):
+                break
+            db.add(Blob(sha256=sha256, path=path, size=size, content_type=content_type, ref_count=1))
+            try:
+                db.flush()
+            except IntegrityError:
+                # A concurrent upload of the same bytes won; reference its blob instead
+                db.rollback()
+                continue
+            commit_blob_file(tmp_path, path)
+            created = True
+            break
+        blob = db.get(Blob, sha256)
+        db_image = Image(filename=filename, path=blob.path, sha256=sha256, user_id=current_user.id, project_id=project_id)
+        db.add(db_image)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        if created:
+            discard(path)
+        raise
+    finally:
+        discard(tmp_path)
+    db.refresh(db_image)
+    if created:
+        thumbnail_executor.submit(build_thumbnails, sha256, blob.path)
+    return serialize_image(db_image, blob)
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Reject oversized uploads before the multipart body is spooled to disk
+    if request.url.path == "/images/upload":
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + 64 * 1024:
+            return Response(status_code=413, content=json.dumps({"detail": "Upload too large"}), media_type="application/json")
+    return await call_next(request)
+
 @app.get("/images")
-def get_images(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(Image).filter(Image.user_id == current_user.id).all()
+async def get_images(cursor: str = None, limit: int = LIST_PAGE_SIZE, full: bool = False, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    limit = clamp_limit(limit)
+    if full:
+        statement = select(Image).where(Image.user_id == current_user.id)
+        images = (await db.scalars(keyset_page(statement, Image.uploaded_at, Image.id, cursor, limit))).all()
+        return page_response(images, limit, "uploaded_at", lambda image: image)
+    statement = (
+        select(Image.id, Image.filename, Image.path, Image.project_id, Image.uploaded_at, Blob.thumbnail_path, Blob.preview_path)
+        .outerjoin(Blob, Blob.sha256 == Image.sha256)
+        .where(Image.user_id == current_user.id)
+    )
+    images = (await db.execute(keyset_page(statement, Image.uploaded_at, Image.id, cursor, limit))).all()
+    return page_response(images, limit, "uploaded_at", lambda image: {
+        "id": image.id,
+        "filename": image.filename,
+        "url": upload_url(image.path),
+        "thumbnail_url": upload_url(image.thumbnail_path),
+        "preview_url": upload_url(image.preview_path),
+        "project_id": image.project_id,
+        "uploaded_at": image.uploaded_at,
+    })
 
 @app.post("/images/upload")
 def upload_image(file: UploadFile = File(...), project_id: int = None, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    os.makedirs("uploads", exist_ok=True)
-    path = f"uploads/{file.filename}"
-    with open(path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    db_image = Image(filename=file.filename, path=path, user_id=current_user.id, project_id=project_id)
-    db.add(db_image)
-    db.commit()
-    db.refresh(db_image)
-    return db_image
+    try:
+        tmp_path, sha256, size = stream_to_temp(file.file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return store_image(db, current_user, tmp_path, sha256, size, file.filename, file.content_type, project_id)
 
 @app.get("/images/{image_id}")
 def get_image(image_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     image = db.query(Image).filter(Image.id == image_id, Image.user_id == current_user.id).first()
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
-    return image
+    blob = db.get(Blob, image.sha256) if image.sha256 else None
+    return serialize_image(image, blob)
 
 @app.delete("/images/{image_id}")
 def delete_image(image_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     image = db.query(Image).filter(Image.id == image_id, Image.user_id == current_user.id).first()
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
-    os.remove(image.path)
+    sha256, path = image.sha256, image.path
     db.delete(image)
+    if sha256 is None:
+        # Legacy upload stored outside the blob store
+        db.commit()
+        discard(path)
+        return {"message": "Deleted"}
+    db.query(Blob).filter(Blob.sha256 == sha256).update({Blob.ref_count: Blob.ref_count - 1}, synchronize_session=False)
+    blob = db.query(Blob).filter(Blob.sha256 == sha256, Blob.ref_count <= 0).first()
+    if blob:
+        # Last reference: remove files while this transaction still holds the write
+        # lock so a concurrent upload of the same bytes cannot race the unlink
+        remove_files(blob.path, blob.thumbnail_path, blob.preview_path, *derived_paths(sha256).values())
+        db.delete(blob)
     db.commit()
     return {"message": "Deleted"}
 
-@app.post("/images/generate")
-def generate_image(request: ImageGenerate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+# Image generation runs as background jobs; clients poll or subscribe for the result
+IMAGE_JOB_WORKERS = int(os.getenv("IMAGE_JOB_WORKERS", "2"))
+IMAGE_JOB_MAX_QUEUE = int(os.getenv("IMAGE_JOB_MAX_QUEUE", "256"))
+IMAGE_JOB_MAX_ATTEMPTS = int(os.getenv("IMAGE_JOB_MAX_ATTEMPTS", "3"))
+IMAGE_JOB_RETRY_BACKOFF = float(os.getenv("IMAGE_JOB_RETRY_BACKOFF", "2"))
+IMAGE_JOB_TTL = int(os.getenv("IMAGE_JOB_TTL", "3600"))
+IMAGE_JOB_POLL_MS = int(os.getenv("IMAGE_JOB_POLL_MS", "500"))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "60"))
+IMAGE_MOCK_DELAY = float(os.getenv("IMAGE_MOCK_DELAY", "0"))
+
+download_session = None
+openai_clients = {}
+
+def get_download_session():
+    # One pooled HTTP session for result downloads, sized to the worker count
+    global download_session
+    if download_session is None:
+        import requests
+
+        session = requests.Session()
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=IMAGE_JOB_WORKERS))
+        session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=IMAGE_JOB_WORKERS))
+        download_session = session
+    return download_session
+
+def get_openai_client(api_key):
+    # Reuse the client (and its connection pool); retries are handled by the job queue
+    if api_key not in openai_clients:
+        from openai import OpenAI
+
+        openai_clients[api_key] = OpenAI(api_key=api_key, max_retries=0)
+    return openai_clients[api_key]
+
+def load_image_generation():
+    import openai  # noqa: F401
+
+    get_download_session()
+
+def is_transient_image_error(e):
+    import openai
+    import requests
+
+    return isinstance(e, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError, requests.RequestException))
+
+def generate_image_bytes(job):
     openai_api_key = os.getenv("OPENAI_API_KEY")
+    timestamp = int(datetime.utcnow().timestamp())
     if not openai_api_key:
         # Mock response for development
-        os.makedirs("uploads", exist_ok=True)
-        timestamp = int(datetime.utcnow().timestamp())
-        filename = f"mock_generated_{current_user.id}_{timestamp}.png"
-        path = f"uploads/{filename}"
+        if IMAGE_MOCK_DELAY:
+            time.sleep(IMAGE_MOCK_DELAY)
+        filename = f"mock_generated_{job.user_id}_{timestamp}.png"
         # Create a simple mock image (1x1 pixel PNG)
-        with open(path, "wb") as f:
-            f.write(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\tpHYs\x00\x00\x0b\x13\x00\x00\x0b\x13\x01\x00\x9a\x9c\x18\x00\x00\x00\nIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01\x00\x18\xdd\x8d\xb4\x00\x00\x00\x00IEND\xaeB`\x82')
-        # Save to DB
-        db_image = Image(filename=filename, path=path, user_id=current_user.id, project_id=request.project_id)
-        db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
-        return db_image
-    client = OpenAI(api_key=openai_api_key)
+        return filename, b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\tpHYs\x00\x00\x0b\x13\x00\x00\x0b\x13\x01\x00\x9a\x9c\x18\x00\x00\x00\nIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01\x00\x18\xdd\x8d\xb4\x00\x00\x00\x00IEND\xaeB`\x82'
+    response = get_openai_client(openai_api_key).images.generate(
+        model="dall-e-3",
+        prompt=job.payload["prompt"],
+        size="1024x1024",
+        quality="standard",
+        n=1,
+    )
+    image_url = response.data[0].url
+    # Download the image
+    image_jobs.progress(job, "downloading")
+    img_response = get_download_session().get(image_url, timeout=IMAGE_DOWNLOAD_TIMEOUT)
+    img_response.raise_for_status()
+    return f"generated_{job.user_id}_{timestamp}.png", img_response.content
+
+def run_image_job(job):
+    image_jobs.progress(job, "generating")
+    filename, content = generate_image_bytes(job)
+    image_jobs.progress(job, "storing")
+    tmp_path, sha256, size = write_temp(content)
+    db = SessionLocal()
     try:
-        response = client.images.generate(
-            model="dall-e-3",
-            prompt=request.prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
-        image_url = response.data[0].url
-        # Download the image
-        img_response = requests.get(image_url)
-        img_response.raise_for_status()
-        os.makedirs("uploads", exist_ok=True)
-        timestamp = int(datetime.utcnow().timestamp())
-        filename = f"generated_{current_user.id}_{timestamp}.png"
-        path = f"uploads/{filename}"
-        with open(path, "wb") as f:
-            f.write(img_response.content)
-        # Save to DB
-        db_image = Image(filename=filename, path=path, user_id=current_user.id, project_id=request.project_id)
-        db.add(db_image)
+        user = db.get(User, job.user_id)
+        if user is None:
+            discard(tmp_path)
+            raise ValueError("User no longer exists")
+        return store_image(db, user, tmp_path, sha256, size, filename, "image/png", job.payload["project_id"])
+    finally:
+        db.close()
+
+def save_image_job(user_id, snapshot):
+    done = snapshot["status"] in TERMINAL_STATUSES
+    updated_at = datetime.fromisoformat(snapshot["updated_at"])
+    db = SessionLocal()
+    try:
+        db.merge(ImageJob(
+            id=snapshot["job_id"],
+            user_id=user_id,
+            status=snapshot["status"],
+            stage=snapshot["stage"],
+            attempts=snapshot["attempts"],
+            result=jsonable_encoder(snapshot["result"]),
+            error=snapshot["error"],
+            created_at=datetime.fromisoformat(snapshot["created_at"]),
+            updated_at=updated_at,
+            finished_at=updated_at if done else None,
+        ))
+        if done:
+            # Finished rows are kept as long as finished jobs are kept in memory
+            db.execute(delete(ImageJob).where(ImageJob.finished_at < updated_at - timedelta(seconds=IMAGE_JOB_TTL)))
         db.commit()
-        db.refresh(db_image)
-        return db_image
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
+    finally:
+        db.close()
+
+def load_image_job(job_id, user_id):
+    db = SessionLocal()
+    try:
+        row = db.get(ImageJob, job_id)
+        if row is None or row.user_id != user_id:
+            return None
+        return {
+            "job_id": row.id,
+            "status": row.status,
+            "stage": row.stage,
+            "attempts": row.attempts,
+            "result": row.result,
+            "error": row.error,
+            "created_at": row.created_at.isoformat(),
+            "updated_at": row.updated_at.isoformat(),
+        }
+    finally:
+        db.close()
+
+image_jobs = JobQueue(
+    run_image_job,
+    concurrency=IMAGE_JOB_WORKERS,
+    max_queue=IMAGE_JOB_MAX_QUEUE,
+    max_attempts=IMAGE_JOB_MAX_ATTEMPTS,
+    retry_backoff=IMAGE_JOB_RETRY_BACKOFF,
+    retry_if=is_transient_image_error,
+    job_ttl=IMAGE_JOB_TTL,
+    persist=save_image_job,
+)
+
+@app.on_event("startup")
+async def start_image_jobs():
+    image_jobs.ensure_started()
+
+@app.on_event("shutdown")
+async def stop_image_jobs():
+    await image_jobs.stop()
+
+async def get_image_job(job_id, user_id):
+    # The live job if this worker runs it, otherwise the state its worker last stored
+    job = image_jobs.get(job_id)
+    if job is not None and job.user_id == user_id:
+        return job, job.snapshot()
+    snapshot = await run_in_threadpool(load_image_job, job_id, user_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return None, snapshot
+
+async def poll_image_job(snapshot, user_id, timeout):
+    # Re-reads a job running on another worker until it changes; None once its row is gone
+    deadline = time.monotonic() + timeout
+    while snapshot["status"] not in TERMINAL_STATUSES and time.monotonic() < deadline:
+        await asyncio.sleep(min(IMAGE_JOB_POLL_MS / 1000, max(deadline - time.monotonic(), 0)))
+        latest = await run_in_threadpool(load_image_job, snapshot["job_id"], user_id)
+        if latest is None or latest["updated_at"] != snapshot["updated_at"]:
+            return latest
+    return snapshot
+
+@app.post("/images/generate", status_code=status.HTTP_202_ACCEPTED)
+async def generate_image(request: ImageGenerate, current_user: User = Depends(get_current_user)):
+    # Identical in-flight prompts from the same user share one job
+    key = (current_user.id, request.project_id, " ".join(request.prompt.split()).lower())
+    try:
+        job = image_jobs.submit(key, current_user.id, {"prompt": request.prompt, "project_id": request.project_id})
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    # Stored before replying so a poll landing on another worker can find it
+    await image_jobs.flush()
+    return job.snapshot()
+
+@app.get("/images/jobs/{job_id}")
+async def get_image_job_status(job_id: str, wait: float = 0, current_user: User = Depends(get_current_user)):
+    # wait > 0 long-polls until the job changes or the timeout passes
+    job, snapshot = await get_image_job(job_id, current_user.id)
+    if wait <= 0:
+        return snapshot
+    if job is not None:
+        await image_jobs.wait(job, min(wait, 30))
+        return job.snapshot()
+    return await poll_image_job(snapshot, current_user.id, min(wait, 30)) or snapshot
+
+@app.websocket("/ws/images/jobs/{job_id}")
+async def websocket_image_job(job_id: str, websocket: WebSocket, token: str = Query(None), db: AsyncSession = Depends(get_async_db)):
+    await websocket.accept()
+    try:
+        user = await db.run_sync(lambda session: resolve_token(token, session)) if token else None
+        job, snapshot = await get_image_job(job_id, user.id) if user else (None, None)
+    except HTTPException:
+        snapshot = None
+    if snapshot is None:
+        await websocket.close(code=1008)
+        return
+    try:
+        while snapshot is not None:
+            if job is not None:
+                changed = job.changed
+                snapshot = job.snapshot()
+            await websocket.send_json(jsonable_encoder(snapshot))
+            if snapshot["status"] in TERMINAL_STATUSES:
+                break
+            if job is not None:
+                await changed.wait()
+            else:
+                snapshot = await poll_image_job(snapshot, user.id, float("inf"))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
 
 # Search endpoints
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_PREVIEW_MESSAGES = 5
+
+def parse_search_date(value):
+    # Stored timestamps are naive UTC
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def search_previews(db, chat_ids):
+    # The last SEARCH_PREVIEW_MESSAGES messages of every chat, oldest first, in one query
+    if not chat_ids:
+        return {}
+    ranked = select(
+        Message, func.row_number().over(partition_by=Message.chat_id, order_by=Message.seq.desc()).label("position")
+    ).where(Message.chat_id.in_(chat_ids)).subquery()
+    recent = aliased(Message, ranked)
+    previews = {}
+    for message in db.scalars(select(recent).where(ranked.c.position <= SEARCH_PREVIEW_MESSAGES).order_by(ranked.c.chat_id, ranked.c.seq)):
+        previews.setdefault(message.chat_id, []).append(serialize_message(message))
+    return previews
+
 @app.post("/search")
 def perform_search(search: SearchRequest, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    query = db.query(Chat).filter(Chat.user_id == current_user.id)
-    if search.chat_id:
-        query = query.filter(Chat.id == search.chat_id)
-    if search.date_from:
-        date_from = datetime.fromisoformat(search.date_from.replace('Z', '+00:00'))
-        query = query.filter(Chat.created_at >= date_from)
-    if search.date_to:
-        date_to = datetime.fromisoformat(search.date_to.replace('Z', '+00:00'))
-        query = query.filter(Chat.created_at <= date_to)
-    chats = query.all()
-    # Filter by query in messages
-    results = []
-    for chat in chats:
-        if search.query:
-            found = False
-            for msg in chat.messages:
-                if search.query.lower() in msg.get('content', '').lower():
-                    found = True
-                    break
-            if not found:
-                continue
-        results.append({
-            "id": chat.id,
-            "created_at": chat.created_at.isoformat(),
-            "messages": chat.messages[-5:]  # last 5 messages as preview
-        })
-    db_query = SearchQuery(query=search.query, user_id=current_user.id, results={"results": results})
+    date_from = parse_search_date(search.date_from) if search.date_from else None
+    date_to = parse_search_date(search.date_to) if search.date_to else None
+    limit = max(1, min(search.limit, SEARCH_MAX_PAGE_SIZE))
+    offset = max(0, search.offset)
+    filters = {"chat_id": search.chat_id, "date_from": search.date_from, "date_to": search.date_to}
+    cache_key = (current_user.id, search.query, search.chat_id, date_from, date_to, limit, offset)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        results, has_more = cached
+    elif search.query:
+        results, has_more = search_backend.search(
+            db, search.query, current_user.id, chat_id=search.chat_id,
+            date_from=date_from, date_to=date_to, limit=limit, offset=offset,
+        )
+    else:
+        # No text to match: list the filtered chats with a preview of their latest messages
+        query = db.query(Chat).filter(Chat.user_id == current_user.id)
+        if search.chat_id:
+            query = query.filter(Chat.id == search.chat_id)
+        if date_from:
+            query = query.filter(Chat.created_at >= date_from)
+        if date_to:
+            query = query.filter(Chat.created_at <= date_to)
+        chats = query.order_by(Chat.created_at.desc()).offset(offset).limit(limit + 1).all()
+        has_more = len(chats) > limit
+        chats = chats[:limit]
+        # Archived chats are previewed from their segments
+        archived = load_archived(engine, [chat.id for chat in chats if chat.archived_at])
+        previews = search_previews(db, [chat.id for chat in chats])
+        results = [
+            {
+                "id": chat.id,
+                "created_at": chat.created_at.isoformat(),
+                # rows written after archiving follow the archived ones
+                "messages": (archived.get(chat.id, []) + previews.get(chat.id, []))[-SEARCH_PREVIEW_MESSAGES:],
+            }
+            for chat in chats
+        ]
+    if cached is not None:
+        # Repeats served from the cache (e.g. paging back) were recorded the first time
+        return {"results": results, "next_offset": offset + limit if has_more else None}
+    search_cache.set(cache_key, (results, has_more))
+    # History keeps only what is needed to replay the search, not the payload
+    db_query = SearchQuery(
+        query=search.query,
+        user_id=current_user.id,
+        filters=filters,
+        hit_count=len(results),
+        result_ids=[result["id"] for result in results],
+    )
     db.add(db_query)
     db.commit()
-    return {"results": results}
+    return {"results": results, "next_offset": offset + limit if has_more else None}
+
+SEARCH_HISTORY_PAGE_SIZE = 50
 
 @app.get("/search/history")
-def get_search_history(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(SearchQuery).filter(SearchQuery.user_id == current_user.id).all()
+def get_search_history(before: int = None, limit: int = SEARCH_HISTORY_PAGE_SIZE, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+    query = db.query(
+        SearchQuery.id, SearchQuery.query, SearchQuery.filters, SearchQuery.hit_count,
+        SearchQuery.result_ids, SearchQuery.timestamp,
+    ).filter(SearchQuery.user_id == current_user.id)
+    if before is not None:
+        query = query.filter(SearchQuery.id < before)
+    rows = query.order_by(SearchQuery.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "history": [row._asdict() for row in rows],
+        "next_cursor": rows[-1].id if has_more else None,
+    }
 
 # Settings endpoints
 @app.get("/settings")
@@ -450,25 +1259,562 @@ def get_account(current_user: User = Depends(get_current_user)):
     return {"username": current_user.username, "email": current_user.email}
 
 @app.put("/account")
-def update_account(email: str = None, password: str = None, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if email:
-        current_user.email = email
-    if password:
-        current_user.hashed_password = get_password_hash(password)
-    db.commit()
+async def update_account(email: str = None, password: str = None, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    hashed = await run_password_op(password_hasher.hash, password) if password else None
+
+    def save():
+        # current_user may come detached from the principal cache
+        user = db.get(User, current_user.id)
+        if email:
+            user.email = email
+        if hashed:
+            user.hashed_password = hashed
+        db.commit()
+
+    await run_in_threadpool(save)
+    invalidate_principal(current_user.id)
     return {"message": "Updated"}
 
 @app.delete("/account")
 def delete_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db.delete(current_user)
+    # Everything the account owns goes in the same transaction; deleting the user alone would
+    # only null out user_id and leave the rows (and their uploads) behind
+    user_id = current_user.id
+    delete_chat_rows(db, select(Chat.id).where(Chat.user_id == user_id))
+    images = delete_image_rows(db, Image.user_id == user_id)
+    for model in (Chat, Project, SearchQuery, ImageJob):
+        db.execute(delete(model).where(model.user_id == user_id).execution_options(synchronize_session=False))
+    db.execute(delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
     db.commit()
+    discard_legacy_uploads(images)
+    invalidate_principal(user_id)
+    invalidate_search_cache(user_id)
     return {"message": "Account deleted"}
 
+# Streamed NDJSON bodies: split into lines as they arrive, with a 413 past either limit
+async def capped_stream(request: Request, max_body_bytes):
+    too_large = HTTPException(status_code=413, detail=f"Body exceeds {max_body_bytes} bytes")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > max_body_bytes:
+        raise too_large
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_body_bytes:
+            raise too_large
+        yield chunk
+
+async def ndjson_lines(request: Request, max_line_bytes, max_body_bytes):
+    # The buffer only ever holds one partial line, split off by offset rather than re-copied
+    buffer = bytearray()
+    async for chunk in capped_stream(request, max_body_bytes):
+        buffer += chunk
+        start = 0
+        while (end := buffer.find(b"\n", start)) >= 0:
+            if end - start > max_line_bytes:
+                raise HTTPException(status_code=413, detail=f"Line exceeds {max_line_bytes} bytes")
+            yield bytes(buffer[start:end])
+            start = end + 1
+        del buffer[:start]
+        if len(buffer) > max_line_bytes:
+            raise HTTPException(status_code=413, detail=f"Line exceeds {max_line_bytes} bytes")
+    if buffer:
+        yield bytes(buffer)
+
+# Bulk import/export: NDJSON, one record per line, projects first so chats and images can
+# reference them by their exported id. Imports are written in chunked transactions
+EXPORT_PAGE_SIZE = 200
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+IMPORT_MAX_ERRORS = 100
+# A chat line carries all of its messages, so lines may be far longer than prediction inputs
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(64 * 1024 * 1024)))
+IMPORT_MAX_BODY_BYTES = int(os.getenv("IMPORT_MAX_BODY_BYTES", str(4 * 1024 * 1024 * 1024)))
+BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS", "10000"))
+EXPORT_TYPES = ("projects", "chats", "images")
+
+def iso(value):
+    return value.isoformat() if value else None
+
+def parse_timestamp(value):
+    if value is None:
+        return datetime.utcnow()
+    if not isinstance(value, str):
+        raise ValueError("Timestamps must be ISO 8601 strings")
+    # Exports use naive UTC; aware values are converted to match
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def require_string(record, name, optional=False):
+    value = record.get(name)
+    if value is None and optional:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"'{name}' must be a string")
+    return value
+
+async def export_records(user_id, include):
+    # Own session: the response outlives the request's dependencies
+    started = time.perf_counter()
+    records = messages = 0
+    async with AsyncSessionLocal() as db:
+        for kind, model in (("projects", Project), ("chats", Chat), ("images", Image)):
+            if kind not in include:
+                continue
+            last_id = 0
+            while True:
+                rows = (await db.scalars(
+                    select(model).where(model.user_id == user_id, model.id > last_id).order_by(model.id).limit(EXPORT_PAGE_SIZE)
+                )).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                if kind == "projects":
+                    lines = [{"type": "project", "id": p.id, "name": p.name, "description": p.description, "created_at": iso(p.created_at)} for p in rows]
+                elif kind == "chats":
+                    history = {}
+                    # Plain rows rather than ORM objects: this is where an export spends its time
+                    messages_page = await db.execute(
+                        select(Message.chat_id, Message.seq, Message.role, Message.content, Message.timestamp)
+                        .where(Message.chat_id.in_([c.id for c in rows])).order_by(Message.chat_id, Message.seq)
+                    )
+                    for chat_id, seq, role, content, timestamp in messages_page:
+                        history.setdefault(chat_id, []).append({"seq": seq, "role": role, "content": content, "timestamp": timestamp.isoformat()})
+                    history.update(await run_in_threadpool(load_archived, engine, [c.id for c in rows if c.archived_at]))
+                    messages += sum(len(h) for h in history.values())
+                    lines = [{"type": "chat", "id": c.id, "project_id": c.project_id, "created_at": iso(c.created_at), "messages": history.get(c.id, [])} for c in rows]
+                else:
+                    lines = [{"type": "image", "id": i.id, "filename": i.filename, "sha256": i.sha256, "project_id": i.project_id, "uploaded_at": iso(i.uploaded_at), "url": upload_url(i.path)} for i in rows]
+                records += len(lines)
+                yield "".join(json.dumps(line) + "\n" for line in lines)
+                # Release the read transaction between pages so writers are not held up
+                await db.commit()
+    elapsed = time.perf_counter() - started
+    logger.info("Exported %d records (%d messages) for user %s in %.2fs, %.0f rows/s", records, messages, user_id, elapsed, (records + messages) / elapsed if elapsed else 0)
+
+@app.get("/export")
+def export_data(include: str = ",".join(EXPORT_TYPES), current_user: User = Depends(get_current_user)):
+    kinds = {kind.strip() for kind in include.split(",") if kind.strip()}
+    if not kinds or not kinds <= set(EXPORT_TYPES):
+        raise HTTPException(status_code=422, detail=f"include must be a subset of {','.join(EXPORT_TYPES)}")
+    return StreamingResponse(
+        export_records(current_user.id, kinds),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="kaisang-export.ndjson"'},
+    )
+
+def adjust_blob_refs(db, counts, sign):
+    # One executemany for every blob whose reference count changes
+    if counts:
+        blobs = Blob.__table__
+        db.execute(
+            update(blobs).where(blobs.c.sha256 == bindparam("key")).values(ref_count=blobs.c.ref_count + sign * bindparam("n")),
+            [{"key": sha256, "n": n} for sha256, n in counts.items()],
+        )
+
+class BulkImport:
+    # Buffers parsed lines and writes them IMPORT_CHUNK_ROWS rows at a time, one transaction per chunk
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.project_ids = {}
+        self.owned_projects = None
+        self.pending = []
+        self.pending_rows = 0
+        self.counts = {"projects": 0, "chats": 0, "messages": 0, "images": 0}
+        self.lines = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": message})
+
+    def add(self, line, record):
+        if not isinstance(record, dict):
+            raise ValueError("Expected a JSON object")
+        kind = record.get("type")
+        if kind == "project":
+            row = {"name": require_string(record, "name"), "description": require_string(record, "description", optional=True) or "", "created_at": parse_timestamp(record.get("created_at"))}
+            rows = 1
+        elif kind == "chat":
+            messages = record.get("messages", [])
+            if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+                raise ValueError("'messages' must be a list of objects")
+            row = {
+                "created_at": parse_timestamp(record.get("created_at")),
+                "messages": [(require_string(m, "role"), require_string(m, "content"), parse_timestamp(m.get("timestamp"))) for m in messages],
+            }
+            rows = 1 + len(messages)
+        elif kind == "image":
+            sha256 = require_string(record, "sha256")
+            row = {"filename": require_string(record, "filename"), "sha256": sha256.lower(), "uploaded_at": parse_timestamp(record.get("uploaded_at"))}
+            rows = 1
+        else:
+            raise ValueError("'type' must be project, chat or image")
+        self.pending.append((line, kind, record.get("id"), record.get("project_id"), row))
+        self.pending_rows += rows
+
+    def resolve_project(self, project_id):
+        # Ids from this file map to the projects created for them; existing projects may be referenced directly
+        if project_id is None:
+            return None
+        if project_id in self.project_ids:
+            return self.project_ids[project_id]
+        if project_id in self.owned_projects:
+            return project_id
+        raise ValueError(f"Unknown project_id {project_id}")
+
+    def flush(self):
+        batch, self.pending, self.pending_rows = self.pending, [], 0
+        if not batch:
+            return
+        db = SessionLocal()
+        try:
+            if self.owned_projects is None:
+                self.owned_projects = set(db.scalars(select(Project.id).where(Project.user_id == self.user_id)))
+            counts, mapped = self.write(db, batch)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning("Import chunk of lines %d-%d failed: %s", batch[0][0], batch[-1][0], e)
+            self.error(batch[0][0], f"Lines {batch[0][0]}-{batch[-1][0]} were not imported: {e}")
+            return
+        finally:
+            db.close()
+        self.project_ids.update(mapped)
+        self.owned_projects.update(mapped.values())
+        for name, count in counts.items():
+            self.counts[name] += count
+
+    def write(self, db, batch):
+        counts = {"projects": 0, "chats": 0, "messages": 0, "images": 0}
+        mapped = {}
+        projects = [(source_id, row) for _, kind, source_id, _, row in batch if kind == "project"]
+        if projects:
+            ids = db.scalars(
+                insert(Project).returning(Project.id, sort_by_parameter_order=True),
+                [dict(row, user_id=self.user_id) for _, row in projects],
+            ).all()
+            mapped = {source_id: new_id for (source_id, _), new_id in zip(projects, ids) if source_id is not None}
+            counts["projects"] = len(ids)
+        # Projects committed in earlier chunks are already in project_ids; this chunk's go in now
+        self.project_ids.update(mapped)
+        try:
+            chats, images = [], []
+            for line, kind, _, project_id, row in batch:
+                if kind == "project":
+                    continue
+                try:
+                    row = dict(row, project_id=self.resolve_project(project_id))
+                except ValueError as e:
+                    self.error(line, str(e))
+                    continue
+                (chats if kind == "chat" else images).append((line, row))
+            if chats:
+                ids = db.scalars(
+                    insert(Chat).returning(Chat.id, sort_by_parameter_order=True),
+                    [{"user_id": self.user_id, "project_id": row["project_id"], "created_at": row["created_at"]} for _, row in chats],
+                ).all()
+                messages = [
+                    {"chat_id": chat_id, "seq": seq, "role": role, "content": content, "timestamp": timestamp}
+                    for chat_id, (_, row) in zip(ids, chats)
+                    for seq, (role, content, timestamp) in enumerate(row["messages"], start=1)
+                ]
+                if messages:
+                    with search_backend.defer_indexing(db):
+                        db.execute(insert(Message.__table__), messages)
+                counts["chats"], counts["messages"] = len(ids), len(messages)
+            if images:
+                # Only metadata travels in the file; the bytes must already be in the blob store
+                blobs = dict(db.execute(select(Blob.sha256, Blob.path).where(Blob.sha256.in_({row["sha256"] for _, row in images}))).all())
+                rows = []
+                for line, row in images:
+                    if row["sha256"] not in blobs:
+                        self.error(line, f"No stored upload with sha256 {row['sha256']}")
+                        continue
+                    rows.append(dict(row, path=blobs[row["sha256"]], user_id=self.user_id))
+                if rows:
+                    db.execute(insert(Image.__table__), rows)
+                    adjust_blob_refs(db, Counter(row["sha256"] for row in rows), 1)
+                counts["images"] = len(rows)
+        finally:
+            for source_id in mapped:
+                self.project_ids.pop(source_id, None)
+        return counts, mapped
+
+    def summary(self, elapsed):
+        rows = sum(self.counts.values())
+        return {
+            **self.counts,
+            "lines": self.lines,
+            "error_count": self.error_count,
+            "errors": self.errors,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": round(rows / elapsed) if elapsed else 0,
+        }
+
+@app.post("/import")
+async def import_data(request: Request, current_user: User = Depends(get_current_user)):
+    importer = BulkImport(current_user.id)
+    started = time.perf_counter()
+    try:
+        async for line in ndjson_lines(request, IMPORT_MAX_LINE_BYTES, IMPORT_MAX_BODY_BYTES):
+            importer.lines += 1
+            if not line.strip():
+                continue
+            try:
+                importer.add(importer.lines, json.loads(line))
+            except ValueError as e:
+                importer.error(importer.lines, str(e))
+                continue
+            if importer.pending_rows >= IMPORT_CHUNK_ROWS:
+                await run_in_threadpool(importer.flush)
+    except HTTPException as e:
+        # Earlier chunks are already committed; keep the complete lines and say what got in
+        await run_in_threadpool(importer.flush)
+        invalidate_search_cache(current_user.id)
+        raise HTTPException(status_code=e.status_code, detail={"error": e.detail, **importer.summary(time.perf_counter() - started)})
+    await run_in_threadpool(importer.flush)
+    invalidate_search_cache(current_user.id)
+    summary = importer.summary(time.perf_counter() - started)
+    logger.info("Imported %s for user %s", summary, current_user.id)
+    return summary
+
+# Bulk mutations: one statement per table, however many ids
+class BulkIds(BaseModel):
+    ids: List[int]
+
+class BulkMove(BaseModel):
+    ids: List[int]
+    # null moves the items out of any project
+    project_id: Optional[int] = None
+
+def check_bulk(ids, db=None, user_id=None, project_id=None):
+    if len(ids) > BULK_MAX_IDS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_IDS} ids per request")
+    if project_id is not None and not db.scalar(select(Project.id).where(Project.id == project_id, Project.user_id == user_id)):
+        raise HTTPException(status_code=404, detail="Project not found")
+
+@app.post("/chats/bulk-delete")
+def bulk_delete_chats(request: BulkIds, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    check_bulk(request.ids)
+    delete_chat_rows(db, select(Chat.id).where(Chat.user_id == current_user.id, Chat.id.in_(request.ids)))
+    deleted = db.execute(delete(Chat).where(Chat.user_id == current_user.id, Chat.id.in_(request.ids)).execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    invalidate_search_cache(current_user.id)
+    return {"deleted": deleted}
+
+@app.post("/chats/bulk-move")
+def bulk_move_chats(request: BulkMove, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    check_bulk(request.ids, db, current_user.id, request.project_id)
+    updated = db.execute(
+        update(Chat).where(Chat.user_id == current_user.id, Chat.id.in_(request.ids))
+        .values(project_id=request.project_id).execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    invalidate_search_cache(current_user.id)
+    return {"updated": updated}
+
+def delete_image_rows(db, condition):
+    # Deletes the matching images and their references; returns (sha256, path) of each
+    images = db.execute(select(Image.sha256, Image.path).where(condition)).all()
+    db.execute(delete(Image).where(condition).execution_options(synchronize_session=False))
+    refs = Counter(sha256 for sha256, _ in images if sha256)
+    adjust_blob_refs(db, refs, -1)
+    # Same rule as delete_image: files of unreferenced blobs go while the write lock is held
+    orphans = db.execute(select(Blob.sha256, Blob.path, Blob.thumbnail_path, Blob.preview_path).where(Blob.sha256.in_(refs), Blob.ref_count <= 0)).all()
+    for sha256, *paths in orphans:
+        remove_files(*paths, *derived_paths(sha256).values())
+    if orphans:
+        db.execute(delete(Blob).where(Blob.sha256.in_([row[0] for row in orphans])).execution_options(synchronize_session=False))
+    return images
+
+def discard_legacy_uploads(images):
+    # Legacy uploads stored outside the blob store; only once the delete is committed
+    for sha256, path in images:
+        if sha256 is None:
+            discard(path)
+
+@app.post("/images/bulk-delete")
+def bulk_delete_images(request: BulkIds, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    check_bulk(request.ids)
+    images = delete_image_rows(db, and_(Image.user_id == current_user.id, Image.id.in_(request.ids)))
+    db.commit()
+    discard_legacy_uploads(images)
+    return {"deleted": len(images)}
+
+@app.post("/images/bulk-move")
+def bulk_move_images(request: BulkMove, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    check_bulk(request.ids, db, current_user.id, request.project_id)
+    updated = db.execute(
+        update(Image).where(Image.user_id == current_user.id, Image.id.in_(request.ids))
+        .values(project_id=request.project_id).execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return {"updated": updated}
+
 # Keep old predict for compatibility
 class Query(BaseModel):
     text: str
 
 @app.post("/predict")
-def get_prediction(query: Query):
-    response = predict(query.text)
+async def get_prediction(query: Query):
+    try:
+        response = await inference_scheduler.submit(query.text)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Inference queue is full")
     return {"input": query.text, "response": response}
+
+# Closest intents.json patterns by cosine similarity, whichever engine answers /predict
+RETRIEVAL_MAX_K = 50
+
+class MatchQuery(BaseModel):
+    text: str
+    k: int = 5
+
+@app.post("/predict/matches")
+async def get_prediction_matches(query: MatchQuery):
+    k = max(1, min(query.k, RETRIEVAL_MAX_K))
+    matches = (await run_in_threadpool(match_batch, [query.text], k))[0]
+    return {
+        "input": query.text,
+        "matches": matches,
+        "min_score": RETRIEVAL_MIN_SCORE,
+        "confident": bool(matches) and matches[0]["score"] >= RETRIEVAL_MIN_SCORE,
+    }
+
+# Model registry
+@app.get("/model/info")
+def get_model_info():
+    return registry.info()
+
+@app.post("/model/reload")
+def reload_model(current_user: User = Depends(get_admin_user)):
+    previous = registry.bundle.version
+    try:
+        registry.reload()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Model reload failed: {str(e)}")
+    return {"previous_version": previous, **registry.info()}
+
+# Batch prediction
+PREDICT_MAX_BATCH = int(os.getenv("PREDICT_MAX_BATCH", "1000"))
+PREDICT_MAX_LINE_BYTES = int(os.getenv("PREDICT_MAX_LINE_BYTES", str(64 * 1024)))
+PREDICT_MAX_BODY_BYTES = int(os.getenv("PREDICT_MAX_BODY_BYTES", str(64 * 1024 * 1024)))
+
+def parse_batch_item(item):
+    if isinstance(item, dict):
+        item = item.get("text")
+    if not isinstance(item, str):
+        raise ValueError("Each item must be a string or an object with a 'text' field")
+    return item
+
+async def batch_predictions(request: Request):
+    # Predicts every PREDICT_MAX_BATCH lines and yields each chunk's results as soon as they are ready
+    texts = []
+    line_no = 0
+    async for line in ndjson_lines(request, PREDICT_MAX_LINE_BYTES, PREDICT_MAX_BODY_BYTES):
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            texts.append(parse_batch_item(json.loads(line)))
+        except ValueError as e:
+            yield json.dumps({"line": line_no, "error": str(e)}) + "\n"
+            continue
+        if len(texts) >= PREDICT_MAX_BATCH:
+            yield await predict_lines(texts)
+            texts = []
+    if texts:
+        yield await predict_lines(texts)
+
+async def predict_lines(texts):
+    responses = await run_in_threadpool(observed_predict_batch, texts)
+    return "".join(json.dumps({"input": t, "response": r}) + "\n" for t, r in zip(texts, responses))
+
+async def stream_batch_predictions(first, output):
+    yield first
+    try:
+        async for chunk in output:
+            yield chunk
+    except HTTPException as e:
+        # The status line is already sent; end the stream with the error instead
+        yield json.dumps({"error": e.detail, "status": e.status_code}) + "\n"
+
+@app.post("/predict/batch")
+async def get_batch_prediction(request: Request):
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        output = batch_predictions(request)
+        # Problems found before the first results are ready still get a proper status code
+        try:
+            first = await output.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        return StreamingResponse(stream_batch_predictions(first, output), media_type="application/x-ndjson")
+    body = bytearray()
+    async for chunk in capped_stream(request, PREDICT_MAX_BODY_BYTES):
+        body += chunk
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if isinstance(items, dict):
+        items = items.get("texts")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=422, detail="Expected a JSON array of texts")
+    if len(items) > PREDICT_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {PREDICT_MAX_BATCH} items")
+    try:
+        texts = [parse_batch_item(item) for item in items]
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    responses = await run_in_threadpool(observed_predict_batch, texts)
+    return {"results": [{"input": t, "response": r} for t, r in zip(texts, responses)]}
+
+# Retention and cleanup: idle chats go to cold storage, old search history and orphaned
+# rows and uploads are removed, and freed database pages are returned (see app/maintenance.py)
+maintenance = MaintenanceRunner(default_tasks(engine))
+
+@app.on_event("startup")
+async def start_maintenance():
+    maintenance.ensure_started()
+
+@app.on_event("shutdown")
+async def stop_maintenance():
+    await maintenance.stop()
+
+@app.get("/maintenance")
+def get_maintenance(current_user: User = Depends(get_admin_user)):
+    return maintenance.stats()
+
+@app.post("/maintenance/run")
+async def run_maintenance(tasks: str = None, current_user: User = Depends(get_admin_user)):
+    names = {name.strip() for name in tasks.split(",") if name.strip()} if tasks else None
+    known = {name for name, _ in maintenance.tasks}
+    if names and not names <= known:
+        raise HTTPException(status_code=422, detail=f"tasks must be a subset of {','.join(sorted(known))}")
+    return await maintenance.run_now(names)
+
+# Stats
+@app.get("/stats")
+def get_stats():
+    return {"inference": inference_scheduler.stats(), "search_cache": search_cache.stats(), "auth_cache": principal_cache.stats(), "password_hashing": password_hasher.stats(), "image_jobs": image_jobs.stats(), "chat_pubsub": chat_connections.stats(), "chat_rate_limit": chat_rate_limiter.stats(), "maintenance": maintenance.stats()}
+
+# Prometheus metrics; requests slower than SLOW_REQUEST_MS are logged with their SQL breakdown (0 disables)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+
+metrics.gauge("kaisang_inference_queue_depth", "Texts waiting for the inference scheduler", lambda: inference_scheduler.stats()["queue_depth"])
+metrics.gauge("kaisang_image_jobs_queue_depth", "Image generation jobs waiting for a worker", lambda: image_jobs.stats()["queue_depth"])
+metrics.gauge("kaisang_image_jobs_running", "Image generation jobs in progress", lambda: image_jobs.running)
+metrics.gauge("kaisang_chat_subscribers", "Chat WebSockets subscribed to live updates", lambda: chat_connections.stats()["subscribers"])
+metrics.gauge("kaisang_password_hash_pending", "Password hash/verify operations in flight", lambda: password_hasher.pending)
+
+# Added last so it wraps every other middleware
+app.add_middleware(MetricsMiddleware, slow_request_ms=SLOW_REQUEST_MS)
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,266 @@
+import gzip
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, bindparam, text
+
+logger = logging.getLogger(__name__)
+
+# Cold storage for chats nobody has touched in a while: their messages move out of the
+# database into gzip-compressed JSONL segments and are restored the next time the chat is opened
+ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "archive")
+CHAT_ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH_CHATS = 500
+# Roughly how many messages one archiving transaction deletes, to keep its write lock short
+ARCHIVE_BATCH_MESSAGES = 20000
+# Segments with less than this fraction of their bytes still referenced are rewritten
+COMPACT_BELOW = 0.5
+PREVIEW_LENGTH = 100
+
+
+def as_datetime(value):
+    # Raw SQL returns SQLite DateTime values as strings
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def isoformat(value):
+    value = as_datetime(value)
+    return value.isoformat() if value else None
+
+
+def segment_path(name):
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+def encode_member(record):
+    # One gzip member per chat: concatenated members are still a valid .jsonl.gz, and any
+    # one chat can be read back from its offset without inflating the rest of the segment
+    return gzip.compress((json.dumps(record) + "\n").encode(), compresslevel=6)
+
+
+def write_segment(members):
+    # Returns the segment name and the (offset, length) of each member, in order
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = f"chats-{datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+    path = segment_path(name)
+    locations = []
+    with open(path + ".tmp", "wb") as f:
+        for member in members:
+            locations.append((f.tell(), len(member)))
+            f.write(member)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return name, locations
+
+
+def read_member(segment, offset, length, raw=False):
+    with open(segment_path(segment), "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    return data if raw else json.loads(gzip.decompress(data))
+
+
+def load_archived(engine, chat_ids):
+    # Messages of archived chats, read from their segments without restoring them
+    if not chat_ids:
+        return {}
+    for attempt in range(2):
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT chat_id, segment, byte_offset, byte_length FROM chat_archives WHERE chat_id IN :chat_ids")
+                .bindparams(bindparam("chat_ids", expanding=True)),
+                {"chat_ids": list(chat_ids)},
+            ).fetchall()
+        try:
+            return {chat_id: read_member(segment, offset, length)["messages"] for chat_id, segment, offset, length in rows}
+        except FileNotFoundError:
+            # A compaction replaced the segment after the lookup; the new location is committed by now
+            if attempt:
+                raise
+
+
+def restore_chat(engine, chat_id):
+    # Moves an archived chat's messages back into the messages table; returns how many
+    with engine.begin() as conn:
+        # Clearing the flag first takes the write lock, so only one caller restores a chat
+        if not conn.execute(
+            text("UPDATE chats SET archived_at = NULL, restored_at = :now WHERE id = :chat_id AND archived_at IS NOT NULL")
+            .bindparams(bindparam("now", type_=DateTime)),
+            {"chat_id": chat_id, "now": datetime.utcnow()},
+        ).rowcount:
+            return 0
+        segment, offset, length, last_seq = conn.execute(
+            text("SELECT segment, byte_offset, byte_length, last_seq FROM chat_archives WHERE chat_id = :chat_id"), {"chat_id": chat_id}
+        ).one()
+        messages = read_member(segment, offset, length)["messages"]
+        # A turn written after archiving started again from seq 1; move it after the archived ones
+        conn.execute(text("UPDATE messages SET seq = -seq WHERE chat_id = :chat_id"), {"chat_id": chat_id})
+        conn.execute(text("UPDATE messages SET seq = :last_seq - seq WHERE chat_id = :chat_id"), {"chat_id": chat_id, "last_seq": last_seq})
+        if messages:
+            conn.execute(
+                text("INSERT INTO messages (chat_id, seq, role, content, timestamp) VALUES (:chat_id, :seq, :role, :content, :timestamp)")
+                .bindparams(bindparam("timestamp", type_=DateTime)),
+                [
+                    {"chat_id": chat_id, "seq": m["seq"], "role": m["role"], "content": m["content"], "timestamp": datetime.fromisoformat(m["timestamp"])}
+                    for m in messages
+                ],
+            )
+        conn.execute(text("DELETE FROM chat_archives WHERE chat_id = :chat_id"), {"chat_id": chat_id})
+    logger.info("Restored %d archived messages of chat %s", len(messages), chat_id)
+    return len(messages)
+
+
+def idle_chats(conn, after, cutoff):
+    # Unarchived chats whose newest message is older than the cutoff, in id order. A restored
+    # chat counts as touched when it was restored, so reading an old chat keeps it warm
+    return conn.execute(
+        text("""
+            SELECT c.id, c.user_id, c.project_id, c.created_at, last.seq, last.role, last.content, last.timestamp
+            FROM chats c
+            JOIN messages last ON last.chat_id = c.id
+                AND last.seq = (SELECT MAX(seq) FROM messages WHERE chat_id = c.id)
+            WHERE c.archived_at IS NULL AND c.id > :after AND last.timestamp < :cutoff
+                AND (c.restored_at IS NULL OR c.restored_at < :cutoff)
+            ORDER BY c.id
+            LIMIT :limit
+        """).bindparams(bindparam("cutoff", type_=DateTime)),
+        {"after": after, "cutoff": cutoff, "limit": ARCHIVE_BATCH_CHATS},
+    ).fetchall()
+
+
+def archive_batch(engine, chats):
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT chat_id, seq, role, content, timestamp FROM messages WHERE chat_id IN :chat_ids ORDER BY chat_id, seq")
+            .bindparams(bindparam("chat_ids", expanding=True)),
+            {"chat_ids": [chat.id for chat in chats]},
+        ).fetchall()
+    history = {}
+    for chat_id, seq, role, content, timestamp in rows:
+        history.setdefault(chat_id, []).append({"seq": seq, "role": role, "content": content, "timestamp": isoformat(timestamp)})
+    # Same shape as a chat line of GET /export
+    records = [
+        {"type": "chat", "id": chat.id, "user_id": chat.user_id, "project_id": chat.project_id, "created_at": isoformat(chat.created_at), "messages": history.get(chat.id, [])}
+        for chat in chats
+    ]
+    members = [encode_member(record) for record in records]
+    segment, locations = write_segment(members)
+    now = datetime.utcnow()
+    params = [
+        {
+            "chat_id": chat.id, "segment": segment, "offset": offset, "length": length,
+            "count": len(history.get(chat.id, [])), "last_seq": chat.seq, "last_role": chat.role,
+            "last_preview": chat.content[:PREVIEW_LENGTH], "last_timestamp": as_datetime(chat.timestamp), "archived_at": now,
+        }
+        for chat, (offset, length) in zip(chats, locations)
+    ]
+    try:
+        with engine.begin() as conn:
+            # Chats that got a new message since they were read are skipped; the segment keeps a dead copy
+            conn.execute(
+                text("""
+                    INSERT INTO chat_archives (chat_id, segment, byte_offset, byte_length, message_count, last_seq, last_role, last_preview, last_timestamp, archived_at)
+                    SELECT :chat_id, :segment, :offset, :length, :count, :last_seq, :last_role, :last_preview, :last_timestamp, :archived_at
+                    WHERE (SELECT MAX(seq) FROM messages WHERE chat_id = :chat_id) = :last_seq
+                """).bindparams(bindparam("last_timestamp", type_=DateTime), bindparam("archived_at", type_=DateTime)),
+                params,
+            )
+            archived = "(SELECT chat_id FROM chat_archives WHERE segment = :segment)"
+            messages = conn.execute(text(f"DELETE FROM messages WHERE chat_id IN {archived}"), {"segment": segment}).rowcount
+            archived_chats = conn.execute(
+                text(f"UPDATE chats SET archived_at = :now WHERE id IN {archived}").bindparams(bindparam("now", type_=DateTime)),
+                {"segment": segment, "now": now},
+            ).rowcount
+    except BaseException:
+        os.remove(segment_path(segment))
+        raise
+    return {
+        "chats": archived_chats,
+        "messages": messages,
+        "raw_bytes": sum(len(json.dumps(record)) + 1 for record in records),
+        "archived_bytes": sum(len(member) for member in members),
+    }
+
+
+def archive_idle_chats(engine, idle_days=CHAT_ARCHIVE_AFTER_DAYS):
+    report = {"chats": 0, "messages": 0, "segments": 0, "raw_bytes": 0, "archived_bytes": 0}
+    if idle_days <= 0:
+        return report
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+    after = 0
+    while True:
+        with engine.connect() as conn:
+            candidates = idle_chats(conn, after, cutoff)
+        if not candidates:
+            break
+        # last.seq stands in for the message count, which is what the transaction's length depends on
+        batch, messages = [], 0
+        for chat in candidates:
+            if batch and messages + chat.seq > ARCHIVE_BATCH_MESSAGES:
+                break
+            batch.append(chat)
+            messages += chat.seq
+        after = batch[-1].id
+        result = archive_batch(engine, batch)
+        report["segments"] += 1
+        for name, value in result.items():
+            report[name] += value
+    if report["chats"]:
+        logger.info("Archived %d chats (%d messages) into %d segments", report["chats"], report["messages"], report["segments"])
+    return report
+
+
+def compact_segments(engine):
+    # Deletes segments nothing points at any more and rewrites mostly-dead ones. A superseded
+    # file is deleted once the new locations are committed; readers that looked up the old
+    # location just before retry (see load_archived)
+    report = {"removed": 0, "rewritten": 0, "reclaimed_bytes": 0}
+    if not os.path.isdir(ARCHIVE_DIR):
+        return report
+    with engine.connect() as conn:
+        live = {
+            segment: (count, size)
+            for segment, count, size in conn.execute(
+                text("SELECT segment, COUNT(*), SUM(byte_length) FROM chat_archives GROUP BY segment")
+            )
+        }
+    for name in sorted(os.listdir(ARCHIVE_DIR)):
+        if not name.startswith("chats-"):
+            continue
+        path = segment_path(name)
+        size = os.path.getsize(path)
+        if name.endswith(".tmp") or name not in live:
+            # .tmp files are segments whose writer died; this pass runs before any new ones are written
+            os.remove(path)
+            report["removed"] += 1
+            report["reclaimed_bytes"] += size
+        elif live[name][1] < size * COMPACT_BELOW:
+            new_size = rewrite_segment(engine, name)
+            os.remove(path)
+            report["reclaimed_bytes"] += size - new_size
+            report["rewritten"] += 1
+    return report
+
+
+def rewrite_segment(engine, name):
+    # Copies the live members byte for byte into a new segment; returns its size
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT chat_id, byte_offset, byte_length FROM chat_archives WHERE segment = :segment ORDER BY byte_offset"),
+            {"segment": name},
+        ).fetchall()
+    segment, locations = write_segment([read_member(name, offset, length, raw=True) for _, offset, length in rows])
+    with engine.begin() as conn:
+        # Chats restored meanwhile no longer match and keep nothing in the new segment
+        conn.execute(
+            text("UPDATE chat_archives SET segment = :segment, byte_offset = :offset, byte_length = :length WHERE chat_id = :chat_id AND segment = :old"),
+            [
+                {"segment": segment, "offset": offset, "length": length, "chat_id": chat_id, "old": name}
+                for (chat_id, _, _), (offset, length) in zip(rows, locations)
+            ],
+        )
+    return sum(length for _, length in locations)
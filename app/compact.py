@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+FORMAT_VERSION = 1
+
+# Analyzer settings needed to rebuild the tokenizer without the fitted vocabulary
+ANALYZER_PARAMS = ("lowercase", "strip_accents", "token_pattern", "ngram_range", "analyzer", "stop_words")
+TFIDF_PARAMS = ANALYZER_PARAMS + ("binary", "norm", "use_idf", "sublinear_tf")
+HASHING_PARAMS = ANALYZER_PARAMS + ("binary", "norm", "n_features", "alternate_sign")
+
+
+class UnsupportedModelError(Exception):
+    pass
+
+
+def portable_params(estimator, names):
+    params = estimator.get_params()
+    for name in ("preprocessor", "tokenizer"):
+        if params.get(name) is not None:
+            raise UnsupportedModelError(f"Custom {name} cannot be exported")
+    if callable(params.get("analyzer")):
+        raise UnsupportedModelError("Callable analyzer cannot be exported")
+    exported = {name: params[name] for name in names}
+    if isinstance(exported["stop_words"], (set, frozenset)):
+        exported["stop_words"] = sorted(exported["stop_words"])
+    exported["ngram_range"] = list(exported["ngram_range"])
+    return exported
+
+
+def write_array(out_dir, name, array, digest):
+    array = np.ascontiguousarray(array)
+    np.save(os.path.join(out_dir, name), array, allow_pickle=False)
+    digest.update(name.encode())
+    digest.update(array.tobytes())
+
+
+def export_compact(vectorizer, model, out_dir):
+    # Writes .npy arrays plus meta.json (last, so a complete meta means a complete export)
+    if not all(hasattr(model, name) for name in ("coef_", "intercept_", "classes_")):
+        raise UnsupportedModelError(f"{type(model).__name__} is not a linear classifier")
+    os.makedirs(out_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    # Stored as (features, classes) so a sparse row product only touches the rows it needs
+    coef = np.asarray(model.coef_, dtype=np.float32).T
+    if isinstance(vectorizer, TfidfVectorizer):
+        terms = sorted(vectorizer.vocabulary_, key=lambda term: term.encode("utf-8"))
+        columns = np.array([vectorizer.vocabulary_[term] for term in terms], dtype=np.int64)
+        encoded = [term.encode("utf-8") for term in terms]
+        width = max((len(term) for term in encoded), default=1)
+        # Sorted fixed-width byte strings: lookups are a vectorised searchsorted over the mmap
+        write_array(out_dir, "vocabulary.npy", np.array(encoded, dtype=f"S{width}"), digest)
+        idf = vectorizer.idf_[columns] if vectorizer.use_idf else np.ones(len(columns))
+        write_array(out_dir, "idf.npy", idf.astype(np.float32), digest)
+        coef = coef[columns]
+        kind, params = "tfidf", portable_params(vectorizer, TFIDF_PARAMS)
+    elif isinstance(vectorizer, HashingVectorizer):
+        kind, params = "hashing", portable_params(vectorizer, HASHING_PARAMS)
+    else:
+        raise UnsupportedModelError(f"{type(vectorizer).__name__} cannot be exported")
+    write_array(out_dir, "coef.npy", coef, digest)
+    write_array(out_dir, "intercept.npy", np.asarray(model.intercept_, dtype=np.float32), digest)
+    classes = [str(tag) for tag in model.classes_]
+    digest.update(json.dumps([kind, params, classes], sort_keys=True).encode())
+    meta = {
+        "format": FORMAT_VERSION,
+        "vectorizer": kind,
+        "params": params,
+        "classes": classes,
+        "digest": digest.hexdigest(),
+    }
+    tmp_path = os.path.join(out_dir, ".meta.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, "meta.json"))
+    return meta
+
+
+class CompactTfidfVectorizer:
+    def __init__(self, vocabulary, idf, params):
+        self.vocabulary = vocabulary
+        self.width = vocabulary.dtype.itemsize
+        self.idf = idf
+        self.binary = params["binary"]
+        self.norm = params["norm"]
+        self.sublinear_tf = params["sublinear_tf"]
+        analyzer_params = {name: params[name] for name in ANALYZER_PARAMS}
+        analyzer_params["ngram_range"] = tuple(analyzer_params["ngram_range"])
+        self.analyze = TfidfVectorizer(**analyzer_params).build_analyzer()
+
+    def lookup(self, tokens):
+        # Column of each token, or -1 when it is not in the vocabulary
+        columns = np.full(len(tokens), -1, dtype=np.int64)
+        if not tokens or not len(self.vocabulary):
+            return columns
+        encoded = [token.encode("utf-8") for token in tokens]
+        fits = np.array([len(token) <= self.width for token in encoded])
+        if not fits.any():
+            return columns
+        keys = np.array([token for token, ok in zip(encoded, fits) if ok], dtype=f"S{self.width}")
+        positions = np.minimum(np.searchsorted(self.vocabulary, keys), len(self.vocabulary) - 1)
+        found = self.vocabulary[positions] == keys
+        columns[np.flatnonzero(fits)] = np.where(found, positions, -1)
+        return columns
+
+    def transform(self, texts):
+        rows, tokens = [], []
+        for row, text in enumerate(texts):
+            analyzed = self.analyze(text)
+            tokens.extend(analyzed)
+            rows.extend([row] * len(analyzed))
+        columns = self.lookup(tokens)
+        known = columns >= 0
+        counts = sp.csr_matrix(
+            (np.ones(int(known.sum()), dtype=np.float64), (np.asarray(rows, dtype=np.int64)[known], columns[known])),
+            shape=(len(texts), len(self.vocabulary)),
+        )
+        counts.sum_duplicates()
+        if self.binary:
+            counts.data[:] = 1
+        elif self.sublinear_tf:
+            np.log(counts.data, counts.data)
+            counts.data += 1
+        counts.data *= self.idf[counts.indices]
+        return normalize(counts, norm=self.norm, copy=False) if self.norm else counts
+
+
+class CompactLinearModel:
+    def __init__(self, coef, intercept, classes):
+        self.coef = coef
+        self.intercept = intercept
+        self.classes_ = np.array(classes)
+
+    def decision_function(self, X):
+        return np.asarray(X @ self.coef) + self.intercept
+
+    def predict(self, X):
+        scores = self.decision_function(X)
+        if scores.shape[1] == 1:
+            return self.classes_[(scores[:, 0] > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+
+def load_compact(path):
+    # Read-only memory maps: every worker process shares the same page-cache pages
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != FORMAT_VERSION:
+        raise UnsupportedModelError(f"Unknown compact model format {meta.get('format')}")
+    params = meta["params"]
+
+    def array(name):
+        return np.load(os.path.join(path, name), mmap_mode="r", allow_pickle=False)
+
+    if meta["vectorizer"] == "tfidf":
+        vectorizer = CompactTfidfVectorizer(array("vocabulary.npy"), array("idf.npy"), params)
+    else:
+        # HashingVectorizer is stateless, so rebuilding it costs nothing
+        params = dict(params, ngram_range=tuple(params["ngram_range"]))
+        vectorizer = HashingVectorizer(**params)
+    model = CompactLinearModel(array("coef.npy"), array("intercept.npy"), meta["classes"])
+    return vectorizer, model, meta
@@ -0,0 +1,170 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import anyio
+
+pwd_context = None
+
+
+def get_pwd_context():
+    # passlib is imported on first use, in whichever process does the hashing
+    global pwd_context
+    if pwd_context is None:
+        from passlib.context import CryptContext
+
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return pwd_context
+
+
+def truncate_password(password):
+    # Truncate to 72 bytes (not characters) to comply with bcrypt limit
+    return password.encode('utf-8')[:72].decode('utf-8', errors='ignore')
+
+
+def verify_password(plain_password, hashed_password):
+    return get_pwd_context().verify(truncate_password(plain_password), hashed_password)
+
+
+def get_password_hash(password):
+    return get_pwd_context().hash(truncate_password(password))
+
+
+def warm_worker():
+    get_pwd_context()
+    return os.getpid()
+
+
+def timed_call(fn, *args):
+    # Runs in the worker; the start time lets the caller measure queue wait
+    started = time.time()
+    return fn(*args), started, time.time()
+
+
+def stop_executor(executor):
+    # cancel_futures is Python 3.9+; on 3.8 calls still queued run before the workers exit
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown(wait=False)
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+# Runs bcrypt off the request workers on a small process pool with admission control
+class PasswordHasher:
+    def __init__(self, workers=2, max_pending=32, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.hash_time = 0.0
+        self.recent = deque()
+
+    def get_executor(self):
+        if self.executor is None:
+            # spawn keeps bcrypt workers independent of the server's threads and sockets
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.executor
+
+    async def warm_up(self):
+        if self.workers > 0:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(self.get_executor(), warm_worker) for _ in range(self.workers)])
+        else:
+            await anyio.to_thread.run_sync(get_pwd_context)
+
+    def shutdown(self):
+        if self.executor is not None:
+            stop_executor(self.executor)
+            self.executor = None
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HasherBusyError("Too many password operations in progress")
+        submitted = time.time()
+        executor = None
+        try:
+            if self.workers > 0:
+                executor = self.get_executor()
+                future = asyncio.get_running_loop().run_in_executor(executor, timed_call, fn, *args)
+            else:
+                # Inline mode: share the request threadpool like plain sync endpoints do
+                future = asyncio.ensure_future(anyio.to_thread.run_sync(functools.partial(timed_call, fn, *args)))
+        except BrokenProcessPool:
+            self.reset_executor(executor)
+            raise HasherBusyError("Password worker pool failed")
+        # A timed-out call keeps its worker busy, so it stays pending until it actually finishes
+        self.pending += 1
+        future.add_done_callback(self.finished)
+        try:
+            result, started, finished = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise HasherBusyError("Password operation timed out")
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); the pool is unusable, so start a fresh one
+            self.reset_executor(executor)
+            raise HasherBusyError("Password worker pool failed")
+        self.record(max(0.0, started - submitted), finished - started, finished)
+        return result
+
+    def finished(self, future):
+        self.pending -= 1
+        if not future.cancelled():
+            # Mark a late failure as retrieved when nobody is waiting on it any more
+            future.exception()
+
+    def reset_executor(self, executor):
+        if executor is not None and self.executor is executor:
+            self.executor = None
+            stop_executor(executor)
+
+    async def hash(self, password):
+        return await self.run(get_password_hash, password)
+
+    async def verify(self, plain_password, hashed_password):
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def record(self, wait, duration, finished):
+        self.completed += 1
+        self.queue_wait += wait
+        self.max_queue_wait = max(self.max_queue_wait, wait)
+        self.hash_time += duration
+        self.recent.append(finished)
+        while self.recent and self.recent[0] < finished - 60:
+            self.recent.popleft()
+
+    def stats(self):
+        now = time.time()
+        while self.recent and self.recent[0] < now - 60:
+            self.recent.popleft()
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "per_second_last_minute": len(self.recent) / 60,
+            "avg_queue_wait_ms": self.queue_wait / self.completed * 1000 if self.completed else 0,
+            "max_queue_wait_ms": self.max_queue_wait * 1000,
+            "avg_hash_ms": self.hash_time / self.completed * 1000 if self.completed else 0,
+        }
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, key, user_id, payload):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.user_id = user_id
+        self.payload = payload
+        self.status = "queued"
+        self.stage = "queued"
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.updated_at = self.created_at
+        self.finished_at = None
+        self.changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "attempts": self.attempts,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+# Runs slow jobs on a bounded worker pool; identical in-flight jobs share one run
+class JobQueue:
+    def __init__(self, handler, concurrency=2, max_queue=256, max_attempts=3, retry_backoff=1.0, retry_if=None, job_ttl=3600, persist=None):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        # Decides whether a failure is transient; by default everything is retried
+        self.retry_if = retry_if or (lambda e: True)
+        self.job_ttl = job_ttl
+        # Called with (user_id, snapshot) after every change, in order on its own thread, so the
+        # state can be shared with other processes
+        self.persist = persist
+        self.persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-persist") if persist else None
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="jobs")
+        self.jobs = {}
+        self.inflight = {}
+        self.queue = None
+        self.workers = []
+        self.loop = None
+        self.running = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.retries = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.run_time = 0.0
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.workers and self.loop is loop and not any(worker.done() for worker in self.workers):
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        # Jobs queued on a previous loop can never run
+        self.inflight = {}
+        self.workers = [loop.create_task(self.run()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        for worker in self.workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self.workers = []
+
+    def submit(self, key, user_id, payload):
+        self.ensure_started()
+        self.purge()
+        job = self.inflight.get(key)
+        if job is not None:
+            self.deduplicated += 1
+            return job
+        job = Job(key, user_id, payload)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFullError("Job queue is full")
+        self.submitted += 1
+        self.jobs[job.id] = job
+        self.inflight[key] = job
+        self.share(job)
+        return job
+
+    def get(self, job_id):
+        self.purge()
+        return self.jobs.get(job_id)
+
+    def purge(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def update(self, job, **changes):
+        # Always called on the event loop; wakes anyone waiting on the job
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated_at = datetime.utcnow()
+        changed, job.changed = job.changed, asyncio.Event()
+        changed.set()
+        self.share(job)
+
+    def share(self, job):
+        if self.persist is not None:
+            self.persist_executor.submit(self.save, job.user_id, job.snapshot())
+
+    async def flush(self):
+        # Waits for the changes shared so far to be persisted
+        if self.persist is not None:
+            await asyncio.wrap_future(self.persist_executor.submit(lambda: None))
+
+    def save(self, user_id, snapshot):
+        try:
+            self.persist(user_id, snapshot)
+        except Exception:
+            logger.exception("Could not persist job %s", snapshot["job_id"])
+
+    def progress(self, job, stage):
+        # Thread-safe; handlers call this to report which step they are on
+        self.loop.call_soon_threadsafe(lambda: self.update(job, stage=stage))
+
+    async def wait(self, job, timeout=None):
+        # Returns once the job changes (or immediately if it is already done)
+        if job.done:
+            return
+        try:
+            await asyncio.wait_for(job.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def retry_later(self, job, delay):
+        await asyncio.sleep(delay)
+        await self.queue.put(job)
+
+    def finish(self, job, **changes):
+        self.inflight.pop(job.key, None)
+        job.finished_at = time.time()
+        self.update(job, **changes)
+
+    async def run(self):
+        while True:
+            job = await self.queue.get()
+            job.attempts += 1
+            self.update(job, status="running", stage="running")
+            self.running += 1
+            started = time.perf_counter()
+            try:
+                result = await self.loop.run_in_executor(self.executor, self.handler, job)
+            except Exception as e:
+                if job.attempts < self.max_attempts and self.retry_if(e):
+                    self.retries += 1
+                    delay = self.retry_backoff * 2 ** (job.attempts - 1)
+                    logger.info("Job %s failed (attempt %d), retrying in %.1fs: %s", job.id, job.attempts, delay, e)
+                    self.update(job, status="queued", stage="retrying", error=str(e))
+                    self.loop.create_task(self.retry_later(job, delay))
+                else:
+                    self.failed += 1
+                    self.finish(job, status="failed", stage="failed", error=str(e))
+            else:
+                self.succeeded += 1
+                self.finish(job, status="succeeded", stage="done", result=result, error=None)
+            finally:
+                self.running -= 1
+                self.run_time += time.perf_counter() - started
+
+    def stats(self):
+        runs = self.succeeded + self.failed + self.retries
+        return {
+            "concurrency": self.concurrency,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "in_flight": len(self.inflight),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "avg_run_ms": self.run_time / runs * 1000 if runs else 0,
+        }
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, bindparam, text
+
+from app.archive import ARCHIVE_DIR, archive_idle_chats, compact_segments
+from app.metrics import metrics
+from app.storage import BLOB_DIR, THUMB_DIR, TMP_DIR, UPLOAD_DIR, derived_paths, discard
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background passes (0 disables them; POST /maintenance/run still works)
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+SEARCH_HISTORY_RETENTION_DAYS = float(os.getenv("SEARCH_HISTORY_RETENTION_DAYS", "90"))
+# Files younger than this are never collected: they may belong to an upload still in flight
+UPLOAD_GC_GRACE_HOURS = float(os.getenv("UPLOAD_GC_GRACE_HOURS", "24"))
+# Pages freed per incremental_vacuum step; each step is its own short write transaction
+VACUUM_STEP_PAGES = int(os.getenv("MAINTENANCE_VACUUM_STEP_PAGES", "2000"))
+# One-off full VACUUM for databases created before auto_vacuum=INCREMENTAL; it locks the database while it runs
+MAINTENANCE_FULL_VACUUM = os.getenv("MAINTENANCE_FULL_VACUUM", "false").lower() == "true"
+DELETE_BATCH = 5000
+LOOKUP_BATCH = 500
+
+MAINTENANCE_SECONDS = metrics.histogram(
+    "kaisang_maintenance_task_seconds", "Duration of one maintenance task", ("task",),
+    (0.01, 0.1, 1.0, 10.0, 60.0, 300.0, 1800.0),
+)
+MAINTENANCE_RECLAIMED = metrics.counter("kaisang_maintenance_reclaimed_bytes", "Bytes freed on disk by maintenance", ("task",))
+
+ORPHANED = "user_id IS NULL OR user_id NOT IN (SELECT id FROM users)"
+
+
+@contextmanager
+def write_locked(engine):
+    # A write that touches nothing still takes SQLite's write lock, so checks made inside see
+    # no concurrent writer (an upload between creating its blob file and committing, say)
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            conn.execute(text("UPDATE blobs SET ref_count = ref_count WHERE 0"))
+        yield conn
+
+
+def remove_blobs(conn, rows):
+    # rows: (sha256, path, thumbnail_path, preview_path); files go while the write lock is held
+    removed = 0
+    for sha256, *paths in rows:
+        for path in {*paths, *derived_paths(sha256).values()}:
+            removed += file_size(path)
+            discard(path)
+    if rows:
+        conn.execute(
+            text("DELETE FROM blobs WHERE sha256 IN :keys").bindparams(bindparam("keys", expanding=True)),
+            {"keys": [row[0] for row in rows]},
+        )
+    return removed
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def sweep_orphans(engine):
+    # Rows whose owner is gone (accounts deleted before delete_account cleaned up after itself)
+    # and blobs no image references any more
+    report = {"messages": 0, "chats": 0, "images": 0, "projects": 0, "search_queries": 0, "blob_refs_fixed": 0, "blobs": 0, "reclaimed_bytes": 0}
+    # Looked for without the write lock first; there is usually nothing to do
+    checks = [f"SELECT 1 FROM {table} WHERE {ORPHANED}" for table in ("chats", "images", "projects", "search_queries")]
+    checks.append("SELECT 1 FROM blobs WHERE ref_count != (SELECT COUNT(*) FROM images WHERE images.sha256 = blobs.sha256)")
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT " + " OR ".join(f"EXISTS ({check})" for check in checks))).scalar():
+            return report
+    with write_locked(engine) as conn:
+        orphan_chats = f"SELECT id FROM chats WHERE {ORPHANED}"
+        conn.execute(text(f"DELETE FROM chat_archives WHERE chat_id IN ({orphan_chats})"))
+        report["messages"] = conn.execute(text(f"DELETE FROM messages WHERE chat_id IN ({orphan_chats})")).rowcount
+        report["chats"] = conn.execute(text(f"DELETE FROM chats WHERE {ORPHANED}")).rowcount
+        report["images"] = conn.execute(text(f"DELETE FROM images WHERE {ORPHANED}")).rowcount
+        # Projects are cleared from surviving chats and images first, as delete_project does
+        orphan_projects = f"SELECT id FROM projects WHERE {ORPHANED}"
+        for table in ("chats", "images"):
+            conn.execute(text(f"UPDATE {table} SET project_id = NULL WHERE project_id IN ({orphan_projects})"))
+        report["projects"] = conn.execute(text(f"DELETE FROM projects WHERE {ORPHANED}")).rowcount
+        report["search_queries"] = conn.execute(text(f"DELETE FROM search_queries WHERE {ORPHANED}")).rowcount
+        # Recount references; any drift (e.g. images deleted above) shows up here
+        report["blob_refs_fixed"] = conn.execute(text("""
+            UPDATE blobs SET ref_count = (SELECT COUNT(*) FROM images WHERE images.sha256 = blobs.sha256)
+            WHERE ref_count != (SELECT COUNT(*) FROM images WHERE images.sha256 = blobs.sha256)
+        """)).rowcount
+        blobs = conn.execute(text("SELECT sha256, path, thumbnail_path, preview_path FROM blobs WHERE ref_count <= 0")).fetchall()
+        report["blobs"] = len(blobs)
+        report["reclaimed_bytes"] = remove_blobs(conn, blobs)
+    return report
+
+
+def prune_search_history(engine, retention_days=SEARCH_HISTORY_RETENTION_DAYS):
+    report = {"search_queries": 0}
+    if retention_days <= 0:
+        return report
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    statement = text(
+        "DELETE FROM search_queries WHERE id IN (SELECT id FROM search_queries WHERE timestamp < :cutoff LIMIT :limit)"
+    ).bindparams(bindparam("cutoff", type_=DateTime))
+    # Batches in separate transactions so searches are never blocked for long
+    while True:
+        with engine.begin() as conn:
+            deleted = conn.execute(statement, {"cutoff": cutoff, "limit": DELETE_BATCH}).rowcount
+        report["search_queries"] += deleted
+        if deleted < DELETE_BATCH:
+            return report
+
+
+def stale_files(directory, cutoff):
+    # Regular files directly under directory last modified before cutoff
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return []
+    return [entry.path for entry in entries if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff]
+
+
+def collect_upload_garbage(engine, grace_hours=UPLOAD_GC_GRACE_HOURS):
+    # Files under UPLOAD_DIR that no row points at: abandoned temp uploads, blob files and
+    # thumbnails of deleted blobs, and legacy uploads of deleted images
+    cutoff = time.time() - grace_hours * 3600
+    report = {"tmp": 0, "blobs": 0, "thumbnails": 0, "legacy": 0, "reclaimed_bytes": 0}
+
+    def collect(kind, paths):
+        for path in paths:
+            # Checked again under the lock; the file may have been replaced since it was listed
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime < cutoff:
+                discard(path)
+                report["reclaimed_bytes"] += stat.st_size
+                report[kind] += 1
+
+    collect("tmp", stale_files(TMP_DIR, cutoff))
+    for root, kind in ((BLOB_DIR, "blobs"), (THUMB_DIR, "thumbnails")):
+        for prefix in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            files = stale_files(os.path.join(root, prefix), cutoff)
+            for start in range(0, len(files), LOOKUP_BATCH):
+                batch = files[start:start + LOOKUP_BATCH]
+                # Blob files are named <sha256><ext>, thumbnails <sha256>_<size>.webp
+                keys = {os.path.basename(path)[:64] for path in batch}
+                with write_locked(engine) as conn:
+                    rows = conn.execute(
+                        text("SELECT sha256, path, thumbnail_path, preview_path FROM blobs WHERE sha256 IN :keys")
+                        .bindparams(bindparam("keys", expanding=True)),
+                        {"keys": list(keys)},
+                    ).fetchall()
+                    if kind == "blobs":
+                        keep = {os.path.abspath(path) for _, path, _, _ in rows}
+                    else:
+                        keep = {os.path.abspath(p) for sha256, _, *paths in rows for p in (*paths, *derived_paths(sha256).values()) if p}
+                    collect(kind, [path for path in batch if os.path.abspath(path) not in keep])
+    # Uploads from before the blob store were written straight into UPLOAD_DIR
+    legacy = stale_files(UPLOAD_DIR, cutoff)
+    if legacy:
+        with write_locked(engine) as conn:
+            keep = {os.path.abspath(path) for path, in conn.execute(text("SELECT path FROM images WHERE sha256 IS NULL AND path IS NOT NULL"))}
+            collect("legacy", [path for path in legacy if os.path.abspath(path) not in keep])
+    return report
+
+
+def optimize_database(engine):
+    # Returns freed pages to the filesystem and refreshes planner statistics (SQLite only;
+    # other databases run their own autovacuum)
+    if engine.dialect.name != "sqlite" or engine.url.database in (None, "", ":memory:"):
+        return {"skipped": engine.dialect.name}
+    wal_path = engine.url.database + "-wal"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+
+        def pragma(name):
+            return conn.execute(text(f"PRAGMA {name}")).scalar()
+
+        page_size = pragma("page_size")
+        pages_before = pragma("page_count")
+        report = {"auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(pragma("auto_vacuum")), "free_pages": pragma("freelist_count")}
+        if report["auto_vacuum"] == "incremental":
+            while pragma("freelist_count"):
+                conn.execute(text(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})"))
+        elif report["free_pages"] and MAINTENANCE_FULL_VACUUM:
+            # Rebuilds the file; setting the mode first switches it to incremental for next time
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+            report["full_vacuum"] = True
+        elif report["free_pages"]:
+            logger.info("%d free pages can only be reclaimed by a full VACUUM (MAINTENANCE_FULL_VACUUM=true)", report["free_pages"])
+        report["free_pages_left"] = pragma("freelist_count")
+        pages_after = pragma("page_count")
+        # The WAL only holds pages waiting to be copied into the database; emptying it is
+        # reported on its own and doesn't count as reclaimed space
+        wal_before = file_size(wal_path)
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        report["wal_truncated_bytes"] = max(0, wal_before - file_size(wal_path))
+        # ANALYZE only the tables whose statistics are stale, sampling at most 1000 rows per index
+        conn.execute(text("PRAGMA analysis_limit = 1000"))
+        conn.execute(text("PRAGMA optimize"))
+    report["size_bytes"] = pages_after * page_size
+    report["reclaimed_bytes"] = max(0, pages_before - pages_after) * page_size
+    return report
+
+
+def default_tasks(engine):
+    # Order matters: orphans and archiving free pages that the final vacuum then returns
+    return [
+        ("orphans", lambda: sweep_orphans(engine)),
+        ("search_history", lambda: prune_search_history(engine)),
+        ("archive_segments", lambda: compact_segments(engine)),
+        ("archive_chats", lambda: archive_idle_chats(engine)),
+        ("uploads", lambda: collect_upload_garbage(engine)),
+        ("database", lambda: optimize_database(engine)),
+    ]
+
+
+# Runs the maintenance tasks every interval on one background thread; with several workers
+# a lock file makes sure only one of them runs a pass at a time
+class MaintenanceRunner:
+    def __init__(self, tasks, interval=MAINTENANCE_INTERVAL, lock_path=os.path.join(ARCHIVE_DIR, ".maintenance.lock")):
+        self.tasks = tasks
+        self.interval = interval
+        self.lock_path = lock_path
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance")
+        self.worker = None
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.reclaimed_bytes = 0
+        self.last_run = None
+
+    def ensure_started(self):
+        if self.interval > 0 and (self.worker is None or self.worker.done()):
+            self.worker = asyncio.get_running_loop().create_task(self.loop())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_now()
+
+    async def run_now(self, names=None):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.run, names)
+
+    @contextmanager
+    def exclusive(self):
+        if fcntl is None:
+            yield True
+            return
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        with open(self.lock_path, "w") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def run(self, names=None):
+        # One pass over the tasks (or just the named ones); a failing task does not stop the rest
+        with self.exclusive() as acquired:
+            if not acquired:
+                self.skipped += 1
+                return {"skipped": "another worker is running maintenance"}
+            self.running = True
+            started = time.perf_counter()
+            report = {"started_at": datetime.utcnow().isoformat(), "tasks": {}}
+            try:
+                for name, task in self.tasks:
+                    if names and name not in names:
+                        continue
+                    task_started = time.perf_counter()
+                    try:
+                        result = task()
+                    except Exception as e:
+                        logger.exception("Maintenance task %s failed", name)
+                        self.failures += 1
+                        result = {"error": str(e)}
+                    elapsed = time.perf_counter() - task_started
+                    MAINTENANCE_SECONDS.observe(elapsed, task=name)
+                    reclaimed = result.get("reclaimed_bytes", 0)
+                    if reclaimed:
+                        MAINTENANCE_RECLAIMED.inc(reclaimed, task=name)
+                    report["tasks"][name] = {**result, "ms": round(elapsed * 1000, 1)}
+            finally:
+                self.running = False
+            report["reclaimed_bytes"] = sum(task.get("reclaimed_bytes", 0) for task in report["tasks"].values())
+            report["elapsed_s"] = round(time.perf_counter() - started, 3)
+            self.runs += 1
+            self.reclaimed_bytes += report["reclaimed_bytes"]
+            self.last_run = report
+        logger.info("Maintenance pass reclaimed %d bytes in %.1fs", report["reclaimed_bytes"], report["elapsed_s"])
+        return report
+
+    def stats(self):
+        return {
+            "interval_s": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "last_run": self.last_run,
+        }
+
+
+if __name__ == "__main__":
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    # Same schema setup as the app, then one pass of every task
+    from app.api import init_db
+    from app.database import engine
+
+    init_db()
+    print(json.dumps(MaintenanceRunner(default_tasks(engine), interval=0).run(), indent=2))
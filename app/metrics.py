@@ -0,0 +1,252 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Per-request SQL accounting; the object is shared with threadpool copies of the context
+current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    @property
+    def family(self):
+        # The 0.0.4 text format names a counter family after its samples, suffix included
+        return f"{self.name}_total"
+
+    def header(self):
+        return [f"# HELP {self.family} {self.help}", f"# TYPE {self.family} {self.kind}"]
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [f"{self.family}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # [per-bucket counts, sum, count]; cumulated at render time
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge(Metric):
+    # Read at scrape time from a callback, e.g. a queue depth
+    kind = "gauge"
+
+    def __init__(self, name, help, read):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", self.name, e)
+            return []
+        return self.header() + [f"{self.name} {format_value(value)}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read):
+        return self.register(Gauge(name, help, read))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = metrics.histogram("kaisang_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+HTTP_REQUEST_SQL_QUERIES = metrics.histogram("kaisang_http_request_sql_queries", "SQL statements executed per HTTP request", ("route",), COUNT_BUCKETS)
+HTTP_REQUEST_SQL_SECONDS = metrics.histogram("kaisang_http_request_sql_seconds", "Time spent in SQL per HTTP request", ("route",))
+WEBSOCKET_MESSAGE_SECONDS = metrics.histogram("kaisang_websocket_message_duration_seconds", "Time to handle one WebSocket message", ("route",))
+WEBSOCKET_SHED = metrics.counter("kaisang_websocket_shed", "Chat WebSocket messages answered with a busy frame instead of being processed", ("reason",))
+SQL_QUERY_SECONDS = metrics.histogram("kaisang_sql_query_duration_seconds", "SQL statement latency by operation", ("operation",))
+PREDICT_SECONDS = metrics.histogram("kaisang_predict_batch_duration_seconds", "Time spent in predict_batch")
+PREDICT_TEXTS = metrics.counter("kaisang_predict_texts", "Texts classified by predict_batch")
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def record(self, statement, elapsed):
+        with self.lock:
+            self.queries += 1
+            self.sql_time += elapsed
+            count, total = self.statements.get(statement, (0, 0.0))
+            self.statements[statement] = (count + 1, total + elapsed)
+
+    def breakdown(self, limit=5):
+        with self.lock:
+            items = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return "; ".join(f"{count}x {total * 1000:.1f}ms {' '.join(statement.split())[:200]}" for statement, (count, total) in items)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    SQL_QUERY_SECONDS.observe(elapsed, operation=statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+    stats = current_request.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+
+def instrument_engine(engine):
+    # Works for async engines through their sync_engine
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def timed(fn, histogram, counter=None):
+    # Wraps a batch function, observing its duration and the number of items
+    def wrapper(items):
+        started = time.perf_counter()
+        try:
+            return fn(items)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            if counter is not None:
+                counter.inc(len(items))
+    return wrapper
+
+
+def route_name(scope):
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+# Pure ASGI middleware so timing covers the whole request, including streaming bodies
+class MetricsMiddleware:
+    def __init__(self, app, slow_request_ms=0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            route = route_name(scope)
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status)
+            HTTP_REQUEST_SQL_QUERIES.observe(stats.queries, route=route)
+            HTTP_REQUEST_SQL_SECONDS.observe(stats.sql_time, route=route)
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                logger.warning(
+                    "Slow request %s %s -> %s in %.1fms (%d queries, %.1fms SQL): %s",
+                    scope["method"], route, status, elapsed * 1000, stats.queries, stats.sql_time * 1000, stats.breakdown(),
+                )
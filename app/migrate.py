@@ -0,0 +1,127 @@
+import json
+import logging
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Matches how SQLAlchemy stores DateTime values in SQLite
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def parse_timestamp(value, default):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def can_drop_column(engine):
+    if engine.dialect.name != "sqlite":
+        return True
+    return sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def migrate_chat_messages(engine):
+    # Move legacy chats.messages JSON blobs into the append-only messages table
+    columns = {column["name"] for column in inspect(engine).get_columns("chats")}
+    if "messages" not in columns:
+        return 0
+    moved = 0
+    with engine.begin() as conn:
+        rows = conn.execute(text("SELECT id, messages, created_at FROM chats WHERE messages IS NOT NULL")).fetchall()
+        for chat_id, blob, created_at in rows:
+            messages = json.loads(blob) if isinstance(blob, str) else (blob or [])
+            if not messages:
+                continue
+            created_at = parse_timestamp(created_at, datetime.utcnow())
+            start = conn.execute(
+                text("SELECT COALESCE(MAX(seq), 0) FROM messages WHERE chat_id = :chat_id"),
+                {"chat_id": chat_id},
+            ).scalar()
+            params = [
+                {
+                    "chat_id": chat_id,
+                    "seq": start + i,
+                    "role": message.get("role", "user"),
+                    "content": message.get("content", ""),
+                    "timestamp": parse_timestamp(message.get("timestamp"), created_at).strftime(TIMESTAMP_FORMAT),
+                }
+                for i, message in enumerate(messages, start=1)
+            ]
+            conn.execute(
+                text("INSERT INTO messages (chat_id, seq, role, content, timestamp) VALUES (:chat_id, :seq, :role, :content, :timestamp)"),
+                params,
+            )
+            moved += len(params)
+        if can_drop_column(engine):
+            conn.execute(text("ALTER TABLE chats DROP COLUMN messages"))
+        else:
+            conn.execute(text("UPDATE chats SET messages = NULL"))
+    logger.info("Migrated %d messages out of chats.messages", moved)
+    return moved
+
+
+def migrate_search_queries(engine):
+    # Replace the full results payload with hit_count/result_ids
+    columns = {column["name"] for column in inspect(engine).get_columns("search_queries")}
+    if "results" not in columns:
+        return 0
+    with engine.begin() as conn:
+        for name, ddl in (("filters", "JSON"), ("hit_count", "INTEGER DEFAULT 0"), ("result_ids", "JSON")):
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE search_queries ADD COLUMN {name} {ddl}"))
+        rows = conn.execute(text("SELECT id, results FROM search_queries WHERE results IS NOT NULL")).fetchall()
+        params = []
+        for query_id, blob in rows:
+            payload = json.loads(blob) if isinstance(blob, str) else (blob or {})
+            ids = [result.get("id") for result in (payload or {}).get("results", [])]
+            params.append({"id": query_id, "hit_count": len(ids), "result_ids": json.dumps(ids)})
+        if params:
+            conn.execute(
+                text("UPDATE search_queries SET hit_count = :hit_count, result_ids = :result_ids WHERE id = :id"),
+                params,
+            )
+        if can_drop_column(engine):
+            conn.execute(text("ALTER TABLE search_queries DROP COLUMN results"))
+        else:
+            conn.execute(text("UPDATE search_queries SET results = NULL"))
+    logger.info("Slimmed %d search history rows", len(params))
+    return len(params)
+
+
+def add_missing_columns(engine, metadata):
+    # create_all never alters existing tables; add nullable columns declared since
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                ddl = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {ddl}"))
+                logger.info("Added column %s.%s", table.name, column.name)
+
+
+def create_missing_indexes(engine, metadata):
+    # create_all only builds indexes for new tables; add any declared since
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # The app's init_db creates missing tables and applies the migrations above
+    from app.api import init_db
+
+    init_db()
+    print("✅ Database migrated")
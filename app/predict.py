@@ -1,51 +1,245 @@
+import hashlib
 import pickle
 import random
 import json
+import os
 import re
+import threading
+from datetime import datetime
 
-# Load model and vectorizer
-with open("models/model.pkl", "rb") as f:
-    model = pickle.load(f)
+MODEL_PATH = os.getenv("MODEL_PATH", "models/model.pkl")
+VECTORIZER_PATH = os.getenv("VECTORIZER_PATH", "models/vectorizer.pkl")
+INTENTS_PATH = os.getenv("INTENTS_PATH", "data/intents.json")
+# Pointer to the current training run's pickles, written by app.train after both are in place
+MODEL_MANIFEST_PATH = os.getenv("MODEL_MANIFEST_PATH", "models/manifest.json")
+# Pointer to the current memory-mapped export written by app.train
+COMPACT_MODEL_PATH = os.getenv("COMPACT_MODEL_PATH", "models/compact.json")
+# auto: compact export when present, else pickles; compact/pickle force one
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "auto")
+# classifier: the trained model picks the intent; retrieval: the closest pattern in
+# intents.json does, falling back when its cosine score is below RETRIEVAL_MIN_SCORE
+PREDICT_ENGINE = os.getenv("PREDICT_ENGINE", "classifier")
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))
+PREDICT_ENGINES = ("classifier", "retrieval")
 
-with open("models/vectorizer.pkl", "rb") as f:
-    vectorizer = pickle.load(f)
+FALLBACK_RESPONSE = "I don't understand..."
 
-# Load intents
-with open("data/intents.json") as f:
-    intents = json.load(f)
+# Regex to match emojis
+EMOJI_PATTERN = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002700-\U000027BF"  # dingbats
+    "\U0001f926-\U0001f937"  # gestures
+    "\U00010000-\U0010ffff"  # other unicode
+    "\u2640-\u2642"  # gender symbols
+    "\u2600-\u2B55"  # misc symbols
+    "\u200d"  # zero width joiner
+    "\u23cf"  # eject symbol
+    "\u23e9"  # fast forward
+    "\u231a"  # watch
+    "\ufe0f"  # variation selector
+    "\u3030"  # wavy dash
+    "]+",
+    flags=re.UNICODE
+)
 
 def remove_emojis(text):
-    # Regex to match emojis
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        "\U00002700-\U000027BF"  # dingbats
-        "\U0001f926-\U0001f937"  # gestures
-        "\U00010000-\U0010ffff"  # other unicode
-        "\u2640-\u2642"  # gender symbols
-        "\u2600-\u2B55"  # misc symbols
-        "\u200d"  # zero width joiner
-        "\u23cf"  # eject symbol
-        "\u23e9"  # fast forward
-        "\u231a"  # watch
-        "\ufe0f"  # variation selector
-        "\u3030"  # wavy dash
-        "]+",
-        flags=re.UNICODE
-    )
-    return emoji_pattern.sub('', text)
+    return EMOJI_PATTERN.sub('', text)
+
+
+# Immutable snapshot of everything needed to answer a message
+class ModelBundle:
+    def __init__(self, model, vectorizer, intents, version, format="pickle", engine="classifier"):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.intents = intents
+        self.version = version
+        self.format = format
+        self.engine = engine
+        self.loaded_at = datetime.utcnow()
+        self.pattern_index = None
+        self.pattern_index_lock = threading.Lock()
+        # tag -> sanitized responses, so replies are a dict lookup
+        self.responses = {
+            intent["tag"]: [remove_emojis(r) for r in intent["responses"]]
+            for intent in intents["intents"]
+        }
+
+    def get_response(self, tag):
+        choices = self.responses.get(tag)
+        if not choices:
+            return FALLBACK_RESPONSE
+        return random.choice(choices)
+
+    @property
+    def retrieval(self):
+        # Built from intents.json alone, so new patterns need a reload rather than retraining
+        if self.pattern_index is None:
+            with self.pattern_index_lock:
+                if self.pattern_index is None:
+                    from app.retrieval import PatternIndex
+
+                    self.pattern_index = PatternIndex(self.intents, min_score=RETRIEVAL_MIN_SCORE)
+        return self.pattern_index
+
+    def predict_batch(self, texts):
+        if not texts:
+            return []
+        if self.engine == "retrieval":
+            tags = self.retrieval.predict_tags(texts)
+        else:
+            # One sparse matrix and one classifier call for the whole batch
+            tags = self.model.predict(self.vectorizer.transform(texts))
+        return [self.get_response(tag) for tag in tags]
+
+
+class ModelRegistry:
+    def __init__(self, model_path=MODEL_PATH, vectorizer_path=VECTORIZER_PATH, intents_path=INTENTS_PATH,
+                 compact_path=COMPACT_MODEL_PATH, model_format=MODEL_FORMAT, engine=PREDICT_ENGINE,
+                 manifest_path=MODEL_MANIFEST_PATH):
+        if engine not in PREDICT_ENGINES:
+            raise ValueError(f"Unknown predict engine: {engine}")
+        self.paths = (model_path, vectorizer_path, intents_path)
+        self.compact_path = compact_path
+        self.manifest_path = manifest_path
+        self.model_format = model_format
+        self.engine = engine
+        # Only loads take the lock; readers grab self.current without waiting
+        self.lock = threading.Lock()
+        self.fingerprint = None
+        self.current = None
+
+    @property
+    def bundle(self):
+        # Loaded on first use (or by the startup warm-up) so importing the app stays cheap
+        bundle = self.current
+        if bundle is None:
+            self.reload(force=False)
+            bundle = self.current
+        return bundle
+
+    @property
+    def loaded(self):
+        return self.current is not None
+
+    def use_compact(self):
+        if self.model_format == "auto":
+            return os.path.exists(self.compact_path)
+        return self.model_format == "compact"
+
+    def watched_paths(self):
+        # A pointer file changes in one os.replace, so it is watched instead of what it points at
+        if self.use_compact():
+            return (self.compact_path, self.paths[2])
+        if os.path.exists(self.manifest_path):
+            return (self.manifest_path, self.paths[2])
+        return self.paths
+
+    def stat_files(self):
+        return {p: (os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in self.watched_paths()}
+
+    def changed(self, fingerprint):
+        previous = self.fingerprint
+        if previous is None or previous.keys() != fingerprint.keys():
+            return True
+        changed = {p for p in fingerprint if fingerprint[p] != previous[p]}
+        # Bare pickles are replaced one at a time; reloading between the two would pair a
+        # new vectorizer with the old model, so wait until both have been replaced
+        pair = set(self.paths[:2])
+        if changed & pair and not pair <= changed:
+            return False
+        return bool(changed)
+
+    def pickle_paths(self):
+        model_path, vectorizer_path, _ = self.paths
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            base = os.path.dirname(self.manifest_path)
+            return os.path.join(base, manifest["model"]), os.path.join(base, manifest["vectorizer"])
+        return model_path, vectorizer_path
+
+    def load(self):
+        intents_path = self.paths[2]
+        digest = hashlib.sha256()
+        if self.use_compact():
+            with open(self.compact_path) as f:
+                pointer = json.load(f)
+            from app.compact import load_compact
+
+            vectorizer, model, meta = load_compact(os.path.join(os.path.dirname(self.compact_path), pointer["path"]))
+            digest.update(meta["digest"].encode())
+            model_format = "compact"
+        else:
+            model_path, vectorizer_path = self.pickle_paths()
+            with open(model_path, "rb") as f:
+                data = f.read()
+                digest.update(data)
+                model = pickle.loads(data)
+            with open(vectorizer_path, "rb") as f:
+                data = f.read()
+                digest.update(data)
+                vectorizer = pickle.loads(data)
+            model_format = "pickle"
+        with open(intents_path, "rb") as f:
+            data = f.read()
+            digest.update(data)
+            intents = json.loads(data)
+        bundle = ModelBundle(model, vectorizer, intents, digest.hexdigest()[:12], model_format, self.engine)
+        if self.engine == "retrieval":
+            # Index before the swap, so the first request after a reload doesn't pay for it
+            bundle.retrieval
+        return bundle
+
+    def reload(self, force=True):
+        with self.lock:
+            fingerprint = self.stat_files()
+            if not force and self.current is not None and not self.changed(fingerprint):
+                return False
+            bundle = self.load()
+            # Single attribute assignment: in-flight calls keep the bundle they started with
+            self.current = bundle
+            self.fingerprint = fingerprint
+            return True
+
+    def reload_if_changed(self):
+        # Nothing to refresh until something has asked for the model
+        if self.current is None:
+            return False
+        return self.reload(force=False)
+
+    def info(self):
+        bundle = self.bundle
+        model_path, vectorizer_path, intents_path = self.paths
+        return {
+            "version": bundle.version,
+            "format": bundle.format,
+            "engine": bundle.engine,
+            "loaded_at": bundle.loaded_at.isoformat(),
+            "model_path": model_path,
+            "vectorizer_path": vectorizer_path,
+            "compact_path": self.compact_path,
+            "manifest_path": self.manifest_path,
+            "intents_path": intents_path,
+            "intents": len(bundle.responses),
+            "tags": sorted(bundle.responses),
+            "retrieval": bundle.pattern_index.stats() if bundle.pattern_index is not None else None,
+        }
+
+
+registry = ModelRegistry()
 
 def get_response(tag):
-    for intent in intents["intents"]:
-        if intent["tag"] == tag:
-            response = random.choice(intent["responses"])
-            return remove_emojis(response)
-    return "I don't understand..."
+    return registry.bundle.get_response(tag)
 
 def predict(text: str) -> str:
-    X = vectorizer.transform([text])
-    tag = model.predict(X)[0]
-    return get_response(tag)
+    return registry.bundle.predict_batch([text])[0]
+
+def predict_batch(texts: list) -> list:
+    return registry.bundle.predict_batch(texts)
+
+def match_batch(texts: list, k: int = 5) -> list:
+    return registry.bundle.retrieval.matches(texts, k)
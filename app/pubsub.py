@@ -0,0 +1,295 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PUBSUB_DELIVERY_SECONDS = metrics.histogram(
+    "kaisang_pubsub_delivery_seconds", "Time from publish to the frame being sent to a subscriber", ("backend",)
+)
+
+
+# Delivers to subscribers in this process only; enough for a single worker
+class InProcessBroker:
+    name = "memory"
+
+    def __init__(self):
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel, message):
+        self.deliver([(channel, message)])
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+# Cross-process bus on a shared SQLite file: every worker appends events and polls for
+# the ones written by the others. Local subscribers are served directly, without the round trip
+class SQLiteBroker:
+    name = "sqlite"
+
+    def __init__(self, path, poll_interval=0.02, retention=60, max_batch=1000):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.max_batch = max_batch
+        self.node = uuid.uuid4().hex
+        # One thread owns the connection, so statements never interleave
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pubsub")
+        self.conn = None
+        self.deliver = None
+        self.poller = None
+        self.pending = []
+        self.flushing = None
+        self.last_id = 0
+        self.written = 0
+        self.received = 0
+        self.polls = 0
+        self.write_batches = 0
+
+    def open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, node TEXT NOT NULL, "
+            "payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_events_created_at ON events (created_at)")
+        self.conn = conn
+        # Only events published after we joined are delivered
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        loop = asyncio.get_running_loop()
+        self.last_id = await loop.run_in_executor(self.executor, self.open)
+        self.poller = loop.create_task(self.poll())
+
+    async def stop(self):
+        if self.poller is not None:
+            self.poller.cancel()
+            try:
+                await self.poller
+            except asyncio.CancelledError:
+                pass
+            self.poller = None
+        if self.flushing is not None:
+            await self.flushing
+        if self.conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.conn.close)
+            self.conn = None
+
+    async def publish(self, channel, message):
+        self.deliver([(channel, message)])
+        # Publishes from the same loop iteration are written in one transaction
+        self.pending.append((channel, self.node, json.dumps(message), time.time()))
+        if self.flushing is None:
+            self.flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        await asyncio.sleep(0)
+        rows, self.pending = self.pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.write, rows)
+        except Exception as e:
+            logger.warning("Dropped %d pub/sub events: %s", len(rows), e)
+        finally:
+            self.flushing = None
+            if self.pending:
+                self.flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    def write(self, rows):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany("INSERT INTO events (channel, node, payload, created_at) VALUES (?, ?, ?, ?)", rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.written += len(rows)
+        self.write_batches += 1
+
+    def read(self, last_id):
+        rows = self.conn.execute(
+            "SELECT id, channel, node, payload FROM events WHERE id > ? ORDER BY id LIMIT ?", (last_id, self.max_batch)
+        ).fetchall()
+        self.polls += 1
+        # Piggyback retention on the poll; every worker trims, which is harmless
+        if self.polls % 500 == 0:
+            self.conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - self.retention,))
+        return rows
+
+    async def poll(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                rows = await loop.run_in_executor(self.executor, self.read, self.last_id)
+            except Exception as e:
+                logger.warning("Pub/sub poll failed: %s", e)
+                rows = []
+            if rows:
+                self.last_id = rows[-1][0]
+                batch = [(channel, json.loads(payload)) for _, channel, node, payload in rows if node != self.node]
+                if batch:
+                    self.received += len(batch)
+                    self.deliver(batch)
+            # A full batch means more are waiting, so read again straight away
+            if len(rows) < self.max_batch:
+                await asyncio.sleep(self.poll_interval)
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "written": self.written,
+            "write_batches": self.write_batches,
+            "received": self.received,
+            "polls": self.polls,
+            "last_id": self.last_id,
+        }
+
+
+class Subscriber:
+    def __init__(self, channel, websocket, max_pending):
+        self.id = uuid.uuid4().hex
+        self.channel = channel
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.sender = None
+
+
+# Tracks the WebSockets subscribed to each channel and fans broker messages out to them.
+# Each subscriber has its own sender task, so one slow socket never delays the others
+class ConnectionManager:
+    def __init__(self, broker, max_pending=256):
+        self.broker = broker
+        self.max_pending = max_pending
+        self.channels = {}
+        # Server-side handlers per channel, e.g. cache invalidations sent by other workers
+        self.listeners = {}
+        self.loop = None
+        self.starting = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.send_batches = 0
+        self.delivery_time = 0.0
+
+    async def start(self):
+        if self.starting is None:
+            self.loop = asyncio.get_running_loop()
+            self.starting = self.loop.create_task(self.broker.start(self.dispatch))
+        # Concurrent first subscribers all wait on the same start
+        await asyncio.shield(self.starting)
+
+    async def stop(self):
+        for subscribers in list(self.channels.values()):
+            for subscriber in list(subscribers):
+                await self.unsubscribe(subscriber)
+        if self.starting is not None:
+            await self.broker.stop()
+            self.starting = None
+
+    async def subscribe(self, channel, websocket):
+        await self.start()
+        subscriber = Subscriber(channel, websocket, self.max_pending)
+        subscriber.sender = asyncio.get_running_loop().create_task(self.send_loop(subscriber))
+        self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    async def unsubscribe(self, subscriber):
+        subscribers = self.channels.get(subscriber.channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[subscriber.channel]
+        if subscriber.sender is not None and subscriber.sender is not asyncio.current_task():
+            subscriber.sender.cancel()
+            try:
+                await subscriber.sender
+            except asyncio.CancelledError:
+                pass
+
+    async def publish(self, channel, frames, origin=None):
+        # frames are pre-encoded text frames; the origin subscriber already has them
+        message = {"frames": frames, "origin": origin.id if origin else None, "published_at": time.time()}
+        self.published += 1
+        await self.broker.publish(channel, message)
+
+    def listen(self, channel, callback):
+        self.listeners.setdefault(channel, []).append(callback)
+
+    def notify(self, channel, message):
+        # Publishes to every worker's listeners; safe to call from threadpool threads
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: self.loop.create_task(self.broker.publish(channel, message)))
+
+    def dispatch(self, batch):
+        for channel, message in batch:
+            for callback in self.listeners.get(channel, ()):
+                callback(message)
+            for subscriber in self.channels.get(channel, ()):
+                if subscriber.id == message["origin"]:
+                    continue
+                try:
+                    subscriber.queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # The client is not reading; it can catch up from GET /chats/{id}
+                    self.dropped += 1
+
+    async def send_loop(self, subscriber):
+        while True:
+            batch = [await subscriber.queue.get()]
+            while not subscriber.queue.empty():
+                batch.append(subscriber.queue.get_nowait())
+            self.send_batches += 1
+            try:
+                for message in batch:
+                    for frame in message["frames"]:
+                        await subscriber.websocket.send_text(frame)
+                    elapsed = max(0.0, time.time() - message["published_at"])
+                    PUBSUB_DELIVERY_SECONDS.observe(elapsed, backend=self.broker.name)
+                    self.delivery_time += elapsed
+                    self.delivered += 1
+            except Exception as e:
+                logger.debug("Dropping subscriber %s on %s: %s", subscriber.id, subscriber.channel, e)
+                await self.unsubscribe(subscriber)
+                return
+
+    def stats(self):
+        return {
+            **self.broker.stats(),
+            "channels": len(self.channels),
+            "subscribers": sum(len(subscribers) for subscribers in self.channels.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "send_batches": self.send_batches,
+            "avg_delivery_ms": self.delivery_time / self.delivered * 1000 if self.delivered else 0,
+        }
+
+
+def get_broker(name, path=None, poll_interval=0.02):
+    if name == "memory":
+        return InProcessBroker()
+    if name == "sqlite":
+        return SQLiteBroker(path, poll_interval=poll_interval)
+    raise ValueError(f"Unknown pub/sub backend: {name}")
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Token bucket per key (e.g. user id); the least recently used buckets are evicted past maxsize
+class RateLimiter:
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def acquire(self, key):
+        # Returns 0 when a token was taken, otherwise the seconds until one is available
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                wait = 0
+                self.allowed += 1
+            else:
+                self.buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self.buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
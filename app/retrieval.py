@@ -0,0 +1,84 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+# Nearest-pattern lookup over every pattern in intents.json. Rows are L2-normalised TF-IDF
+# vectors, so one sparse product yields the cosine similarity to every pattern at once
+class PatternIndex:
+    def __init__(self, intents, min_score=0.3, ngram_range=(1, 2)):
+        patterns, tags = [], []
+        for intent in intents["intents"]:
+            for pattern in intent.get("patterns", []):
+                patterns.append(pattern)
+                tags.append(intent["tag"])
+        self.patterns = patterns
+        self.tags = tags
+        self.min_score = min_score
+        self.vectorizer = TfidfVectorizer(ngram_range=ngram_range, sublinear_tf=True, dtype=np.float32)
+        try:
+            matrix = self.vectorizer.fit_transform(patterns)
+        except ValueError:
+            # No patterns, or none with a usable token: every lookup falls back
+            self.postings = None
+            return
+        # Transposed to (terms, patterns) CSR, so a query only reads the rows of its own terms
+        self.postings = matrix.T.tocsr()
+        self.analyze = self.vectorizer.build_analyzer()
+        self.vocabulary = self.vectorizer.vocabulary_
+        self.idf = self.vectorizer.idf_.astype(np.float32)
+
+    def vectorize(self, texts):
+        # Same weighting as the fitted vectorizer (1 + log tf, idf, l2), without the per-call
+        # validation and diagonal idf product that dominate TfidfVectorizer.transform on short texts
+        indptr, indices, counts = [0], [], []
+        for text in texts:
+            row = {}
+            for token in self.analyze(text):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    row[column] = row.get(column, 0) + 1
+            indices.extend(row)
+            counts.extend(row.values())
+            indptr.append(len(indices))
+        indices = np.array(indices, dtype=np.int32)
+        data = np.log(np.array(counts, dtype=np.float32)) + 1
+        data *= self.idf[indices]
+        rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+        data /= np.sqrt(np.bincount(rows, weights=data * data, minlength=len(texts)))[rows].astype(np.float32)
+        return sp.csr_matrix((data, indices, np.array(indptr, dtype=np.int32)), shape=(len(texts), len(self.idf)))
+
+    def search_batch(self, texts, k=5):
+        # Top-k (pattern index, score) pairs per text, best first
+        if self.postings is None or not texts:
+            return [[] for _ in texts]
+        scores = self.vectorize(texts) @ self.postings
+        results = []
+        for row in range(len(texts)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            data, columns = scores.data[start:end], scores.indices[start:end]
+            top = np.argpartition(-data, k)[:k] if len(data) > k else np.arange(len(data))
+            top = top[np.argsort(-data[top], kind="stable")]
+            results.append([(int(columns[i]), float(data[i])) for i in top])
+        return results
+
+    def matches(self, texts, k=5):
+        return [
+            [{"tag": self.tags[i], "pattern": self.patterns[i], "score": round(score, 4)} for i, score in hits]
+            for hits in self.search_batch(texts, k)
+        ]
+
+    def predict_tags(self, texts):
+        # Tag of the closest pattern, or None when nothing is similar enough to trust
+        return [
+            self.tags[hits[0][0]] if hits and hits[0][1] >= self.min_score else None
+            for hits in self.search_batch(texts, 1)
+        ]
+
+    def stats(self):
+        return {
+            "patterns": len(self.patterns),
+            "terms": self.postings.shape[0] if self.postings is not None else 0,
+            "nnz": int(self.postings.nnz) if self.postings is not None else 0,
+            "min_score": self.min_score,
+        }
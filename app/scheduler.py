@@ -0,0 +1,121 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# Coalesces concurrent predict calls into one vectorized predict_batch call
+class InferenceScheduler:
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=5, max_queue=1024, threads=1):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="inference")
+        self.queue = None
+        self.worker = None
+        self.loop = None
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.batch_sizes = {}
+        self.wait_time = 0.0
+        self.inference_time = 0.0
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self.worker is not None and self.loop is loop and not self.worker.done():
+            return
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.worker = loop.create_task(self.run())
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def submit(self, text: str) -> str:
+        self.ensure_started()
+        future = self.loop.create_future()
+        try:
+            self.queue.put_nowait((text, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError("Inference queue is full")
+        self.requests += 1
+        return await future
+
+    async def collect(self):
+        # Wait for the first request, then keep the window open for max_wait
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            # wait_for() can time out after get() already took an item, losing that request and
+            # leaving its caller hanging; a getter that finishes despite the cancel keeps its item
+            getter = asyncio.ensure_future(self.queue.get())
+            await asyncio.wait([getter], timeout=timeout)
+            if not getter.done():
+                getter.cancel()
+                await asyncio.wait([getter])
+                if getter.cancelled():
+                    break
+            batch.append(getter.result())
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.collect()
+            batch = [item for item in batch if not item[1].cancelled()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            try:
+                results = await self.loop.run_in_executor(self.executor, self.predict_batch, texts)
+            except Exception as e:
+                results = None
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.record(batch, started)
+            if results is not None:
+                for (_, future, _), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    def record(self, batch, started):
+        size = len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, size)
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        self.wait_time += sum(started - enqueued for _, _, enqueued in batch)
+        self.inference_time += time.perf_counter() - started
+
+    def stats(self):
+        processed = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue": self.max_queue,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self.requests,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "avg_batch_size": processed / self.batches if self.batches else 0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "avg_queue_wait_ms": self.wait_time / processed * 1000 if processed else 0,
+            "avg_inference_ms": self.inference_time / self.batches * 1000 if self.batches else 0,
+        }
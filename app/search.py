@@ -0,0 +1,351 @@
+import html
+import logging
+import os
+import re
+import sqlite3
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, text
+
+from app.archive import load_archived, read_member
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto")
+SNIPPETS_PER_CHAT = 3
+SNIPPET_WORDS = 12
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# Snippets are HTML: matches are first marked with control characters, which html.escape
+# leaves alone, and only become tags once the message text around them is escaped
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+def isoformat(value):
+    # Raw SQL returns SQLite DateTime values as strings
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.isoformat()
+
+
+def build_filters(user_id, chat_id=None, date_from=None, date_to=None):
+    clauses = ["c.user_id = :user_id"]
+    params = {"user_id": user_id}
+    if chat_id:
+        clauses.append("c.id = :chat_id")
+        params["chat_id"] = chat_id
+    if date_from:
+        clauses.append("c.created_at >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        clauses.append("c.created_at <= :date_to")
+        params["date_to"] = date_to
+    return " AND ".join(clauses), params
+
+
+def prepare(sql, params):
+    # Dates are bound as DateTime so they compare like the stored column values
+    statement = text(sql)
+    for name in ("date_from", "date_to"):
+        if name in params:
+            statement = statement.bindparams(bindparam(name, type_=DateTime))
+    return statement
+
+
+def render_snippet(marked):
+    return html.escape(marked).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def group_hits(rows, chat_order):
+    # rows: (chat_id, seq, role, content, timestamp, snippet) in relevance order
+    hits = {chat_id: [] for chat_id in chat_order}
+    for chat_id, seq, role, content, timestamp, snippet in rows:
+        if len(hits[chat_id]) < SNIPPETS_PER_CHAT:
+            hits[chat_id].append({
+                "seq": seq,
+                "role": role,
+                "content": content,
+                "snippet": render_snippet(snippet),
+                "timestamp": isoformat(timestamp),
+            })
+    return hits
+
+
+# Interface every search backend implements; results are grouped per chat
+class SearchBackend:
+    name = "base"
+
+    def setup(self, engine):
+        pass
+
+    def search(self, db, query, user_id, chat_id=None, date_from=None, date_to=None, limit=20, offset=0):
+        raise NotImplementedError
+
+    def defer_indexing(self, db):
+        # Wraps bulk message inserts in db's transaction; backends may index them in one pass
+        return nullcontext()
+
+
+# Portable fallback: substring match in SQL, ranked by number of matching messages
+class LikeSearchBackend(SearchBackend):
+    name = "like"
+
+    def highlight(self, content, query):
+        match = re.search(re.escape(query), content, flags=re.IGNORECASE)
+        if not match:
+            return content
+        start = max(0, match.start() - 60)
+        end = min(len(content), match.end() + 60)
+        return (
+            ("…" if start else "")
+            + content[start:match.start()]
+            + MATCH_START + match.group(0) + MATCH_END
+            + content[match.end():end]
+            + ("…" if end < len(content) else "")
+        )
+
+    def search_archived(self, db, query, filters, params):
+        # Archived chats have no message rows, so their segments are scanned instead; returns
+        # {chat_id: (created_at, matching messages, newest first)}
+        chats = dict(db.execute(prepare(f"SELECT c.id, c.created_at FROM chats c WHERE c.archived_at IS NOT NULL AND {filters}", params), params).fetchall())
+        needle = query.lower()
+        found = {}
+        for chat_id, messages in load_archived(db.get_bind(), chats).items():
+            matched = [m for m in reversed(messages) if needle in m["content"].lower()]
+            if matched:
+                found[chat_id] = (chats[chat_id], matched)
+        return found
+
+    def search(self, db, query, user_id, chat_id=None, date_from=None, date_to=None, limit=20, offset=0):
+        filters, filter_params = build_filters(user_id, chat_id, date_from, date_to)
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        # Archived matches are merged in Python, so the page is cut after the merge
+        params = dict(filter_params, pattern=f"%{pattern}%", limit=offset + limit + 1)
+        matches = f"m.content LIKE :pattern ESCAPE '\\'"
+        ranked = db.execute(prepare(f"""
+            SELECT m.chat_id, c.created_at, COUNT(*) AS hits, MAX(m.seq) AS last_seq
+            FROM messages m JOIN chats c ON c.id = m.chat_id
+            WHERE {matches} AND {filters}
+            GROUP BY m.chat_id
+            ORDER BY hits DESC, last_seq DESC
+            LIMIT :limit
+        """, params), params).fetchall()
+        archived = self.search_archived(db, query, filters, filter_params)
+        merged = {chat_id: (created_at, count, last_seq) for chat_id, created_at, count, last_seq in ranked}
+        for chat_id, (created_at, matched) in archived.items():
+            # A turn written after archiving is a live row of an archived chat
+            _, count, last_seq = merged.get(chat_id, (created_at, 0, 0))
+            merged[chat_id] = (created_at, count + len(matched), max(last_seq, matched[0]["seq"]))
+        ranked = sorted(
+            ((chat_id, *values) for chat_id, values in merged.items()), key=lambda row: (row[2], row[3]), reverse=True
+        )[offset:offset + limit + 1]
+        has_more = len(ranked) > limit
+        ranked = ranked[:limit]
+        if not ranked:
+            return [], False
+        chat_ids = [row[0] for row in ranked]
+        rows = db.execute(
+            text(f"""
+                SELECT m.chat_id, m.seq, m.role, m.content, m.timestamp
+                FROM messages m
+                WHERE {matches} AND m.chat_id IN :chat_ids
+                ORDER BY m.seq DESC
+            """).bindparams(bindparam("chat_ids", expanding=True)),
+            {"pattern": params["pattern"], "chat_ids": chat_ids},
+        ).fetchall()
+        rows += [
+            (chat_id, m["seq"], m["role"], m["content"], m["timestamp"])
+            for chat_id in chat_ids if chat_id in archived
+            for m in archived[chat_id][1]
+        ]
+        hits = group_hits([(*row, self.highlight(row[3], query)) for row in rows], chat_ids)
+        results = [
+            {"id": chat_id, "created_at": isoformat(created_at), "score": float(count), "hits": count, "messages": hits[chat_id]}
+            for chat_id, created_at, count, _ in ranked
+        ]
+        return results, has_more
+
+
+# SQLite FTS5 index over messages.content, kept current by triggers
+class FTS5SearchBackend(SearchBackend):
+    name = "fts5"
+
+    SCHEMA = [
+        """CREATE VIRTUAL TABLE messages_fts USING fts5(
+            content, content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        # A row here (only ever visible inside a bulk import's own transaction) switches the
+        # per-row insert trigger off; the import indexes its messages in one statement instead
+        "CREATE TABLE IF NOT EXISTS messages_fts_suspend (active INTEGER)",
+        """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        WHEN NOT EXISTS (SELECT 1 FROM messages_fts_suspend) BEGIN
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+    ]
+
+    # Archived chats (app/archive.py) lose their message rows, so their text is copied into a
+    # table of its own as they are archived and dropped again when their archive row goes.
+    # rowid is chat_id << 32 | seq, so a chat's rows are one rowid range
+    ARCHIVE_SCHEMA = [
+        """CREATE VIRTUAL TABLE archived_messages_fts USING fts5(
+            content, role UNINDEXED, timestamp UNINDEXED,
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS archived_messages_fts_insert AFTER INSERT ON chat_archives BEGIN
+            INSERT INTO archived_messages_fts(rowid, content, role, timestamp)
+            SELECT (chat_id << 32) + seq, content, role, timestamp FROM messages WHERE chat_id = new.chat_id;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS archived_messages_fts_delete AFTER DELETE ON chat_archives BEGIN
+            DELETE FROM archived_messages_fts WHERE rowid BETWEEN old.chat_id << 32 AND (old.chat_id << 32) + 4294967295;
+        END""",
+    ]
+
+    def setup(self, engine):
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+            ).first()
+            if exists:
+                self.upgrade(conn)
+                return
+            for statement in self.SCHEMA + self.ARCHIVE_SCHEMA:
+                conn.execute(text(statement))
+            # Index messages written before the FTS table existed
+            conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+            self.index_archived(conn)
+        logger.info("Created messages_fts index")
+
+    def upgrade(self, conn):
+        # Indexes created before bulk imports existed have an unconditional insert trigger
+        trigger = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'messages_fts_insert'")
+        ).scalar()
+        if not trigger or "messages_fts_suspend" not in trigger:
+            conn.execute(text("DROP TRIGGER IF EXISTS messages_fts_insert"))
+            for statement in self.SCHEMA[1:3]:
+                conn.execute(text(statement))
+            logger.info("Upgraded messages_fts insert trigger")
+        if not conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archived_messages_fts'")).first():
+            for statement in self.ARCHIVE_SCHEMA:
+                conn.execute(text(statement))
+            self.index_archived(conn)
+            logger.info("Created archived_messages_fts index")
+
+    def index_archived(self, conn):
+        # Chats archived before archived_messages_fts existed are indexed from their segments
+        for chat_id, segment, offset, length in conn.execute(
+            text("SELECT chat_id, segment, byte_offset, byte_length FROM chat_archives")
+        ).fetchall():
+            try:
+                messages = read_member(segment, offset, length)["messages"]
+            except OSError as e:
+                logger.warning("Archived chat %s not indexed: %s", chat_id, e)
+                continue
+            if messages:
+                conn.execute(
+                    text("INSERT INTO archived_messages_fts(rowid, content, role, timestamp) VALUES (:rowid, :content, :role, :timestamp)"),
+                    [{"rowid": (chat_id << 32) + m["seq"], "content": m["content"], "role": m["role"], "timestamp": m["timestamp"]} for m in messages],
+                )
+
+    @contextmanager
+    def defer_indexing(self, db):
+        # The suspend row is written first so this transaction holds the write lock before
+        # reading the id high-water mark: every message above it is then one of ours
+        db.execute(text("INSERT INTO messages_fts_suspend (active) VALUES (1)"))
+        before = db.execute(text("SELECT COALESCE(MAX(id), 0) FROM messages")).scalar()
+        yield
+        db.execute(text("DELETE FROM messages_fts_suspend"))
+        db.execute(text("INSERT INTO messages_fts(rowid, content) SELECT id, content FROM messages WHERE id > :before"), {"before": before})
+
+    def match_expression(self, query):
+        # Quote every term so user input can't inject FTS5 syntax; prefix-match each term
+        terms = re.findall(r"\w+", query)
+        return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+    def search(self, db, query, user_id, chat_id=None, date_from=None, date_to=None, limit=20, offset=0):
+        expression = self.match_expression(query)
+        if not expression:
+            return [], False
+        filters, params = build_filters(user_id, chat_id, date_from, date_to)
+        params.update(query=expression, limit=limit + 1, offset=offset)
+        ranked = db.execute(prepare(f"""
+            SELECT chat_id, created_at, COUNT(*) AS hits, MIN(score) AS score
+            FROM (
+                SELECT m.chat_id, c.created_at, f.score
+                FROM (
+                    SELECT rowid, rank AS score FROM messages_fts WHERE messages_fts MATCH :query
+                ) f
+                JOIN messages m ON m.id = f.rowid
+                JOIN chats c ON c.id = m.chat_id
+                WHERE {filters}
+                UNION ALL
+                SELECT c.id, c.created_at, a.score
+                FROM (
+                    SELECT rowid, rank AS score FROM archived_messages_fts WHERE archived_messages_fts MATCH :query
+                ) a
+                JOIN chats c ON c.id = a.rowid >> 32
+                WHERE {filters}
+            )
+            GROUP BY chat_id
+            ORDER BY score
+            LIMIT :limit OFFSET :offset
+        """, params), params).fetchall()
+        has_more = len(ranked) > limit
+        ranked = ranked[:limit]
+        if not ranked:
+            return [], False
+        chat_ids = [row[0] for row in ranked]
+        rows = db.execute(
+            text(f"""
+                SELECT m.chat_id, m.seq, m.role, m.content, m.timestamp,
+                       snippet(messages_fts, 0, char(2), char(3), '…', {SNIPPET_WORDS}), messages_fts.rank AS score
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH :query AND m.chat_id IN :chat_ids
+                UNION ALL
+                SELECT rowid >> 32, rowid & 4294967295, role, content, timestamp,
+                       snippet(archived_messages_fts, 0, char(2), char(3), '…', {SNIPPET_WORDS}), rank
+                FROM archived_messages_fts
+                WHERE archived_messages_fts MATCH :query AND rowid >> 32 IN :chat_ids
+                ORDER BY score
+            """).bindparams(bindparam("chat_ids", expanding=True)),
+            {"query": expression, "chat_ids": chat_ids},
+        ).fetchall()
+        hits = group_hits([row[:6] for row in rows], chat_ids)
+        # bm25 is lower-is-better; flip it so higher scores rank first for clients
+        results = [
+            {"id": chat_id, "created_at": isoformat(created_at), "score": -score, "hits": count, "messages": hits[chat_id]}
+            for chat_id, created_at, count, score in ranked
+        ]
+        return results, has_more
+
+
+def fts5_available():
+    try:
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE VIRTUAL TABLE probe USING fts5(x)")
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def get_search_backend(engine, name=SEARCH_BACKEND):
+    if name == "auto":
+        name = "fts5" if engine.dialect.name == "sqlite" and fts5_available() else "like"
+    backends = {backend.name: backend for backend in (FTS5SearchBackend, LikeSearchBackend)}
+    if name not in backends:
+        raise ValueError(f"Unknown search backend: {name}")
+    backend = backends[name]()
+    backend.setup(engine)
+    return backend
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "1024"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+THUMB_DIR = os.path.join(UPLOAD_DIR, "thumbs")
+TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+
+thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+def ensure_dirs():
+    for path in (UPLOAD_DIR, BLOB_DIR, THUMB_DIR, TMP_DIR):
+        os.makedirs(path, exist_ok=True)
+
+
+def upload_url(path):
+    if not path:
+        return None
+    return "/uploads/" + os.path.relpath(path, UPLOAD_DIR).replace(os.sep, "/")
+
+
+def file_extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,8}", ext) else ".bin"
+
+
+def blob_path(sha256, ext):
+    # Fan out by hash prefix so no directory grows unbounded
+    return os.path.join(BLOB_DIR, sha256[:2], sha256 + ext)
+
+
+def stream_to_temp(fileobj, max_bytes=MAX_UPLOAD_BYTES):
+    # Copy in chunks, hashing as we write; returns (tmp_path, sha256, size)
+    ensure_dirs()
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        discard(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def write_temp(data):
+    ensure_dirs()
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_DIR)
+    with os.fdopen(fd, "wb") as out:
+        out.write(data)
+    return tmp_path, hashlib.sha256(data).hexdigest(), len(data)
+
+
+def commit_blob_file(tmp_path, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except (FileNotFoundError, TypeError):
+        pass
+
+
+def remove_files(*paths):
+    for path in paths:
+        discard(path)
+
+
+def derived_paths(sha256):
+    return {
+        "thumbnail_path": os.path.join(THUMB_DIR, sha256[:2], f"{sha256}_{THUMBNAIL_SIZE}.webp"),
+        "preview_path": os.path.join(THUMB_DIR, sha256[:2], f"{sha256}_{PREVIEW_SIZE}.webp"),
+    }
+
+
+def make_thumbnails(sha256, path):
+    # Returns the generated paths; raises if Pillow cannot read the file
+    from PIL import Image as PILImage, ImageOps
+
+    paths = derived_paths(sha256)
+    sizes = {"thumbnail_path": THUMBNAIL_SIZE, "preview_path": PREVIEW_SIZE}
+    with PILImage.open(path) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ("RGB", "RGBA"):
+            source = source.convert("RGBA" if "A" in source.getbands() else "RGB")
+        for name, target in paths.items():
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            image = source.copy()
+            # thumbnail() only ever shrinks, so small originals keep their size
+            image.thumbnail((sizes[name], sizes[name]))
+            image.save(target, "WEBP", quality=80)
+    return paths
@@ -1,10 +1,33 @@
+import argparse
+import csv
+import hashlib
 import json
+import os
 import pickle
 import random
+import time
+import zlib
+from datetime import datetime
+from itertools import islice
 
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
+from sklearn.pipeline import Pipeline
+
+from app.compact import UnsupportedModelError, export_compact
+
+MODELS_DIR = os.getenv("MODELS_DIR", "models")
+HASHING_FEATURES = 2 ** 20
+# Every example whose text hashes into this bucket is held out for evaluation
+HOLDOUT_BUCKETS = 10
+MIN_HOLDOUT_EXAMPLES = 50
+
+SEARCH_GRIDS = {
+    "batch": {"vectorizer__ngram_range": [(1, 1), (1, 2)], "model__C": [0.1, 1.0, 10.0]},
+    "incremental": {"vectorizer__ngram_range": [(1, 1), (1, 2)], "model__alpha": [1e-6, 1e-5, 1e-4]},
+}
 
 
 def load_data(path):
@@ -25,24 +48,287 @@ def prepare_data(intents):
     return texts, labels
 
 
-def train():
-    intents = load_data("data/intents.json")
-    texts, labels = prepare_data(intents)
+def iter_examples(path):
+    # Streams (text, tag) pairs from intents JSON, JSONL ({"text", "tag"}) or CSV (text,tag columns)
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row["text"], row["tag"]
+    elif path.endswith(".csv"):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                yield row["text"], row["tag"]
+    else:
+        yield from zip(*prepare_data(load_data(path)))
+
+
+def iter_all(paths):
+    for path in paths:
+        yield from iter_examples(path)
+
+
+def iter_chunks(examples, size):
+    examples = iter(examples)
+    while True:
+        chunk = list(islice(examples, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def is_holdout(text):
+    return zlib.crc32(text.encode("utf-8")) % HOLDOUT_BUCKETS == 0
+
+
+def reservoir_sample(examples, size, seed):
+    rng = random.Random(seed)
+    sample = []
+    for i, example in enumerate(examples):
+        if i < size:
+            sample.append(example)
+        else:
+            j = rng.randint(0, i)
+            if j < size:
+                sample[j] = example
+    return sample
+
+
+def build_pipeline(mode, seed=0):
+    if mode == "incremental":
+        vectorizer = HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False, norm="l2")
+        model = SGDClassifier(loss="log_loss", random_state=seed)
+    else:
+        vectorizer = TfidfVectorizer()
+        model = LogisticRegression(max_iter=1000)
+    return Pipeline([("vectorizer", vectorizer), ("model", model)])
+
+
+def search_params(mode, examples, folds, jobs, seed):
+    # Cross-validated grid search on a sample, fanned out over `jobs` processes
+    texts = [text for text, _ in examples]
+    labels = [tag for _, tag in examples]
+    smallest = min(np.unique(labels, return_counts=True)[1]) if labels else 0
+    folds = min(folds, smallest)
+    if folds < 2:
+        print("⚠️  Not enough examples per tag for cross-validation; using defaults")
+        return {}, None
+    search = GridSearchCV(
+        build_pipeline(mode, seed),
+        SEARCH_GRIDS[mode],
+        cv=StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed),
+        n_jobs=jobs,
+        scoring="accuracy",
+    )
+    started = time.perf_counter()
+    search.fit(texts, labels)
+    print(f"🔎 Best params {search.best_params_} (cv accuracy {search.best_score_:.3f}, {time.perf_counter() - started:.1f}s)")
+    return search.best_params_, search.best_score_
+
+
+def load_current(models_dir):
+    # Existing hashing/SGD artifacts can be updated in place; anything else starts fresh
+    try:
+        with open(os.path.join(models_dir, "model.pkl"), "rb") as f:
+            model = pickle.load(f)
+        with open(os.path.join(models_dir, "vectorizer.pkl"), "rb") as f:
+            vectorizer = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if isinstance(model, SGDClassifier) and isinstance(vectorizer, HashingVectorizer):
+        return vectorizer, model
+    return None
+
+
+def scan(paths):
+    # One cheap pass: the label set (partial_fit needs it up front) and whether a holdout is usable
+    classes, train_classes, holdout = set(), set(), 0
+    for text, tag in iter_all(paths):
+        classes.add(tag)
+        if is_holdout(text):
+            holdout += 1
+        else:
+            train_classes.add(tag)
+    # Tiny datasets (like the bundled intents) train on everything
+    return sorted(classes), holdout >= MIN_HOLDOUT_EXAMPLES and train_classes == classes
+
+
+def training_examples(paths, use_holdout):
+    for text, tag in iter_all(paths):
+        if not (use_holdout and is_holdout(text)):
+            yield text, tag
+
+
+def train_incremental(paths, classes, use_holdout, chunk_size, epochs, params, seed, resume, models_dir):
+    current = load_current(models_dir) if resume else None
+    if current:
+        vectorizer, model = current
+        unknown = set(classes) - set(model.classes_)
+        if unknown:
+            raise ValueError(f"New tags {sorted(unknown)} need a full retrain (drop --resume)")
+        classes = list(model.classes_)
+    else:
+        pipeline = build_pipeline("incremental", seed).set_params(**params)
+        vectorizer, model = pipeline.named_steps["vectorizer"], pipeline.named_steps["model"]
+    seen = 0
+    for epoch in range(epochs):
+        for chunk in iter_chunks(training_examples(paths, use_holdout), chunk_size):
+            texts, labels = zip(*chunk)
+            model.partial_fit(vectorizer.transform(texts), labels, classes=classes)
+            if epoch == 0:
+                seen += len(chunk)
+    return vectorizer, model, seen
+
+
+def train_batch(paths, use_holdout, params, seed):
+    texts, labels = [], []
+    for text, tag in training_examples(paths, use_holdout):
+        texts.append(text)
+        labels.append(tag)
+    pipeline = build_pipeline("batch", seed).set_params(**params)
+    pipeline.fit(texts, labels)
+    return pipeline.named_steps["vectorizer"], pipeline.named_steps["model"], len(texts)
+
+
+def evaluate(vectorizer, model, paths, use_holdout, chunk_size):
+    correct = total = train_correct = train_total = 0
+    for chunk in iter_chunks(iter_all(paths), chunk_size):
+        texts, labels = zip(*chunk)
+        predictions = model.predict(vectorizer.transform(texts))
+        for text, tag, predicted in zip(texts, labels, predictions):
+            if use_holdout and is_holdout(text):
+                total += 1
+                correct += predicted == tag
+            else:
+                train_total += 1
+                train_correct += predicted == tag
+    return {
+        "holdout_examples": total,
+        "holdout_accuracy": correct / total if total else None,
+        "train_accuracy": train_correct / train_total if train_total else None,
+    }
+
+
+def publish_compact(vectorizer, model, version, models_dir=MODELS_DIR):
+    # Export the array-backed copy next to the pickles and point models/compact.json at it
+    pointer_path = os.path.join(models_dir, "compact.json")
+    relative = os.path.join("versions", version, "compact")
+    try:
+        meta = export_compact(vectorizer, model, os.path.join(models_dir, relative))
+    except UnsupportedModelError as e:
+        # A stale pointer would shadow the new pickles, so fall back to them
+        print(f"⚠️  Compact export skipped: {e}")
+        if os.path.exists(pointer_path):
+            os.remove(pointer_path)
+        return None
+    tmp_path = pointer_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version, "path": relative, "digest": meta["digest"]}, f, indent=2)
+    os.replace(tmp_path, pointer_path)
+    return relative
+
+
+def export_current(models_dir=MODELS_DIR):
+    # Converts the live pickles without retraining
+    with open(os.path.join(models_dir, "model.pkl"), "rb") as f:
+        model_bytes = f.read()
+    with open(os.path.join(models_dir, "vectorizer.pkl"), "rb") as f:
+        vectorizer_bytes = f.read()
+    version = f"{datetime.utcnow():%Y%m%d%H%M%S}-{hashlib.sha256(model_bytes + vectorizer_bytes).hexdigest()[:12]}"
+    relative = publish_compact(pickle.loads(vectorizer_bytes), pickle.loads(model_bytes), version, models_dir)
+    if relative:
+        print(f"✅ Exported compact model to {os.path.join(models_dir, relative)}")
+    return relative
+
+
+def save_artifacts(vectorizer, model, metadata, models_dir=MODELS_DIR):
+    # Write models/versions/<version>/ and then swap the live files atomically
+    model_bytes = pickle.dumps(model)
+    vectorizer_bytes = pickle.dumps(vectorizer)
+    digest = hashlib.sha256(model_bytes + vectorizer_bytes).hexdigest()[:12]
+    version = f"{datetime.utcnow():%Y%m%d%H%M%S}-{digest}"
+    version_dir = os.path.join(models_dir, "versions", version)
+    os.makedirs(version_dir, exist_ok=True)
+    metadata = dict(metadata, version=version, created_at=datetime.utcnow().isoformat())
+    for name, data in (("model.pkl", model_bytes), ("vectorizer.pkl", vectorizer_bytes)):
+        with open(os.path.join(version_dir, name), "wb") as f:
+            f.write(data)
+    with open(os.path.join(version_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2, default=str)
+    # The live pickles are kept up to date for tools that read them directly
+    for name, data in (("vectorizer.pkl", vectorizer_bytes), ("model.pkl", model_bytes)):
+        tmp_path = os.path.join(models_dir, f".{name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(models_dir, name))
+    # The model watcher follows models/manifest.json, which switches both files in one os.replace
+    relative = os.path.join("versions", version)
+    manifest_path = os.path.join(models_dir, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"version": version, "model": os.path.join(relative, "model.pkl"), "vectorizer": os.path.join(relative, "vectorizer.pkl")}, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    publish_compact(vectorizer, model, version, models_dir)
+    return version
 
-    vectorizer = TfidfVectorizer()
-    X = vectorizer.fit_transform(texts)
 
-    model = LogisticRegression(max_iter=1000)
-    model.fit(X, labels)
+def train(paths=("data/intents.json",), mode="batch", chunk_size=10000, epochs=1, search=False, folds=5,
+          jobs=-1, search_sample=20000, resume=False, seed=0, models_dir=MODELS_DIR):
+    started = time.perf_counter()
+    classes, use_holdout = scan(paths)
+    params, cv_accuracy = {}, None
+    if search:
+        sample = reservoir_sample(training_examples(paths, use_holdout), search_sample, seed)
+        params, cv_accuracy = search_params(mode, sample, folds, jobs, seed)
 
-    with open("models/vectorizer.pkl", "wb") as f:
-        pickle.dump(vectorizer, f)
+    fit_started = time.perf_counter()
+    if mode == "incremental":
+        vectorizer, model, examples = train_incremental(paths, classes, use_holdout, chunk_size, epochs, params, seed, resume, models_dir)
+    else:
+        vectorizer, model, examples = train_batch(paths, use_holdout, params, seed)
+    fit_seconds = time.perf_counter() - fit_started
 
-    with open("models/model.pkl", "wb") as f:
-        pickle.dump(model, f)
+    metrics = evaluate(vectorizer, model, paths, use_holdout, chunk_size)
+    metadata = {
+        "mode": mode,
+        "sources": list(paths),
+        "examples": examples,
+        "classes": [str(tag) for tag in model.classes_],
+        "params": params,
+        "cv_accuracy": cv_accuracy,
+        "fit_seconds": fit_seconds,
+        "training_seconds": time.perf_counter() - started,
+        **metrics,
+    }
+    version = save_artifacts(vectorizer, model, metadata, models_dir)
 
-    print("✅ Kaisang AI trained successfully")
+    if use_holdout:
+        accuracy = f"holdout accuracy {metrics['holdout_accuracy']:.3f} on {metrics['holdout_examples']}"
+    else:
+        accuracy = f"training accuracy {metrics['train_accuracy']:.3f} (too little data for a holdout)"
+    print(f"📊 {examples} examples, {len(model.classes_)} tags, {accuracy}, {metadata['training_seconds']:.1f}s")
+    print(f"✅ Kaisang AI trained successfully (version {version})")
+    return metadata
 
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the intent classifier")
+    parser.add_argument("data", nargs="*", default=["data/intents.json"], help="intents JSON, JSONL or CSV files")
+    parser.add_argument("--mode", choices=["batch", "incremental"], default="batch",
+                        help="batch: TF-IDF + LogisticRegression in memory; incremental: hashed features + SGD over chunks")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--epochs", type=int, default=1, help="passes over the data in incremental mode")
+    parser.add_argument("--resume", action="store_true", help="continue from the current incremental model")
+    parser.add_argument("--search", action="store_true", help="cross-validated hyperparameter search first")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=-1, help="parallel search workers (-1 = all cores)")
+    parser.add_argument("--search-sample", type=int, default=20000, help="examples sampled for the search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models-dir", default=MODELS_DIR)
+    parser.add_argument("--export", action="store_true", help="only export the current pickles to the compact format")
+    args = parser.parse_args()
+    if args.export:
+        export_current(args.models_dir)
+    else:
+        train(args.data, args.mode, args.chunk_size, args.epochs, args.search, args.folds, args.jobs,
+              args.search_sample, args.resume, args.seed, args.models_dir)
@@ -0,0 +1,117 @@
+# Measures how a burst of logins affects unrelated authenticated requests.
+#
+# Run from the repository root:
+#   python benchmarks/bench_auth.py --logins 64
+#
+# Each mode runs in its own process: "inline" hashes on the request threadpool
+# (HASH_POOL_WORKERS=0, the old behaviour) and "pool" uses the bcrypt process pool.
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import summarize  # noqa: E402
+
+
+async def probe(client, headers, latencies, stop):
+    # Cheap authenticated endpoint; its latency is what a login burst should not hurt
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get("/projects", headers=headers)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+
+
+async def run_mode(args):
+    import httpx
+    from app.api import app, password_hasher
+
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    transport = httpx.ASGITransport(app=app)
+    await app.router.startup()
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        await password_hasher.warm_up()
+        password = "bench-password"
+        response = await client.post("/auth/register", json={"username": prefix, "email": f"{prefix}@bench", "password": password})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        baseline = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, headers, baseline, stop))
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        await task
+
+        under_load = []
+        statuses = {}
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, headers, under_load, stop))
+
+        async def login():
+            response = await client.post("/auth/login", data={"username": prefix, "password": password})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[login() for _ in range(args.logins)])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await task
+
+        await client.delete("/account", headers=headers)
+    await app.router.shutdown()
+
+    return {
+        "hash_pool_workers": password_hasher.workers,
+        "logins": args.logins,
+        "login_statuses": statuses,
+        "burst_seconds": elapsed,
+        "logins_per_second": statuses.get(200, 0) / elapsed,
+        "probe_baseline": summarize(baseline),
+        "probe_under_load": summarize(under_load),
+        "hasher": password_hasher.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--baseline-seconds", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=2, help="process pool size for the pool mode")
+    parser.add_argument("--mode", choices=["inline", "pool"], help="run a single mode in this process")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(run_mode(args))))
+        return
+
+    results = {}
+    scratch = tempfile.mkdtemp(prefix="bench_auth_")
+    for mode, workers in (("inline", 0), ("pool", args.workers)):
+        env = dict(os.environ, HASH_POOL_WORKERS=str(workers), HASH_POOL_MAX_PENDING=str(max(32, args.logins)))
+        env.setdefault("DATABASE_URL", f"sqlite:///{scratch}/{mode}.db")
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--logins", str(args.logins),
+             "--baseline-seconds", str(args.baseline_seconds)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<8}{'logins/s':>10}{'probe p50':>12}{'probe p95':>12}{'probe p99':>12}  statuses")
+    for mode, result in results.items():
+        load = result["probe_under_load"]
+        print(
+            f"{mode:<8}{result['logins_per_second']:>10.1f}{load['p50_ms']:>10.1f}ms"
+            f"{load['p95_ms']:>10.1f}ms{load['p99_ms']:>10.1f}ms  {result['login_statuses']}"
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
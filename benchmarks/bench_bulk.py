@@ -0,0 +1,114 @@
+# Throughput of the bulk endpoints: NDJSON import and export, bulk move and bulk delete.
+#
+# Run from the repository root:
+#   python benchmarks/bench_bulk.py --chats 1000 --messages 1000 --output bulk.json
+#
+# The import body is generated on the fly and streamed to POST /import, so memory
+# stays flat however many messages are sent. rps in the table is rows per second
+# (projects + chats + messages), not requests.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import report, summarize, write_results  # noqa: E402
+
+
+def throughput(rows, elapsed):
+    result = summarize([elapsed], elapsed)
+    result.update(rows=rows, throughput_rps=rows / elapsed if elapsed else 0.0)
+    return result
+
+
+async def import_body(args, phrases):
+    rng = random.Random(args.seed)
+    lines = [{"type": "project", "id": i, "name": f"project {i}", "description": ""} for i in range(args.projects)]
+    yield "".join(json.dumps(line) + "\n" for line in lines).encode()
+    for i in range(args.chats):
+        messages = [
+            {"role": "user" if j % 2 == 0 else "ai", "content": rng.choice(phrases), "timestamp": "2024-01-01T00:00:00"}
+            for j in range(args.messages)
+        ]
+        project_id = i % args.projects if args.projects else None
+        yield (json.dumps({"type": "chat", "id": i, "project_id": project_id, "messages": messages}) + "\n").encode()
+
+
+async def run(args):
+    import httpx
+    from app.api import app
+    from dataset import generate, load_phrases
+
+    await app.router.startup()
+    try:
+        dataset = generate(users=1, chats_per_user=0, messages_per_chat=0, projects_per_user=0, images_per_user=0, seed=args.seed)
+        headers = {"Authorization": f"Bearer {dataset['users'][0]['token']}"}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as client:
+            results = {}
+
+            started = time.perf_counter()
+            response = await client.post("/import", content=import_body(args, load_phrases()), headers={"Content-Type": "application/x-ndjson"})
+            response.raise_for_status()
+            summary = response.json()
+            rows = summary["projects"] + summary["chats"] + summary["messages"]
+            results["import"] = throughput(rows, time.perf_counter() - started)
+            print(f"import: {rows} rows, {summary['error_count']} errors, {results['import']['throughput_rps']:.0f} rows/s", file=sys.stderr)
+
+            started = time.perf_counter()
+            chat_ids, rows = [], 0
+            async with client.stream("GET", "/export") as stream:
+                async for line in stream.aiter_lines():
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    rows += 1 + len(record.get("messages", ()))
+                    if record["type"] == "chat":
+                        chat_ids.append(record["id"])
+            results["export"] = throughput(rows, time.perf_counter() - started)
+            print(f"export: {rows} rows, {results['export']['throughput_rps']:.0f} rows/s", file=sys.stderr)
+
+            for name, path, body in (
+                ("bulk_move", "/chats/bulk-move", {"project_id": None}),
+                ("bulk_delete", "/chats/bulk-delete", {}),
+            ):
+                started = time.perf_counter()
+                for i in range(0, len(chat_ids), args.bulk_size):
+                    response = await client.post(path, json={"ids": chat_ids[i:i + args.bulk_size], **body})
+                    response.raise_for_status()
+                results[name] = throughput(len(chat_ids), time.perf_counter() - started)
+                print(f"{name}: {len(chat_ids)} chats, {results[name]['throughput_rps']:.0f} chats/s", file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=1000, help="messages per chat")
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--bulk-size", type=int, default=1000, help="ids per bulk move/delete request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench_bulk_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{scratch}/bench.db")
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(scratch, "uploads"))
+
+    results = asyncio.run(run(args))
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "threshold")}
+    document = write_results(args.output, "bulk", params, results) if args.output else {"results": results}
+    sys.exit(report(document, args.baseline, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Measures cold-start cost: importing app.api and getting to /ready.
+#
+# Run from the repository root:
+#   python benchmarks/bench_import.py --runs 5 --budget-ms 1500
+#
+# Every run is a fresh interpreter. "import" is the wall time of `import app.api`,
+# "startup" adds the startup hooks (schema creation) and "ready" waits for the
+# background warm-up. The slowest modules come from `python -X importtime`.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import ROOT, report, summarize, write_results  # noqa: E402
+
+PROBE = """
+import asyncio, json, time
+started = time.perf_counter()
+import app.api
+imported = time.perf_counter()
+
+async def boot():
+    await app.api.app.router.startup()
+    booted = time.perf_counter()
+    while not app.api.warm_up_state["done"]:
+        await asyncio.sleep(0.005)
+    ready = time.perf_counter()
+    await app.api.app.router.shutdown()
+    return booted, ready
+
+booted, ready = asyncio.run(boot())
+print(json.dumps({"import": imported - started, "startup": booted - started, "ready": ready - started}))
+"""
+
+
+def slowest_imports(env, limit):
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.api"], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in output.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--budget-ms", type=float, help="exit 1 if the median import exceeds this")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench_import_")
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{scratch}/bench.db")
+    env.setdefault("UPLOAD_DIR", os.path.join(scratch, "uploads"))
+
+    timings = {"import": [], "startup": [], "ready": []}
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+        for name, value in json.loads(output.strip().splitlines()[-1]).items():
+            timings[name].append(value)
+
+    print("Slowest imports (cumulative ms):")
+    for cumulative, name in slowest_imports(env, args.top):
+        print(f"  {cumulative:>8.1f}  {name}")
+
+    results = {f"cold_start_{name}": summarize(values) for name, values in timings.items()}
+    params = {"runs": args.runs}
+    document = write_results(args.output, "import", params, results) if args.output else {"results": results}
+    status = report(document, args.baseline, args.threshold)
+    median = results["cold_start_import"]["p50_ms"]
+    if args.budget_ms is not None:
+        if median > args.budget_ms:
+            print(f"OVER BUDGET import p50 {median:.0f}ms > {args.budget_ms:.0f}ms")
+            status = 1
+        else:
+            print(f"Within budget: import p50 {median:.0f}ms <= {args.budget_ms:.0f}ms")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+# Load benchmark for the REST, WebSocket and inference paths.
+#
+# Run from the repository root:
+#   python benchmarks/bench_load.py --output results.json
+#   python benchmarks/bench_load.py --baseline results.json   # exit 1 on regressions
+#
+# Seeds a synthetic dataset into a scratch database (unless DATABASE_URL is
+# set), runs the app in-process and drives each scenario with a fixed number of
+# requests from --concurrency workers. Client and server share one event loop,
+# so absolute numbers include client overhead; compare runs on the same machine.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import report, summarize, write_results  # noqa: E402
+
+SCENARIOS = ["get_chats", "get_chat", "search", "get_projects", "get_images", "predict", "login", "ws_chat", "ws_fanout"]
+
+
+class ASGIWebSocket:
+    # Minimal in-process WebSocket client speaking ASGI directly to the app
+    def __init__(self, app, path, params):
+        self.app = app
+        self.scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(params).encode(),
+            "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        self.task = asyncio.create_task(self.app(self.scope, self.incoming.get, self.outgoing.put))
+        await self.incoming.put({"type": "websocket.connect"})
+        message = await self.outgoing.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"WebSocket rejected: {message}")
+
+    async def send_text(self, text):
+        await self.incoming.put({"type": "websocket.receive", "text": text})
+
+    async def receive_json(self):
+        message = await self.outgoing.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError(f"WebSocket closed: {message.get('code')}")
+        return json.loads(message["text"])
+
+    async def close(self):
+        await self.incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+
+async def drive(total, concurrency, call):
+    # Shares one counter between workers so exactly `total` calls are made
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def rest_scenarios(client, dataset, seed):
+    users = dataset["users"]
+
+    def picker(name):
+        rng = random.Random(f"{seed}:{name}")
+        return rng, lambda i: users[i % len(users)]
+
+    def auth(user):
+        return {"Authorization": f"Bearer {user['token']}"}
+
+    def request(name, build):
+        rng, user_for = picker(name)
+
+        async def call(i):
+            user = user_for(i)
+            method, path, kwargs = build(rng, user)
+            response = await client.request(method, path, headers=auth(user), **kwargs)
+            return response.status_code < 400
+        return call
+
+    return {
+        "get_chats": request("get_chats", lambda rng, user: ("GET", "/chats", {})),
+        "get_chat": request("get_chat", lambda rng, user: ("GET", f"/chats/{rng.choice(user['chat_ids'])}", {})),
+        "search": request("search", lambda rng, user: ("POST", "/search", {"json": {"query": rng.choice(dataset["words"])}})),
+        "get_projects": request("get_projects", lambda rng, user: ("GET", "/projects", {})),
+        "get_images": request("get_images", lambda rng, user: ("GET", "/images", {})),
+        "predict": request("predict", lambda rng, user: ("POST", "/predict", {"json": {"text": rng.choice(dataset["phrases"])}})),
+        "login": request("login", lambda rng, user: ("POST", "/auth/login", {"data": {"username": user["username"], "password": user["password"]}})),
+    }
+
+
+async def run_ws_chat(app, dataset, args):
+    # Each connection sends --ws-messages messages; latency is per round trip
+    rng = random.Random(f"{args.seed}:ws_chat")
+    latencies = []
+    errors = 0
+
+    async def connection(i):
+        nonlocal errors
+        user = dataset["users"][i % len(dataset["users"])]
+        # Distinct chats, so no connection receives another's fanned-out replies
+        chat_id = user["chat_ids"][i // len(dataset["users"]) % len(user["chat_ids"])]
+        ws = ASGIWebSocket(app, f"/ws/chat/{chat_id}", {"token": user["token"]})
+        try:
+            await ws.connect()
+            for _ in range(args.ws_messages):
+                started = time.perf_counter()
+                await ws.send_text(rng.choice(dataset["phrases"]))
+                reply = await ws.receive_json()
+                if reply.get("role") == "ai":
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+            await ws.close()
+        except ConnectionError:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[connection(i) for i in range(args.ws_connections)])
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def run_ws_fanout(app, dataset, args):
+    # One sender and --fanout-listeners other sockets per chat; latency is from the send
+    # until the last listener has the reply, so it includes the pub/sub hop
+    rng = random.Random(f"{args.seed}:ws_fanout")
+    latencies = []
+    errors = 0
+
+    async def room(i):
+        nonlocal errors
+        user = dataset["users"][i % len(dataset["users"])]
+        # Like ws_chat, rooms get distinct chats so they don't hear each other
+        path = f"/ws/chat/{user['chat_ids'][i // len(dataset['users']) % len(user['chat_ids'])]}"
+        sockets = [ASGIWebSocket(app, path, {"token": user["token"]}) for _ in range(args.fanout_listeners + 1)]
+        sender, listeners = sockets[0], sockets[1:]
+
+        async def until_reply(ws):
+            while (await ws.receive_json()).get("role") != "ai":
+                pass
+
+        try:
+            for ws in sockets:
+                await ws.connect()
+            for _ in range(args.ws_messages):
+                started = time.perf_counter()
+                await sender.send_text(rng.choice(dataset["phrases"]))
+                await asyncio.gather(until_reply(sender), *[until_reply(ws) for ws in listeners])
+                latencies.append(time.perf_counter() - started)
+            for ws in sockets:
+                await ws.close()
+        except ConnectionError:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[room(i) for i in range(args.fanout_rooms)])
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+async def run(args):
+    import httpx
+    from app.api import app
+    from dataset import generate
+
+    # Startup creates the schema, so it has to run before seeding
+    await app.router.startup()
+    results = {}
+    try:
+        started = time.perf_counter()
+        dataset = generate(
+            users=args.users, chats_per_user=args.chats, messages_per_chat=args.messages,
+            projects_per_user=args.projects, images_per_user=args.images, seed=args.seed,
+        )
+        print(f"Seeded dataset in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            calls = rest_scenarios(client, dataset, args.seed)
+            for name in args.scenarios:
+                if name in ("ws_chat", "ws_fanout"):
+                    runner = run_ws_chat if name == "ws_chat" else run_ws_fanout
+                    results[name] = await runner(app, dataset, args)
+                    continue
+                total = args.logins if name == "login" else args.requests
+                await drive(min(args.warmup, total), args.concurrency, calls[name])
+                results[name] = await drive(total, args.concurrency, calls[name])
+                print(f"{name}: {results[name]['throughput_rps']:.1f} req/s", file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--requests", type=int, default=500, help="requests per REST scenario")
+    parser.add_argument("--logins", type=int, default=32, help="requests for the login scenario (bcrypt bound)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--ws-connections", type=int, default=16)
+    parser.add_argument("--ws-messages", type=int, default=20)
+    parser.add_argument("--fanout-rooms", type=int, default=8, help="chats in the ws_fanout scenario")
+    parser.add_argument("--fanout-listeners", type=int, default=4, help="extra sockets per ws_fanout chat")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=20, help="chats per user")
+    parser.add_argument("--messages", type=int, default=50, help="messages per chat")
+    parser.add_argument("--projects", type=int, default=5, help="projects per user")
+    parser.add_argument("--images", type=int, default=10, help="images per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench_load_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{scratch}/bench.db")
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(scratch, "uploads"))
+    # The per-user chat rate limit would otherwise dominate the WebSocket scenarios
+    os.environ.setdefault("CHAT_WS_RATE", "0")
+
+    results = asyncio.run(run(args))
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "threshold")}
+    document = write_results(args.output, "load", params, results) if args.output else {"results": results}
+    sys.exit(report(document, args.baseline, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
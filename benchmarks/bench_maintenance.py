@@ -0,0 +1,136 @@
+# Cost and payoff of the maintenance pass (app/maintenance.py): how fast idle chats are
+# archived, how much smaller the database gets, and what reopening an archived chat costs.
+#
+# Run from the repository root:
+#   python benchmarks/bench_maintenance.py --chats 2000 --messages 200 --output maintenance.json
+#
+# A --active fraction of the chats gets a message from today and stays in the database; the
+# rest are a year old and are archived. rps for "archive" is messages archived per second.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import report, summarize, write_results  # noqa: E402
+
+
+async def import_body(args, phrases):
+    rng = random.Random(args.seed)
+    old = (datetime.utcnow() - timedelta(days=365)).isoformat()
+    for i in range(args.chats):
+        messages = [
+            {"role": "user" if j % 2 == 0 else "ai", "content": rng.choice(phrases), "timestamp": old}
+            for j in range(args.messages)
+        ]
+        if rng.random() < args.active:
+            messages[-1]["timestamp"] = datetime.utcnow().isoformat()
+        yield (json.dumps({"type": "chat", "id": i, "messages": messages}) + "\n").encode()
+
+
+def database_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+async def open_chats(client, chat_ids):
+    latencies = []
+    started = time.perf_counter()
+    for chat_id in chat_ids:
+        call_started = time.perf_counter()
+        response = await client.get(f"/chats/{chat_id}")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def run(args, database):
+    import httpx
+    from app.api import app, maintenance
+    from dataset import generate, load_phrases
+
+    await app.router.startup()
+    try:
+        dataset = generate(users=1, chats_per_user=0, messages_per_chat=0, projects_per_user=0, images_per_user=0, seed=args.seed)
+        headers = {"Authorization": f"Bearer {dataset['users'][0]['token']}"}
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as client:
+            response = await client.post("/import", content=import_body(args, load_phrases()), headers={"Content-Type": "application/x-ndjson"})
+            response.raise_for_status()
+            size_before = database_size(database)
+
+            started = time.perf_counter()
+            run_report = await maintenance.run_now()
+            elapsed = time.perf_counter() - started
+            archived = run_report["tasks"]["archive_chats"]
+            size_after = database_size(database)
+            results = {"archive": summarize([elapsed], elapsed)}
+            results["archive"].update(
+                throughput_rps=archived["messages"] / elapsed if elapsed else 0.0,
+                chats=archived["chats"],
+                messages=archived["messages"],
+                compression=archived["raw_bytes"] / archived["archived_bytes"] if archived["archived_bytes"] else 0.0,
+                db_bytes_before=size_before,
+                db_bytes_after=size_after,
+                reclaimed_bytes=run_report["reclaimed_bytes"],
+            )
+            print(
+                f"archive: {archived['chats']} chats, {archived['messages']} messages in {elapsed:.2f}s; "
+                f"database {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB; segments {archived['archived_bytes'] / 1e6:.1f} MB",
+                file=sys.stderr,
+            )
+
+            chats = []
+            cursor = None
+            while True:
+                page = (await client.get("/chats", params={"limit": 200, **({"cursor": cursor} if cursor else {})})).json()
+                chats += page["items"]
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+            cold = [chat["id"] for chat in chats if chat["archived_at"]][:args.opens]
+            warm = [chat["id"] for chat in chats if not chat["archived_at"]][:args.opens]
+            results["open_warm"] = await open_chats(client, warm)
+            # First open restores the chat; the second is an ordinary read again
+            results["open_archived"] = await open_chats(client, cold)
+            results["reopen_restored"] = await open_chats(client, cold)
+            for name in ("open_warm", "open_archived", "reopen_restored"):
+                print(f"{name}: p50 {results[name]['p50_ms']:.2f}ms p95 {results[name]['p95_ms']:.2f}ms", file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=200, help="messages per chat")
+    parser.add_argument("--active", type=float, default=0.1, help="fraction of chats with recent activity")
+    parser.add_argument("--opens", type=int, default=100, help="chats opened per latency measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="bench_maintenance_")
+    database = os.path.join(scratch, "bench.db")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{database}")
+    os.environ.setdefault("UPLOAD_DIR", os.path.join(scratch, "uploads"))
+    os.environ.setdefault("CHAT_ARCHIVE_DIR", os.path.join(scratch, "archive"))
+    # Passes are started by the benchmark, not the background loop
+    os.environ.setdefault("MAINTENANCE_INTERVAL", "0")
+
+    results = asyncio.run(run(args, database))
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "threshold")}
+    document = write_results(args.output, "maintenance", params, results) if args.output else {"results": results}
+    sys.exit(report(document, args.baseline, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
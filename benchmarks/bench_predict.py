@@ -0,0 +1,66 @@
+# Microbenchmarks for the inference helpers in app/predict.py.
+#
+# Run from the repository root:
+#   python benchmarks/bench_predict.py --output predict.json [--baseline old.json]
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import ROOT, report, summarize, write_results  # noqa: E402
+
+
+def measure(fn, iterations, warmup):
+    # Per-call wall time; throughput_rps is calls per second
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    from app.predict import get_response, predict, predict_batch, registry, remove_emojis
+
+    with open(os.path.join(ROOT, "data", "intents.json")) as f:
+        intents = json.load(f)["intents"]
+    rng = random.Random(args.seed)
+    phrases = [pattern for intent in intents for pattern in intent["patterns"]]
+    tags = [intent["tag"] for intent in intents]
+    texts = [rng.choice(phrases) for _ in range(args.iterations + args.warmup)]
+    batch = [rng.choice(phrases) for _ in range(args.batch_size)]
+    emoji_text = "Hello there 👋 hope you're doing well 😀 see you soon 🚀 " * 4
+    cursor = iter(texts)
+
+    results = {
+        "predict": measure(lambda: predict(next(cursor)), args.iterations, args.warmup),
+        f"predict_batch[{args.batch_size}]": measure(lambda: predict_batch(batch), max(1, args.iterations // 10), args.warmup),
+        "get_response": measure(lambda: get_response(rng.choice(tags)), args.iterations, args.warmup),
+        "remove_emojis": measure(lambda: remove_emojis(emoji_text), args.iterations, args.warmup),
+    }
+    params = dict(vars(args), model_version=registry.info().get("version"))
+    params = {key: value for key, value in params.items() if key not in ("output", "baseline", "threshold")}
+    document = write_results(args.output, "predict", params, results) if args.output else {"results": results}
+    sys.exit(report(document, args.baseline, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# Compares the retrieval engine (app/retrieval.py) with the TF-IDF + LogisticRegression
+# classifier on a synthetic intents file.
+#
+# Run from the repository root:
+#   python benchmarks/bench_retrieval.py --patterns 100000 --intents 200 --output retrieval.json
+#
+# Patterns are drawn from per-intent topic words plus shared filler words. Queries are
+# held-out patterns with a word dropped and a filler word added; gibberish queries use
+# words neither engine has seen. Both engines are scored on the same queries.
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import report, summarize, write_results  # noqa: E402
+
+
+def make_word(rng, used):
+    while True:
+        word = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+        if word not in used:
+            used.add(word)
+            return word
+
+
+def synthesize(patterns, intents, topic_words, fillers, seed):
+    rng = random.Random(seed)
+    used = set()
+    filler = [make_word(rng, used) for _ in range(fillers)]
+    topics = [[make_word(rng, used) for _ in range(topic_words)] for _ in range(intents)]
+    document = {"intents": [{"tag": f"intent{i}", "patterns": [], "responses": [f"response {i}"]} for i in range(intents)]}
+    for n in range(patterns):
+        i = n % intents
+        words = rng.sample(topics[i], rng.randint(2, 4)) + rng.sample(filler, rng.randint(1, 3))
+        rng.shuffle(words)
+        document["intents"][i]["patterns"].append(" ".join(words))
+    unseen = [make_word(rng, used) for _ in range(1000)]
+    return document, filler, unseen
+
+
+def make_queries(document, filler, unseen, count, seed):
+    rng = random.Random(f"{seed}:queries")
+    intents = document["intents"]
+    queries = []
+    for _ in range(count):
+        intent = rng.choice(intents)
+        words = rng.choice(intent["patterns"]).split()
+        words.pop(rng.randrange(len(words)))
+        words.insert(rng.randrange(len(words) + 1), rng.choice(filler))
+        queries.append((" ".join(words), intent["tag"]))
+    gibberish = [" ".join(rng.sample(unseen, rng.randint(2, 5))) for _ in range(count)]
+    return queries, gibberish
+
+
+def measure(fn, inputs, warmup):
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = []
+    started = time.perf_counter()
+    for item in inputs:
+        call_started = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def batches(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patterns", type=int, default=100000)
+    parser.add_argument("--intents", type=int, default=200)
+    parser.add_argument("--topic-words", type=int, default=12, help="distinct words per intent")
+    parser.add_argument("--fillers", type=int, default=300, help="words shared by every intent")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--min-score", type=float, default=0.3)
+    parser.add_argument("--lr-max-iter", type=int, default=200)
+    parser.add_argument("--skip-classifier", action="store_true", help="only benchmark retrieval")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+
+    from app.retrieval import PatternIndex
+
+    document, filler, unseen = synthesize(args.patterns, args.intents, args.topic_words, args.fillers, args.seed)
+    queries, gibberish = make_queries(document, filler, unseen, args.queries, args.seed)
+    texts = [text for text, _ in queries]
+    expected = [tag for _, tag in queries]
+
+    started = time.perf_counter()
+    index = PatternIndex(document, min_score=args.min_score)
+    print(f"retrieval: indexed {args.patterns} patterns in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+    engines = {"retrieval": index.predict_tags}
+
+    if not args.skip_classifier:
+        # Same pipeline as models/model.pkl (app.train batch mode)
+        pairs = [(pattern, intent["tag"]) for intent in document["intents"] for pattern in intent["patterns"]]
+        started = time.perf_counter()
+        vectorizer = TfidfVectorizer()
+        model = LogisticRegression(max_iter=args.lr_max_iter)
+        model.fit(vectorizer.fit_transform([p for p, _ in pairs]), [t for _, t in pairs])
+        print(f"classifier: trained on {len(pairs)} patterns in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        engines["classifier"] = lambda items: list(model.predict(vectorizer.transform(items)))
+
+    results = {}
+    for name, predict_tags in engines.items():
+        results[f"{name}_single"] = measure(lambda text: predict_tags([text]), texts, args.warmup)
+        results[f"{name}_batch[{args.batch_size}]"] = measure(predict_tags, batches(texts, args.batch_size), args.warmup)
+        predicted = predict_tags(texts)
+        rejected = predict_tags(gibberish)
+        accuracy = sum(p == e for p, e in zip(predicted, expected)) / len(expected)
+        # The classifier has no notion of "no match", so it answers every gibberish query
+        fallback_rate = sum(tag is None for tag in rejected) / len(rejected)
+        print(f"{name}: accuracy {accuracy:.3f}, gibberish fallback {fallback_rate:.3f}", file=sys.stderr)
+        results[f"{name}_single"].update(accuracy=accuracy, gibberish_fallback=fallback_rate)
+
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "threshold")}
+    document = write_results(args.output, "retrieval", params, results) if args.output else {"results": results}
+    sys.exit(report(document, args.baseline, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Shared helpers for the benchmark scripts: latency summaries, JSON result
+# files and baseline comparison.
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics compared against a baseline, and which direction is a regression
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    summary = {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+    }
+    if elapsed is not None:
+        summary["errors"] = errors
+        summary["elapsed_s"] = elapsed
+        summary["throughput_rps"] = len(latencies) / elapsed if elapsed else 0.0
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, suite, params, results):
+    document = {
+        "suite": suite,
+        "revision": git_revision(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+    return document
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(current, baseline, threshold=0.2):
+    # Returns one line per metric that got worse by more than threshold (a fraction)
+    regressions = []
+    for name, result in current["results"].items():
+        previous = baseline["results"].get(name)
+        if not previous:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if metric not in result or not previous.get(metric):
+                continue
+            change = (result[metric] - previous[metric]) / previous[metric]
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > threshold:
+                regressions.append(
+                    f"{name} {metric}: {previous[metric]:.3f} -> {result[metric]:.3f} ({change:+.0%} worse)"
+                )
+    return regressions
+
+
+def report(document, baseline_path=None, threshold=0.2):
+    # Prints a table of results; returns the exit code (1 if regressions were found)
+    print(f"{'benchmark':<28}{'count':>8}{'rps':>12}{'p50':>12}{'p95':>12}{'p99':>12}{'errors':>8}")
+    for name, result in document["results"].items():
+        print(
+            f"{name:<28}{result['count']:>8}{result.get('throughput_rps', 0):>12.1f}"
+            f"{result['p50_ms']:>10.3f}ms{result['p95_ms']:>10.3f}ms{result['p99_ms']:>10.3f}ms{result.get('errors', 0):>8}"
+        )
+    if not baseline_path:
+        return 0
+    regressions = compare(document, load_results(baseline_path), threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%} against {baseline_path}")
+    return 1 if regressions else 0
+
@@ -0,0 +1,23 @@
+# Compares two benchmark result files and flags regressions.
+#
+#   python benchmarks/compare.py baseline.json current.json --threshold 0.2
+#
+# Exits with status 1 when any latency percentile or throughput got worse by
+# more than the threshold, so it can gate a release.
+import argparse
+import sys
+
+from common import load_results, report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction")
+    args = parser.parse_args()
+    sys.exit(report(load_results(args.current), args.baseline, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Synthetic dataset generator for the load benchmarks.
+#
+# Writes users, chats with N messages, projects and images straight into the
+# database configured by DATABASE_URL, so import it only after that is set.
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.api import Blob, Chat, Image, Message, Project, SessionLocal, User, create_access_token, store_image
+from app.hashing import get_password_hash
+from app.storage import write_temp
+from common import ROOT
+
+PASSWORD = "bench-password"
+WORDS = ["project", "deadline", "python", "model", "search", "image", "report", "meeting", "budget", "travel", "recipe", "music"]
+
+
+def load_phrases():
+    with open(os.path.join(ROOT, "data", "intents.json")) as f:
+        intents = json.load(f)["intents"]
+    return [pattern for intent in intents for pattern in intent["patterns"]]
+
+
+def sentence(rng, phrases):
+    return f"{rng.choice(phrases)} {' '.join(rng.choices(WORDS, k=rng.randint(2, 8)))}"
+
+
+def generate(users=10, chats_per_user=20, messages_per_chat=50, projects_per_user=5, images_per_user=10, seed=0):
+    # Returns everything the load generator needs: credentials, tokens and ids
+    rng = random.Random(seed)
+    phrases = load_phrases()
+    prefix = f"bench{seed}_{rng.randrange(16 ** 6):06x}"
+    hashed = get_password_hash(PASSWORD)
+    start = datetime.utcnow() - timedelta(days=30)
+    db = SessionLocal()
+    dataset = {"users": []}
+    try:
+        for u in range(users):
+            user = User(username=f"{prefix}_{u}", email=f"{prefix}_{u}@bench.local", hashed_password=hashed)
+            db.add(user)
+            db.flush()
+            projects = [Project(name=f"Project {p}", description=sentence(rng, phrases), user_id=user.id, created_at=start) for p in range(projects_per_user)]
+            db.add_all(projects)
+            chats = [
+                Chat(user_id=user.id, created_at=start + timedelta(minutes=c),
+                     project_id=rng.choice(projects).id if projects and rng.random() < 0.5 else None)
+                for c in range(chats_per_user)
+            ]
+            db.add_all(chats)
+            db.flush()
+            rows = []
+            for chat in chats:
+                for seq in range(1, messages_per_chat + 1):
+                    rows.append({
+                        "chat_id": chat.id,
+                        "seq": seq,
+                        "role": "user" if seq % 2 else "ai",
+                        "content": sentence(rng, phrases),
+                        "timestamp": chat.created_at + timedelta(seconds=seq),
+                    })
+            if rows:
+                db.execute(insert(Message), rows)
+            db.commit()
+            if images_per_user:
+                # One real blob per user; the remaining rows share it like duplicate uploads do
+                tmp_path, sha256, size = write_temp(f"bench image {prefix} {u}".encode())
+                store_image(db, user, tmp_path, sha256, size, "bench.png", "image/png", None)
+                extra = images_per_user - 1
+                if extra:
+                    db.execute(insert(Image), [
+                        {"filename": f"bench_{i}.png", "path": db.get(Blob, sha256).path, "sha256": sha256, "user_id": user.id, "uploaded_at": start + timedelta(minutes=i)}
+                        for i in range(extra)
+                    ])
+                    db.query(Blob).filter(Blob.sha256 == sha256).update({Blob.ref_count: Blob.ref_count + extra}, synchronize_session=False)
+                    db.commit()
+            dataset["users"].append({
+                "id": user.id,
+                "username": user.username,
+                "password": PASSWORD,
+                "token": create_access_token({"sub": user.username}, expires_delta=timedelta(hours=6)),
+                "chat_ids": [chat.id for chat in chats],
+                "project_ids": [project.id for project in projects],
+            })
+    finally:
+        db.close()
+    dataset["phrases"] = phrases
+    dataset["words"] = WORDS
+    return dataset
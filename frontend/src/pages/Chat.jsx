@@ -5,12 +5,15 @@ import api from '../utils/api';
 const Chat = () => {
   const { id } = useParams();
   const [chats, setChats] = useState([]);
+  const [chatsCursor, setChatsCursor] = useState(null);
   const [currentChat, setCurrentChat] = useState(null);
   const [messages, setMessages] = useState([]);
+  const [messagesCursor, setMessagesCursor] = useState(null);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
   const wsRef = useRef(null);
   const messagesEndRef = useRef(null);
+  const keepScrollRef = useRef(false);
 
   useEffect(() => {
     fetchChats();
@@ -18,14 +21,17 @@ const Chat = () => {
 
   useEffect(() => {
     if (id && chats.length > 0) {
-      const chat = chats.find(c => c.id == id);
-      if (chat) setCurrentChat(chat);
+      // Chats past the first page aren't in the sidebar yet but can still be opened
+      const chat = chats.find(c => c.id == id) || { id: Number(id) };
+      if (chat.id !== currentChat?.id) setCurrentChat(chat);
     }
   }, [id, chats]);
 
   useEffect(() => {
     if (currentChat) {
-      setMessages(currentChat.messages || []);
+      setMessages([]);
+      setMessagesCursor(null);
+      fetchMessages(currentChat.id);
       connectWebSocket(currentChat.id);
     } else {
       if (wsRef.current) {
@@ -41,23 +47,45 @@ const Chat = () => {
   }, [currentChat]);
 
   useEffect(() => {
+    // Older messages are added above; stay where the user is reading
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
-  const fetchChats = async () => {
+  const fetchChats = async (cursor = null) => {
     try {
-      const response = await api.get('/chats');
-      setChats(response.data);
+      const response = await api.get('/chats', { params: cursor ? { cursor } : {} });
+      setChats(prev => (cursor ? [...prev, ...response.data.items] : response.data.items));
+      setChatsCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error fetching chats:', error);
     }
   };
 
+  // The newest page first; `before` pages back through older messages
+  const fetchMessages = async (chatId, before = null) => {
+    try {
+      const response = await api.get(`/chats/${chatId}`, { params: before ? { before } : {} });
+      if (before) {
+        keepScrollRef.current = true;
+        setMessages(prev => [...response.data.messages, ...prev]);
+      } else {
+        setMessages(response.data.messages);
+      }
+      setMessagesCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error fetching messages:', error);
+    }
+  };
+
   const createNewChat = async () => {
     try {
       const response = await api.post('/chats', {});
       const newChat = response.data;
-      setChats([...chats, newChat]);
+      setChats([newChat, ...chats]);
       setCurrentChat(newChat);
     } catch (error) {
       console.error('Error creating chat:', error);
@@ -79,6 +107,11 @@ const Chat = () => {
     };
     ws.onmessage = (event) => {
       const message = JSON.parse(event.data);
+      // Heartbeats keep the socket from being closed as idle
+      if (message.type === 'ping') {
+        ws.send(JSON.stringify({ type: 'pong' }));
+        return;
+      }
       setMessages(prev => [...prev, message]);
     };
     ws.onclose = () => {
@@ -130,6 +163,14 @@ const Chat = () => {
               </li>
             ))}
           </ul>
+          {chatsCursor && (
+            <button
+              onClick={() => fetchChats(chatsCursor)}
+              className="w-full mt-4 py-2 text-sm font-semibold text-blue-600 hover:text-blue-800"
+            >
+              Load more chats
+            </button>
+          )}
         </div>
 
         {/* Chat Interface */}
@@ -138,6 +179,16 @@ const Chat = () => {
             <>
               <div className="flex-1 overflow-y-auto p-6 bg-gradient-to-b from-gray-50 to-white">
                 <div className="space-y-6 max-w-4xl mx-auto">
+                  {messagesCursor && (
+                    <div className="text-center">
+                      <button
+                        onClick={() => fetchMessages(currentChat.id, messagesCursor)}
+                        className="text-sm font-semibold text-blue-600 hover:text-blue-800"
+                      >
+                        Load older messages
+                      </button>
+                    </div>
+                  )}
                   {messages.map((msg, index) => (
                     <div
                       key={index}
@@ -4,6 +4,7 @@ import api from '../utils/api';
 const Images = () => {
   const [prompt, setPrompt] = useState('');
   const [images, setImages] = useState([]);
+  const [cursor, setCursor] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
 
@@ -11,10 +12,12 @@ const Images = () => {
     fetchImages();
   }, []);
 
-  const fetchImages = async () => {
+  // Without a cursor the gallery restarts from the newest page
+  const fetchImages = async (nextCursor = null) => {
     try {
-      const response = await api.get('/images');
-      setImages(response.data);
+      const response = await api.get('/images', { params: nextCursor ? { cursor: nextCursor } : {} });
+      setImages(prev => (nextCursor ? [...prev, ...response.data.items] : response.data.items));
+      setCursor(response.data.next_cursor);
     } catch (err) {
       setError('Failed to fetch images');
     }
@@ -26,8 +29,16 @@ const Images = () => {
     setLoading(true);
     setError('');
     try {
-      await api.post('/images/generate', { prompt });
+      const response = await api.post('/images/generate', { prompt });
       setPrompt('');
+      // Generation runs in the background; long-poll the job until it finishes
+      let job = response.data;
+      while (job.status !== 'succeeded' && job.status !== 'failed') {
+        job = (await api.get(`/images/jobs/${job.job_id}`, { params: { wait: 10 } })).data;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
       fetchImages();
     } catch (err) {
       setError('Failed to generate image');
@@ -38,7 +49,7 @@ const Images = () => {
 
   const handleDownload = (image) => {
     const link = document.createElement('a');
-    link.href = `http://localhost:5000/uploads/${image.filename}`;
+    link.href = `${api.defaults.baseURL}${image.url}`;
     link.download = image.filename;
     link.click();
   };
@@ -75,7 +86,8 @@ const Images = () => {
         {images.map((image) => (
           <div key={image.id} className="bg-white rounded-lg shadow-md overflow-hidden">
             <img
-              src={`http://localhost:5000/uploads/${image.filename}`}
+              src={`${api.defaults.baseURL}${image.thumbnail_url || image.url}`}
+              loading="lazy"
               alt={image.filename}
               className="w-full h-48 object-cover"
             />
@@ -92,6 +104,17 @@ const Images = () => {
         ))}
       </div>
 
+      {cursor && (
+        <div className="text-center mt-8">
+          <button
+            onClick={() => fetchImages(cursor)}
+            className="px-6 py-2 bg-blue-500 text-white rounded-lg hover:bg-blue-600"
+          >
+            Load more
+          </button>
+        </div>
+      )}
+
       {images.length === 0 && !loading && (
         <p className="text-center text-gray-500 mt-8">No images yet. Generate your first image!</p>
       )}
@@ -3,6 +3,7 @@ import api from '../utils/api';
 
 const Projects = () => {
   const [projects, setProjects] = useState([]);
+  const [cursor, setCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [showCreateForm, setShowCreateForm] = useState(false);
@@ -17,7 +18,8 @@ const Projects = () => {
     try {
       setLoading(true);
       const response = await api.get('/projects');
-      setProjects(response.data);
+      setProjects(response.data.items);
+      setCursor(response.data.next_cursor);
     } catch (err) {
       setError('Failed to fetch projects');
     } finally {
@@ -25,6 +27,16 @@ const Projects = () => {
     }
   };
 
+  const fetchMoreProjects = async () => {
+    try {
+      const response = await api.get('/projects', { params: { cursor } });
+      setProjects(prev => [...prev, ...response.data.items]);
+      setCursor(response.data.next_cursor);
+    } catch (err) {
+      setError('Failed to fetch projects');
+    }
+  };
+
   const handleCreate = () => {
     setFormData({ name: '', description: '' });
     setEditingProject(null);
@@ -159,6 +171,17 @@ const Projects = () => {
         ))}
       </div>
 
+      {cursor && (
+        <div className="text-center mt-6">
+          <button
+            onClick={fetchMoreProjects}
+            className="bg-blue-500 hover:bg-blue-700 text-white font-bold py-2 px-4 rounded"
+          >
+            Load more
+          </button>
+        </div>
+      )}
+
       {projects.length === 0 && (
         <p className="text-center text-gray-500 mt-6">No projects found. Create your first project!</p>
       )}
@@ -0,0 +1,54 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from app import archive
+
+SCHEMA = [
+    "CREATE TABLE chats (id INTEGER PRIMARY KEY, user_id INTEGER, project_id INTEGER, created_at DATETIME, archived_at DATETIME, restored_at DATETIME)",
+    "CREATE TABLE messages (id INTEGER PRIMARY KEY, chat_id INTEGER, seq INTEGER, role TEXT, content TEXT, timestamp DATETIME)",
+    """CREATE TABLE chat_archives (
+        chat_id INTEGER PRIMARY KEY, segment TEXT, byte_offset INTEGER, byte_length INTEGER, message_count INTEGER,
+        last_seq INTEGER, last_role TEXT, last_preview TEXT, last_timestamp DATETIME, archived_at DATETIME
+    )""",
+]
+
+
+def disk_usage(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    old = datetime.utcnow() - timedelta(days=365)
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+        for chat_id in range(1, 11):
+            conn.execute(text("INSERT INTO chats (id, user_id, created_at) VALUES (:id, 1, :old)"), {"id": chat_id, "old": old})
+            conn.execute(
+                text("INSERT INTO messages (chat_id, seq, role, content, timestamp) VALUES (:chat_id, :seq, 'user', :content, :old)"),
+                [{"chat_id": chat_id, "seq": seq, "content": f"chat {chat_id} message {seq} " * 20, "old": old} for seq in range(1, 21)],
+            )
+    return engine
+
+
+def test_compaction_reports_the_space_it_frees(engine):
+    assert archive.archive_idle_chats(engine, idle_days=1)["chats"] == 10
+    for chat_id in range(1, 9):
+        archive.restore_chat(engine, chat_id)
+
+    total = 0
+    for _ in range(3):
+        before = disk_usage(archive.ARCHIVE_DIR)
+        report = archive.compact_segments(engine)
+        assert report["reclaimed_bytes"] == before - disk_usage(archive.ARCHIVE_DIR)
+        total += report["reclaimed_bytes"]
+    assert total > 0
+    # Later passes have nothing left to reclaim
+    assert report == {"removed": 0, "rewritten": 0, "reclaimed_bytes": 0}
+    assert sorted(archive.load_archived(engine, [9, 10])) == [9, 10]